@@ -0,0 +1,182 @@
+# asgi.py
+"""
+asyncio entry point for the Square webhook pipeline.
+
+    cd xero_app
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Webhooks are validated, de-duplicated and queued exactly like the Flask
+route (routes/square_routes.py), but the queue is drained by
+ASYNC_CONCURRENCY coroutines running services/async_sync.py, so one process
+keeps many Square/Xero round-trips in flight instead of one per thread.
+"""
+import asyncio, json, time
+from services import event_queue, webhook_gate
+from services.event_dedupe import get_deduper
+from services.async_sync import handle_event_async, close_async_xero
+from services.token_refresher import start_token_refresher
+from services.contact_mirror import start_contact_mirror
+from utils import metrics
+from utils.log import get_logger, bind, event_fields
+from config import ASYNC_CONCURRENCY, QUEUE_POLL_INTERVAL
+
+log = get_logger(__name__)
+_wakeup = None  # asyncio.Event, created on lifespan startup
+_tasks = []
+
+
+async def process_one():
+    """Claim and process a single event. Returns False when the queue is empty."""
+    claimed = await asyncio.to_thread(event_queue.claim)
+    if not claimed:
+        return False
+
+    row_id, token, event, attempts = claimed
+    with bind(event):
+        started = time.perf_counter()
+        try:
+            with metrics.track_event(event.get("type")):
+                await handle_event_async(event)
+        except event_queue.RetryLater as e:
+            log.info("event deferred", attempt=attempts, reason=str(e), duration_ms=_ms_since(started))
+            await asyncio.to_thread(event_queue.defer, row_id, token, str(e))
+        except Exception as e:
+            log.error("event failed", attempt=attempts, error=str(e), duration_ms=_ms_since(started))
+            await asyncio.to_thread(event_queue.nack, row_id, token, str(e))
+        else:
+            log.info("event handled", attempt=attempts, duration_ms=_ms_since(started))
+            await asyncio.to_thread(event_queue.ack, row_id, token)
+    return True
+
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+async def _run():
+    while True:
+        try:
+            if await process_one():
+                continue
+        except Exception:
+            log.exception("queue worker error")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), QUEUE_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def _startup():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    _tasks.extend(asyncio.create_task(_run()) for _ in range(ASYNC_CONCURRENCY))
+    start_token_refresher()
+    start_contact_mirror()
+    log.info("async workers started", concurrency=ASYNC_CONCURRENCY)
+
+
+async def _shutdown():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    await close_async_xero()
+
+
+# --- HTTP ------------------------------------------------------------------
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send(send, status, body, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status, payload):
+    await _send(send, status, json.dumps(payload).encode(), "application/json")
+
+
+def _url(scope):
+    headers = dict(scope["headers"])
+    host = headers.get(b"host", b"").decode() or "%s:%d" % tuple(scope["server"])
+    return f"{scope['scheme']}://{host}{scope['path']}"
+
+
+async def _rejected(send, event_type, rejection):
+    if rejection == "ignored":
+        metrics.WEBHOOK_REQUESTS.labels(type="other", outcome="ignored").inc()
+        return await _send_json(send, 200, {"status": "ignored"})
+    metrics.WEBHOOK_REQUESTS.labels(type="unknown", outcome=rejection).inc()
+    if rejection == "forged":
+        log.warning("webhook signature rejected", event_type=event_type)
+        return await _send_json(send, 401, {"error": "invalid_signature"})
+    await _send_json(send, 400, {"error": "invalid_event"})
+
+
+async def square_webhook(scope, receive, send):
+    raw = await _read_body(receive)
+    signature = dict(scope["headers"]).get(webhook_gate.SIGNATURE_HEADER.encode(), b"").decode() or None
+    event_type, event_id, rejection = webhook_gate.screen(raw, signature, _url(scope))
+    if rejection:
+        return await _rejected(send, event_type, rejection)
+
+    deduper = get_deduper()
+    if await asyncio.to_thread(deduper.is_duplicate, event_id):
+        metrics.WEBHOOK_REQUESTS.labels(type=event_type, outcome="duplicate").inc()
+        return await _send_json(send, 200, {"status": "duplicate"})
+
+    event, rejection = webhook_gate.decode(raw)
+    if rejection:
+        await asyncio.to_thread(deduper.forget, event_id)  # a corrected redelivery with this event_id must still get through
+        return await _rejected(send, event_type, rejection)
+
+    log.info("webhook received", **event_fields(event.body))
+
+    try:
+        await asyncio.to_thread(event_queue.enqueue_webhook, event.body, event.raw)
+    except Exception:
+        await asyncio.to_thread(deduper.forget, event_id)
+        metrics.WEBHOOK_REQUESTS.labels(type=event.type, outcome="error").inc()
+        raise
+    metrics.WEBHOOK_REQUESTS.labels(type=event.type, outcome="queued").inc()
+    _wakeup.set()
+
+    await _send_json(send, 200, {"status": "ok"})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await _startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await _shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    route = (scope["method"], scope["path"])
+    if route == ("POST", "/square-webhook"):
+        await square_webhook(scope, receive, send)
+    elif route == ("GET", "/healthz"):
+        await _send_json(send, 200, {"status": "ok"})
+    elif route == ("GET", "/metrics"):
+        await _send(send, 200, *metrics.render())
+    else:
+        await _send_json(send, 404, {"error": "not_found"})
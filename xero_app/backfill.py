@@ -0,0 +1,176 @@
+# backfill.py
+"""
+Sync a date range of historical Square orders into Xero.
+
+    cd xero_app
+    python backfill.py --start 2025-01-01 --end 2025-02-01 --workers 4
+
+Orders are streamed page by page through orders.search cursor pagination
+(only one page is held in memory). Each page is synced in parallel, at
+backfill priority under the shared Xero rate limiter. The cursor is
+checkpointed once a page is done, so after a crash the same command resumes
+from the last unfinished page. Orders the sync ledger already has are skipped.
+Invoices are dated by each order's created_at (in MERCHANT_TIMEZONE), not the day of the run.
+Orders that fail are kept in the checkpoint and retried first on the next run;
+the range only counts as complete once none are left.
+"""
+import argparse, json, os, time
+from concurrent.futures import ThreadPoolExecutor
+from services.square_service import client, get_customers, get_orders, READ_OPTIONS, square_breaker
+from services.sync_service import sync_order
+from services.xero_rate_limiter import backfill_priority
+from services.token_refresher import start_token_refresher
+from services import sync_ledger, tenants
+from config import SQUARE_LOCATION_ID
+
+
+def iter_order_pages(location_ids, start_at, end_at, cursor=None, page_size=100):
+    """Yield (orders, next_cursor) for every page of orders created in [start_at, end_at)."""
+    while True:
+        resp = square_breaker.call(
+            client.orders.search,
+            location_ids=location_ids,
+            cursor=cursor,
+            limit=page_size,
+            query={
+                "filter": {"date_time_filter": {"created_at": {"start_at": start_at, "end_at": end_at}}},
+                "sort": {"sort_field": "CREATED_AT", "sort_order": "ASC"},
+            },
+            request_options=READ_OPTIONS,
+        )
+        cursor = getattr(resp, "cursor", None)
+        yield resp.orders or [], cursor
+        if not cursor:
+            return
+
+
+def load_checkpoint(path, start_at, end_at):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("start_at") != start_at or data.get("end_at") != end_at:
+        print(f"⚠️ Checkpoint {path} is for a different range — starting from the beginning")
+        return None
+    return data
+
+
+def save_checkpoint(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _sync_one(order):
+    """Returns 'synced', 'skipped' or 'failed'."""
+    if sync_ledger.is_synced(order.id):
+        return "skipped"
+    try:
+        with backfill_priority(), tenants.use_tenant(tenants.tenant_for(location_id=getattr(order, "location_id", None))):
+            return "synced" if sync_order(order) else "skipped"
+    except Exception as e:
+        print(f"❌ Order {order.id} failed:", e)
+        return "failed"
+
+
+def _sync_page(pool, orders, state):
+    """Sync one batch of orders, adding failures to state["failed_ids"]."""
+    # Warm the customer cache for the whole page in one bulk call
+    try:
+        get_customers([getattr(o, "customer_id", None) for o in orders])
+    except Exception as e:
+        print("⚠️ Bulk customer fetch failed:", e)
+
+    for order, result in zip(orders, pool.map(_sync_one, orders)):
+        if result == "failed":
+            state["failed_ids"].append(order.id)
+        else:
+            state[result] += 1
+    state["failed"] = len(state["failed_ids"])
+
+
+def _retry_failed(pool, state):
+    """Re-sync the orders that failed on an earlier run."""
+    ids = state["failed_ids"]
+    print(f"🔁 Retrying {len(ids)} previously failed orders")
+    found = get_orders(ids)
+    for order_id in ids:
+        if order_id not in found:
+            print(f"⚠️ Order {order_id} no longer exists in Square — dropping it")
+    state["failed_ids"] = []
+    _sync_page(pool, [found[i] for i in ids if i in found], state)
+
+
+def run(start_at, end_at, location_ids, workers, checkpoint_path, page_size):
+    state = load_checkpoint(checkpoint_path, start_at, end_at) or {
+        "start_at": start_at, "end_at": end_at, "cursor": None, "done": False,
+        "synced": 0, "skipped": 0, "failed": 0,
+    }
+    state.setdefault("failed_ids", [])
+    state.setdefault("pages_done", state["done"])  # checkpoints written before failed orders were kept
+    if state["done"]:
+        print("✅ Backfill already complete for this range")
+        return state
+    if state["cursor"] or state["pages_done"]:
+        print("↩️ Resuming from checkpoint")
+
+    start_token_refresher()  # long runs outlive a 30-minute access token
+    t0 = time.perf_counter()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if state["failed_ids"]:
+            processed += len(state["failed_ids"])
+            _retry_failed(pool, state)
+            save_checkpoint(checkpoint_path, state)
+
+        pages = () if state["pages_done"] else iter_order_pages(location_ids, start_at, end_at, state["cursor"], page_size)
+        for orders, next_cursor in pages:
+            _sync_page(pool, orders, state)
+            processed += len(orders)
+
+            state["cursor"] = next_cursor
+            state["pages_done"] = next_cursor is None
+            save_checkpoint(checkpoint_path, state)
+
+            elapsed = time.perf_counter() - t0
+            print(
+                f"📄 {processed} orders ({processed / elapsed:.1f} orders/s) — "
+                f"synced {state['synced']}, skipped {state['skipped']}, failed {state['failed']}"
+            )
+
+    state["done"] = state["pages_done"] and not state["failed_ids"]
+    save_checkpoint(checkpoint_path, state)
+    elapsed = time.perf_counter() - t0
+    print(f"🏁 Backfill finished: {processed} orders in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.1f} orders/s)")
+    if state["failed_ids"]:
+        print(f"⚠️ {len(state['failed_ids'])} orders failed — run the same command again to retry them")
+    return state
+
+
+def _rfc3339(day: str) -> str:
+    return day if "T" in day else f"{day}T00:00:00Z"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical Square orders into Xero")
+    parser.add_argument("--start", required=True, help="created_at lower bound (YYYY-MM-DD or RFC 3339)")
+    parser.add_argument("--end", required=True, help="created_at upper bound, exclusive")
+    parser.add_argument("--location", action="append", help="Square location ID (repeatable); defaults to SQUARE_LOCATION_ID")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    args = parser.parse_args()
+
+    run(
+        start_at=_rfc3339(args.start),
+        end_at=_rfc3339(args.end),
+        location_ids=args.location or [SQUARE_LOCATION_ID],
+        workers=args.workers,
+        checkpoint_path=args.checkpoint,
+        page_size=args.page_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Xero API calls per order with and without invoice micro-batching.
+
+Simulates a busy hour: `--orders` invoice creations arriving from `--workers`
+concurrent threads against a fake Invoices endpoint with `--latency-ms` of
+round-trip time. Prints POSTs per order and wall time for each mode.
+
+    cd xero_app && python -m benchmarks.bench_invoice_batching --orders 300 --workers 8 --window 0.2
+"""
+import argparse, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.invoice_batcher import InvoiceBatcher
+
+
+class _FakeResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, invoices):
+        self._invoices = invoices
+
+    def json(self):
+        return {"Invoices": self._invoices}
+
+
+class FakeInvoicesEndpoint:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, payload, params=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return _FakeResponse([
+            {**inv, "InvoiceID": f"inv-{inv['InvoiceNumber']}", "StatusAttributeString": "OK"}
+            for inv in payload["Invoices"]
+        ])
+
+
+def _invoice(i):
+    return {"Type": "ACCREC", "InvoiceNumber": f"SQUARE - {i}", "LineItems": []}
+
+
+def run(orders, workers, latency, window, max_size):
+    endpoint = FakeInvoicesEndpoint(latency)
+    if window > 0:
+        batcher = InvoiceBatcher(endpoint.post, window=window, max_size=max_size)
+        create = lambda i: batcher.submit(_invoice(i)).result()
+    else:
+        create = lambda i: endpoint.post({"Invoices": [_invoice(i)]})
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(create, range(orders)))
+    return endpoint.calls, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--window", type=float, default=0.2)
+    parser.add_argument("--max-size", type=int, default=50)
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    base_calls, base_time = run(args.orders, args.workers, latency, 0, args.max_size)
+    batch_calls, batch_time = run(args.orders, args.workers, latency, args.window, args.max_size)
+
+    print(f"{args.orders} orders, {args.workers} workers, {args.latency_ms:.0f} ms per POST")
+    print(f"one POST per order : {base_calls:5d} calls  {base_calls / args.orders:.3f} calls/order  {base_time:6.2f} s")
+    print(f"batched ({args.window:.2f}s window): {batch_calls:5d} calls  {batch_calls / args.orders:.3f} calls/order  {batch_time:6.2f} s")
+    print(f"API calls saved: {(1 - batch_calls / base_calls) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Retried order syncs against a Xero that loses responses.
+
+Points the sync pipeline at the stand-ins in benchmarks/fakes.py, with Xero
+applying a share of POSTs and then answering 503 anyway (--lost-response-rate),
+and handles each order.created event until it succeeds, the way the queue's
+nack / retry would. Checks that every order ended up with exactly one
+"SQUARE - <order_id>" invoice and every customer with at most one contact.
+Prints attempts and Xero calls per order; exits non-zero if a check fails.
+
+    cd xero_app && python -m benchmarks.bench_sync_retries --orders 50 --lost-response-rate 0.3
+    cd xero_app && python -m benchmarks.bench_sync_retries --pipeline async
+"""
+import argparse, asyncio, json, os, sys, tempfile, time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSquare, FakeXero, catalog_snapshot
+
+
+def _configure_env(args, tmp, square, xero):
+    """Point every outbound URL and local file at the stand-ins / a temp dir, before config is imported."""
+    tokens_file = os.path.join(tmp, "xero_tokens.json")
+    with open(tokens_file, "w") as f:
+        json.dump({"tokens": {"access_token": "bench", "refresh_token": "bench", "expires_in": 86400},
+                   "tenant_id": "bench-tenant", "obtained_at": int(time.time())}, f)
+    snapshot = os.path.join(tmp, "catalog_snapshot.json")
+    with open(snapshot, "w") as f:
+        json.dump(catalog_snapshot(), f)
+
+    db = lambda name: os.path.join(tmp, name)
+    os.environ.update({
+        "SQUARE_BASE_URL": square.url,
+        "XERO_API_URL": xero.url,
+        "SQUARE_SANDBOX_ACCESS_TOKEN": "bench",
+        "TOKENS_FILE": tokens_file,
+        "CATALOG_SNAPSHOT_FILE": snapshot,
+        "EVENT_QUEUE_DB": db("event_queue.db"),
+        "CUSTOMER_CACHE_DB": db("event_queue.db"),
+        "CONTACT_INDEX_DB": db("contact_index.db"),
+        "CONTACT_MIRROR_DB": db("contact_mirror.db"),
+        "SYNC_LEDGER_DB": db("sync_ledger.db"),
+        "XERO_RATE_DB": db("xero_rate.db"),
+        "XERO_INVOICE_BATCH_WINDOW": str(args.batch_window),
+        "BREAKER_FAILURE_THRESHOLD": "1000000",  # the lost responses are the point; don't fail fast on them
+        "HTTP_BACKOFF_BASE": "0.01",
+        "HTTP_BACKOFF_CAP": "0.05",
+    })
+
+
+def _order_event(order_id):
+    return {
+        "type": "order.created",
+        "event_id": f"evt-{order_id}",
+        "data": {"type": "order_created", "id": order_id,
+                 "object": {"order_created": {"order_id": order_id, "state": "OPEN"}}},
+    }
+
+
+def _run_sync(events, attempts):
+    from services.sync_service import handle_event
+
+    used = []
+    for event in events:
+        for attempt in range(1, attempts + 1):
+            try:
+                handle_event(event)
+            except Exception:
+                continue
+            used.append(attempt)
+            break
+    return used
+
+
+def _run_async(events, attempts):
+    from services.async_sync import handle_event_async, close_async_xero
+
+    async def run():
+        used = []
+        for event in events:
+            for attempt in range(1, attempts + 1):
+                try:
+                    await handle_event_async(event)
+                except Exception:
+                    continue
+                used.append(attempt)
+                break
+        await close_async_xero()
+        return used
+
+    return asyncio.run(run())
+
+
+def run(args):
+    square = FakeSquare(customers=args.customers).start()
+    xero = FakeXero(lost_response_rate=args.lost_response_rate).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _configure_env(args, tmp, square, xero)
+        order_ids = [f"RETRY-ORDER-{int(time.time())}-{i}" for i in range(args.orders)]
+        events = [_order_event(order_id) for order_id in order_ids]
+        used = (_run_async if args.pipeline == "async" else _run_sync)(events, args.attempts)
+
+    invoices = Counter(inv.get("InvoiceNumber") for inv in xero.invoices.values())
+    contacts = Counter(c.get("AccountNumber") for c in xero.contacts.values())
+    duplicate_invoices = sum(n - 1 for n in invoices.values() if n > 1)
+    duplicate_contacts = sum(n - 1 for n in contacts.values() if n > 1)
+    missing = sum(1 for order_id in order_ids if invoices[f"SQUARE - {order_id}"] == 0)
+
+    ok = duplicate_invoices == 0 and duplicate_contacts == 0 and missing == 0
+    print(
+        f"{args.pipeline} pipeline, {args.orders} orders, lost-response rate {args.lost_response_rate:.2f}: "
+        f"{sum(used) / max(len(used), 1):.2f} attempts/order, {xero.total_calls() / args.orders:.2f} Xero calls/order  |  "
+        f"duplicate invoices {duplicate_invoices}, duplicate contacts {duplicate_contacts}, not invoiced {missing}  "
+        f"{'ok' if ok else 'FAILED'}"
+    )
+    square.shutdown()
+    xero.shutdown()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pipeline", choices=["sync", "async"], default="sync")
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--lost-response-rate", type=float, default=0.3)
+    parser.add_argument("--attempts", type=int, default=20, help="handler runs per event before giving up")
+    parser.add_argument("--batch-window", type=float, default=0.0)
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Token store backends under contention (services/token_store.py).
+
+Starts `--writers` processes per backend (file, sqlite, and redis against the
+FakeRedis stand-in in benchmarks/fakes.py). Each one:
+
+  cas   – increments a counter in the shared document `--rounds` times with
+          read / compare_and_swap retry loops (what token_service._update does)
+  lock  – takes lock("refresh") `--rounds` times and logs entering / leaving
+
+and checks that no increment was lost and no two writers were ever inside the
+lock at once. Prints CAS throughput and conflict rate per backend; exits
+non-zero if a check fails.
+
+    cd xero_app && python -m benchmarks.bench_token_store --writers 4 --rounds 200
+"""
+import argparse, multiprocessing, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeRedis
+from services.token_store import FileTokenStore, SQLiteTokenStore, RedisTokenStore
+
+LOCK_TTL = 10
+
+
+def _cas_writer(make_store, rounds, conflicts):
+    store = make_store()
+    for _ in range(rounds):
+        while True:
+            data, version = store.read()
+            if store.compare_and_swap(version, {**data, "count": data.get("count", 0) + 1}):
+                break
+            with conflicts.get_lock():
+                conflicts.value += 1
+
+
+def _lock_writer(make_store, rounds, log_path):
+    store = make_store()
+    for _ in range(rounds):
+        with store.lock("refresh", LOCK_TTL) as acquired:
+            if not acquired:
+                continue
+            with open(log_path, "a") as log:
+                log.write(f"+{os.getpid()}\n")
+                log.flush()
+                time.sleep(0.0005)
+                log.write(f"-{os.getpid()}\n")
+
+
+def _run_writers(target, writers, *args):
+    procs = [multiprocessing.Process(target=target, args=args) for _ in range(writers)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return time.perf_counter() - t0
+
+
+def _overlaps(log_path):
+    """Times a writer entered the lock while another one held it."""
+    holder, overlaps = None, 0
+    with open(log_path) as f:
+        for line in f:
+            pid = line[1:].strip()
+            if line.startswith("+"):
+                overlaps += holder is not None
+                holder = pid
+            elif holder == pid:
+                holder = None
+    return overlaps
+
+
+def bench(name, make_store, writers, rounds, workdir):
+    conflicts = multiprocessing.Value("i", 0)
+    cas_time = _run_writers(_cas_writer, writers, make_store, rounds, conflicts)
+    count = make_store().read()[0].get("count", 0)
+
+    log_path = os.path.join(workdir, f"{name}.lock.log")
+    lock_time = _run_writers(_lock_writer, writers, make_store, rounds, log_path)
+    overlaps = _overlaps(log_path)
+
+    expected = writers * rounds
+    ok = count == expected and overlaps == 0
+    print(
+        f"{name:7s} cas {expected / cas_time:8.0f} writes/s  {conflicts.value / expected:5.2f} conflicts/write  "
+        f"count {count}/{expected}  |  lock {expected / lock_time:7.0f} holds/s  overlaps {overlaps}  "
+        f"{'ok' if ok else 'FAILED'}"
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method("fork")  # writers inherit the store factories below
+    redis = FakeRedis().start()
+    with tempfile.TemporaryDirectory() as workdir:
+        backends = {
+            "file": lambda: FileTokenStore(os.path.join(workdir, "tokens.json")),
+            "sqlite": lambda: SQLiteTokenStore(os.path.join(workdir, "tokens.db")),
+            "redis": lambda: RedisTokenStore(redis.url, key="bench:xero_tokens"),
+        }
+        print(f"{args.writers} writer processes x {args.rounds} rounds per backend")
+        results = [bench(name, make, args.writers, args.rounds, workdir) for name, make in backends.items()]
+    redis.shutdown()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
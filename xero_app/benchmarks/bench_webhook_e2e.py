@@ -0,0 +1,279 @@
+"""
+End-to-end webhook throughput and latency against local Square/Xero stand-ins.
+
+Serves the real Flask blueprint (routes/square_routes.py) with its queue and
+background workers, points the Square SDK and the Xero client at the fakes in
+benchmarks/fakes.py, and fires synthetic order.created / payment.updated
+streams at a fixed (open-loop) rate. Reports, per event type:
+
+  ack  – POST /square-webhook response time (what Square sees)
+  e2e  – scheduled send → handler finished (Xero invoice written)
+
+as p50/p95/p99, plus throughput and outbound Square/Xero calls per event.
+Results are written as JSON (benchmarks/results/ by default); pass
+--compare OLD.json to print the change against an earlier run.
+
+    cd xero_app && python -m benchmarks.bench_webhook_e2e --orders 200 --rate 20 --xero-latency-ms 80
+"""
+import argparse, json, os, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import FakeSquare, FakeXero, catalog_snapshot
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _percentiles(samples_ms):
+    if not samples_ms:
+        return {"count": 0}
+    s = sorted(samples_ms)
+    pick = lambda q: s[min(len(s) - 1, int(len(s) * q))]
+    return {"count": len(s), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": s[-1]}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _configure_env(args, tmp, square, xero):
+    """Point every outbound URL and every local file at the stand-ins / a temp dir, before config is imported."""
+    now = int(time.time())
+    tokens_file = os.path.join(tmp, "xero_tokens.json")
+    with open(tokens_file, "w") as f:
+        json.dump({"tokens": {"access_token": "bench", "refresh_token": "bench", "expires_in": 86400},
+                   "tenant_id": "bench-tenant", "obtained_at": now}, f)
+    snapshot = os.path.join(tmp, "catalog_snapshot.json")
+    with open(snapshot, "w") as f:
+        json.dump(catalog_snapshot(), f)
+
+    db = lambda name: os.path.join(tmp, name)
+    os.environ.update({
+        "SQUARE_BASE_URL": square.url,
+        "XERO_API_URL": xero.url,
+        "SQUARE_SANDBOX_ACCESS_TOKEN": "bench",
+        "TOKENS_FILE": tokens_file,
+        "CATALOG_SNAPSHOT_FILE": snapshot,
+        "EVENT_QUEUE_DB": db("event_queue.db"),
+        "DEDUPE_DB": db("event_queue.db"),
+        "CUSTOMER_CACHE_DB": db("event_queue.db"),
+        "CONTACT_INDEX_DB": db("contact_index.db"),
+        "CONTACT_MIRROR_DB": db("contact_mirror.db"),
+        "SYNC_LEDGER_DB": db("sync_ledger.db"),
+        "XERO_RATE_DB": db("xero_rate.db"),
+        "WEBHOOK_WORKERS": str(args.workers),
+        "XERO_CALLS_PER_MINUTE": str(args.xero_rpm),
+        "PAYMENT_DEBOUNCE_SECONDS": str(args.payment_debounce),
+        "XERO_INVOICE_BATCH_WINDOW": str(args.batch_window),
+        "QUEUE_POLL_INTERVAL": "0.05",
+        "HTTP_BACKOFF_BASE": "0.05",
+        "HTTP_BACKOFF_CAP": "0.5",
+    })
+
+
+def _schedule(args):
+    """[(offset_seconds, event)] — orders at --rate, each followed by its payment(s) after --payment-lag."""
+    events = []
+    run_id = f"{int(time.time())}"
+    for i in range(args.orders):
+        order_id = f"BENCH-ORDER-{run_id}-{i}"
+        t = i / args.rate
+        events.append((t, {
+            "type": "order.created",
+            "event_id": f"evt-order-{run_id}-{i}",
+            "data": {"type": "order_created", "id": order_id,
+                     "object": {"order_created": {"order_id": order_id, "state": "OPEN"}}},
+        }))
+        for j in range(args.payments_per_order):
+            events.append((t + args.payment_lag * (j + 1), {
+                "type": "payment.updated",
+                "event_id": f"evt-payment-{run_id}-{i}-{j}",
+                "data": {"type": "payment", "id": f"pay-{i}",
+                         "object": {"payment": {
+                             "id": f"pay-{i}", "order_id": order_id, "status": "COMPLETED", "source_type": "CARD",
+                             "card_details": {"status": "CAPTURED", "card": {"card_brand": "VISA", "last_4": "4242"}},
+                         }}},
+            }))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def run(args):
+    square = FakeSquare(customers=args.customers, latency=args.square_latency_ms / 1000,
+                        error_rate=args.square_error_rate, rate_limit_rate=args.square_429_rate).start()
+    xero = FakeXero(latency=args.xero_latency_ms / 1000, error_rate=args.xero_error_rate,
+                    rate_limit_rate=args.xero_429_rate).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _configure_env(args, tmp, square, xero)
+
+        import requests
+        from flask import Flask
+        from werkzeug.serving import make_server
+        from routes.square_routes import square_bp
+        from services import event_queue, worker
+
+        # Time each event from its scheduled send to the end of its (first successful) handling
+        sent_at, done_at, failures = {}, {}, []
+        handle_event = worker.handle_event
+
+        def timed_handle_event(event):
+            try:
+                handle_event(event)
+            except Exception as e:
+                failures.append(str(e))
+                raise
+            done_at.setdefault(event["event_id"], time.perf_counter())
+
+        worker.handle_event = timed_handle_event
+
+        app = Flask(__name__)
+        app.register_blueprint(square_bp)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        webhook_url = f"http://127.0.0.1:{server.server_port}/square-webhook"
+
+        events = _schedule(args)
+        acks = {"order.created": [], "payment.updated": []}
+        bad_acks = []
+        session = requests.Session()
+
+        def fire(item):
+            offset, event = item
+            delay = t0 + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            scheduled = t0 + offset  # open loop: a slow ack doesn't delay the next send
+            sent_at[event["event_id"]] = (event["type"], scheduled)
+            r = session.post(webhook_url, json=event, timeout=30)
+            acks[event["type"]].append((time.perf_counter() - scheduled) * 1000)
+            if r.status_code != 200:
+                bad_acks.append(r.status_code)
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.senders) as pool:
+            list(pool.map(fire, events))
+        send_time = time.perf_counter() - t0
+
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            stats = event_queue.stats()
+            if not stats["pending"] and not stats["in_flight"]:
+                break
+            time.sleep(0.05)
+        total_time = time.perf_counter() - t0
+        stats = event_queue.stats()
+        server.shutdown()
+
+    e2e = {"order.created": [], "payment.updated": []}
+    for event_id, (event_type, scheduled) in sent_at.items():
+        if event_id in done_at:
+            e2e[event_type].append((done_at[event_id] - scheduled) * 1000)
+
+    n = len(events)
+    square.shutdown()
+    xero.shutdown()
+    return {
+        "events_sent": n,
+        "events_handled": len(done_at),
+        "events_coalesced": n - len(done_at) - stats["pending"] - stats["in_flight"] - stats["dead"],
+        "events_dead": stats["dead"],
+        "events_unfinished": stats["pending"] + stats["in_flight"],
+        "handler_failures": len(failures),
+        "bad_acks": len(bad_acks),
+        "send_seconds": send_time,
+        "total_seconds": total_time,
+        "ack_throughput": n / send_time if send_time else 0.0,
+        "processed_throughput": len(done_at) / total_time if total_time else 0.0,
+        "ack_latency_ms": {t: _percentiles(s) for t, s in acks.items()},
+        "e2e_latency_ms": {t: _percentiles(s) for t, s in e2e.items()},
+        "square_calls": dict(square.calls),
+        "xero_calls": dict(xero.calls),
+        "square_calls_per_event": square.total_calls() / n if n else 0.0,
+        "xero_calls_per_event": xero.total_calls() / n if n else 0.0,
+    }
+
+
+def _report(results):
+    print(f"{results['events_sent']} events: {results['events_handled']} handled, "
+          f"{results['events_coalesced']} coalesced, {results['events_dead']} dead, "
+          f"{results['events_unfinished']} unfinished, {results['bad_acks']} bad acks")
+    print(f"throughput: {results['ack_throughput']:.1f} acks/s, {results['processed_throughput']:.1f} processed/s")
+    for kind in ("ack_latency_ms", "e2e_latency_ms"):
+        for event_type, p in results[kind].items():
+            if p["count"]:
+                print(f"{kind[:3]:<4}{event_type:<17} p50 {p['p50']:8.1f} ms  p95 {p['p95']:8.1f} ms  "
+                      f"p99 {p['p99']:8.1f} ms  (n={p['count']})")
+    print(f"outbound per event: square {results['square_calls_per_event']:.2f}, xero {results['xero_calls_per_event']:.2f}")
+
+
+def _compare(old, new):
+    """Print headline metrics side by side with an earlier results file."""
+    rows = [
+        ("processed/s", lambda r: r["processed_throughput"]),
+        ("xero calls/event", lambda r: r["xero_calls_per_event"]),
+        ("square calls/event", lambda r: r["square_calls_per_event"]),
+    ]
+    for kind in ("ack_latency_ms", "e2e_latency_ms"):
+        for event_type in ("order.created", "payment.updated"):
+            for q in ("p50", "p99"):
+                rows.append((f"{kind[:3]} {event_type} {q}", lambda r, k=kind, t=event_type, q=q: r[k][t].get(q)))
+    print(f"\nvs {old.get('git_commit') or '?'} ({old.get('timestamp')})")
+    for label, get in rows:
+        a, b = get(old["results"]), get(new["results"])
+        if a is None or b is None:
+            continue
+        change = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+        print(f"  {label:<30} {a:10.2f} → {b:10.2f}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="order.created events per second")
+    parser.add_argument("--payments-per-order", type=int, default=1)
+    parser.add_argument("--payment-lag", type=float, default=0.5, help="seconds between an order and its payment event(s)")
+    parser.add_argument("--payment-debounce", type=float, default=0, help="PAYMENT_DEBOUNCE_SECONDS for the run")
+    parser.add_argument("--batch-window", type=float, default=0, help="XERO_INVOICE_BATCH_WINDOW for the run")
+    parser.add_argument("--workers", type=int, default=4, help="queue worker threads")
+    parser.add_argument("--senders", type=int, default=32, help="concurrent webhook senders")
+    parser.add_argument("--customers", type=int, default=50)
+    parser.add_argument("--xero-rpm", type=int, default=100000, help="rate limiter calls/minute (Xero's real limit is 60)")
+    parser.add_argument("--square-latency-ms", type=float, default=40)
+    parser.add_argument("--xero-latency-ms", type=float, default=80)
+    parser.add_argument("--square-error-rate", type=float, default=0)
+    parser.add_argument("--xero-error-rate", type=float, default=0)
+    parser.add_argument("--square-429-rate", type=float, default=0)
+    parser.add_argument("--xero-429-rate", type=float, default=0)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--out", help="results file (default: benchmarks/results/webhook_e2e-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    results = run(args)
+    record = {
+        "benchmark": "webhook_e2e",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "params": vars(args),
+        "results": results,
+    }
+    _report(results)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"webhook_e2e-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(record, f, indent=2)
+    print(f"📝 Results written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(json.load(f), record)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Per-call latency: module-level requests.get (new TCP+TLS handshake every call)
+vs the pooled keep-alive Session used by XeroClient.
+
+Runs against a local HTTPS stand-in with a throwaway self-signed cert (needs `openssl`).
+
+    cd xero_app && python -m benchmarks.bench_xero_client --calls 200
+"""
+import argparse, os, ssl, statistics, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from utils.http import build_session
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = b'{"Contacts": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _self_signed_cert(tmp):
+    cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def start_https_server(tmp):
+    cert, key = _self_signed_cert(tmp)
+    server = ThreadingHTTPServer(("localhost", 0), _Handler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert
+
+
+def _time_calls(fn, calls):
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        fn().raise_for_status()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<28} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server, cert = start_https_server(tmp)
+        url = f"https://localhost:{server.server_address[1]}/api.xro/2.0/Contacts"
+
+        cold = _time_calls(lambda: requests.get(url, verify=cert, timeout=30), args.calls)
+
+        session = build_session()
+        session.verify = cert
+        session.get(url, timeout=30)  # warm the pool
+        pooled = _time_calls(lambda: session.get(url, timeout=30), args.calls)
+
+        server.shutdown()
+
+    print(f"{args.calls} GETs against local HTTPS stand-in")
+    a = _report("requests.get (per call)", cold)
+    b = _report("pooled Session (XeroClient)", pooled)
+    print(f"saved per call: {a - b:.2f} ms ({(1 - b / a) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Local stand-ins for the Square and Xero APIs, used by the end-to-end benchmarks.
+
+Each server answers only the endpoints the sync pipeline calls, with a
+configurable latency, 5xx error rate and 429 rate, and counts every request
+it receives so benchmarks can report outbound calls per event. A "lost
+response" rate applies a POST and then answers 503 anyway (the write landed,
+the caller never hears about it); Idempotency-Key headers are honoured by
+replaying the first response, as Xero does.
+
+FakeRedis speaks just enough of the Redis protocol for the shared token store
+(TOKEN_STORE=redis, services/token_store.py); benchmarks/bench_token_store.py
+runs concurrent writers against it.
+"""
+import calendar, json, random, re, socketserver, threading, time, uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from utils.resp import read_reply  # the app's RESP parser reads request arrays too
+
+APPOINTMENT_VARIATION = "BENCH-VAR-BROWS"
+APPOINTMENT_ITEM = "BENCH-ITEM-BEAUTY"
+
+
+class FakeAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1, lost_response_rate=0.0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.lost_response_rate = lost_response_rate
+        self.calls = Counter()   # "METHOD route" -> count
+        self.idempotent = {}     # Idempotency-Key -> (status, payload) of the first request
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+    routes = []                    # [(method, regex, handler_name)]
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        url = urlparse(self.path)
+        server = self.server
+
+        for route_method, pattern, name in self.routes:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                break
+        else:
+            return self._send(404, {"errors": [{"code": "NOT_FOUND", "detail": url.path}]})
+
+        with server.lock:
+            server.calls[f"{method} {name}"] += 1
+        if server.latency:
+            time.sleep(server.latency)
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            return self._send(429, {"Title": "Rate limit exceeded"},
+                              {"Retry-After": str(server.retry_after), "X-Rate-Limit-Problem": "minute"})
+        if roll < server.rate_limit_rate + server.error_rate:
+            return self._send(503, {"errors": [{"code": "SERVICE_UNAVAILABLE"}]})
+
+        key = self.headers.get("Idempotency-Key")
+        with server.lock:
+            replay = server.idempotent.get(key) if key else None
+        if replay:
+            return self._send(*replay)
+
+        status, payload = getattr(self, name)(match, parse_qs(url.query), body)
+        if key:
+            with server.lock:
+                server.idempotent.setdefault(key, (status, payload))
+        if method == "POST" and random.random() < server.lost_response_rate:
+            return self._send(503, {"errors": [{"code": "SERVICE_UNAVAILABLE"}]})
+        self._send(status, payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+# --- Square ------------------------------------------------------------------
+
+def fake_customer(customer_id):
+    n = customer_id.rsplit("-", 1)[-1]
+    return {
+        "id": customer_id,
+        "given_name": "Bench",
+        "family_name": f"Customer {n}",
+        "email_address": f"bench.customer.{n}@example.com",
+        "phone_number": f"+61 400 000 {int(n):03d}" if n.isdigit() else None,
+        "version": 1,
+    }
+
+
+def fake_order(order_id, customer_id):
+    money = {"amount": 5000, "currency": "AUD"}
+    return {
+        "id": order_id,
+        "location_id": "BENCH-LOCATION",
+        "customer_id": customer_id,
+        "state": "COMPLETED",
+        "line_items": [{
+            "uid": "li-1",
+            "name": "Beauty Services (Discounted)",
+            "variation_name": "Brows",
+            "catalog_object_id": APPOINTMENT_VARIATION,
+            "quantity": "1",
+            "base_price_money": money,
+            "total_money": money,
+        }],
+        "tenders": [{
+            "id": f"tender-{order_id}",
+            "type": "CARD",
+            "amount_money": money,
+            "card_details": {"status": "CAPTURED", "card": {"card_brand": "VISA", "last_4": "4242"}},
+        }],
+        "total_money": money,
+    }
+
+
+def catalog_snapshot():
+    """CatalogCache snapshot that already knows the benchmark's appointment variation."""
+    return {
+        "items": {APPOINTMENT_ITEM: {"name": "Beauty Services", "product_type": "APPOINTMENTS_SERVICE", "category_id": None}},
+        "variations": {APPOINTMENT_VARIATION: {"item_id": APPOINTMENT_ITEM, "name": "Brows"}},
+        "latest_time": "2025-01-01T00:00:00Z",
+    }
+
+
+class SquareHandler(_Handler):
+    routes = [
+        ("GET", r"/v2/orders/([^/]+)", "get_order"),
+        ("POST", r"/v2/orders/batch-retrieve", "batch_orders"),
+        ("GET", r"/v2/customers/([^/]+)", "get_customer"),
+        ("POST", r"/v2/customers/bulk-retrieve", "bulk_customers"),
+        ("POST", r"/v2/catalog/batch-retrieve", "batch_catalog"),
+        ("POST", r"/v2/catalog/search", "search_catalog"),
+    ]
+
+    def get_order(self, match, query, body):
+        order_id = match.group(1)
+        return 200, {"order": fake_order(order_id, self.server.customer_for(order_id))}
+
+    def batch_orders(self, match, query, body):
+        return 200, {"orders": [fake_order(oid, self.server.customer_for(oid)) for oid in body.get("order_ids", [])]}
+
+    def get_customer(self, match, query, body):
+        return 200, {"customer": fake_customer(match.group(1))}
+
+    def bulk_customers(self, match, query, body):
+        return 200, {"responses": {cid: {"customer": fake_customer(cid)} for cid in body.get("customer_ids", [])}}
+
+    def batch_catalog(self, match, query, body):
+        return 200, {"objects": []}
+
+    def search_catalog(self, match, query, body):
+        return 200, {"objects": [], "latest_time": "2025-01-01T00:00:00Z"}
+
+
+class FakeSquare(FakeAPI):
+    def __init__(self, customers=50, **kwargs):
+        super().__init__(SquareHandler, **kwargs)
+        self.customers = customers
+
+    def customer_for(self, order_id):
+        """Orders are spread over a fixed pool of customers, so returning clients are common."""
+        return f"BENCH-CUST-{sum(map(ord, order_id)) % self.customers}"
+
+
+# --- Xero --------------------------------------------------------------------
+
+_WHERE = re.compile(r'(\w+)=="([^"]*)"')
+
+
+class XeroHandler(_Handler):
+    routes = [
+        ("GET", r"/api.xro/2.0/Contacts", "get_contacts"),
+        ("POST", r"/api.xro/2.0/Contacts", "post_contacts"),
+        ("GET", r"/api.xro/2.0/Invoices", "get_invoices"),
+        ("POST", r"/api.xro/2.0/Invoices", "post_invoices"),
+    ]
+
+    def get_contacts(self, match, query, body):
+        where = _WHERE.search((query.get("where") or [""])[0])
+        if where:
+            field, value = where.groups()
+            with self.server.lock:
+                contacts = [c for c in self.server.contacts.values() if c.get(field) == value]
+            return 200, {"Contacts": contacts[:1]}
+
+        # Paginated listing (contact mirror loads), 100 per page, If-Modified-Since honoured
+        since = self.headers.get("If-Modified-Since")
+        since_ms = calendar.timegm(time.strptime(since, "%Y-%m-%dT%H:%M:%S")) * 1000 if since else 0
+        page = int((query.get("page") or ["1"])[0])
+        with self.server.lock:
+            contacts = [c for c in self.server.contacts.values() if _updated_ms(c) >= since_ms]
+        return 200, {"Contacts": contacts[(page - 1) * 100:page * 100]}
+
+    def post_contacts(self, match, query, body):
+        out = []
+        with self.server.lock:
+            for contact in body.get("Contacts", []):
+                contact_id = contact.get("ContactID") or str(uuid.uuid4())
+                stored = self.server.contacts.setdefault(contact_id, {"ContactID": contact_id})
+                stored.update({k: v for k, v in contact.items() if v is not None})
+                stored["UpdatedDateUTC"] = f"/Date({int(time.time() * 1000)}+0000)/"
+                out.append(dict(stored))
+        return 200, {"Contacts": out}
+
+    def get_invoices(self, match, query, body):
+        numbers = set((query.get("InvoiceNumbers") or [""])[0].split(","))
+        with self.server.lock:
+            invoices = [inv for inv in self.server.invoices.values() if inv.get("InvoiceNumber") in numbers]
+        return 200, {"Invoices": invoices}
+
+    def post_invoices(self, match, query, body):
+        out = []
+        with self.server.lock:
+            for invoice in body.get("Invoices", []):
+                invoice_id = invoice.get("InvoiceID") or str(uuid.uuid4())
+                stored = self.server.invoices.setdefault(invoice_id, {"InvoiceID": invoice_id})
+                stored.update(invoice)
+                out.append({**stored, "StatusAttributeString": "OK"})
+        return 200, {"Invoices": out}
+
+
+def _updated_ms(contact):
+    m = re.search(r"\d+", contact.get("UpdatedDateUTC") or "")
+    return int(m.group()) if m else 0
+
+
+class FakeXero(FakeAPI):
+    def __init__(self, **kwargs):
+        super().__init__(XeroHandler, **kwargs)
+        self.contacts = {}  # ContactID -> contact
+        self.invoices = {}  # InvoiceID -> invoice
+
+
+# --- Redis (token store) -----------------------------------------------------
+
+class Status(str):
+    """Simple-string reply (+OK); plain str replies are bulk strings."""
+
+
+OK = Status("OK")
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    """GET / SET [NX] [PX ms] / DEL / WATCH / UNWATCH / MULTI / EXEC / DISCARD / PING / SELECT."""
+
+    def handle(self):
+        self.watched = {}   # key -> write counter when WATCHed
+        self.queued = None  # commands between MULTI and EXEC
+        while True:
+            try:
+                request = read_reply(self.rfile)
+            except ConnectionError:
+                return
+            args = [a.decode() for a in request]
+            self.wfile.write(self._encode(self._command(args[0].upper(), args[1:])))
+
+    def _command(self, cmd, args):
+        server = self.server
+        if cmd == "MULTI":
+            self.queued = []
+            return OK
+        if cmd == "DISCARD":
+            self.queued, self.watched = None, {}
+            return OK
+        if self.queued is not None and cmd != "EXEC":
+            self.queued.append((cmd, args))
+            return Status("QUEUED")
+        with server.lock:
+            server.calls[cmd] += 1
+            if cmd == "EXEC":
+                queued, watched = self.queued or [], self.watched
+                self.queued, self.watched = None, {}
+                if any(server.writes.get(k, 0) != n for k, n in watched.items()):
+                    return None
+                return [server.apply(c, a) for c, a in queued]
+            if cmd == "WATCH":
+                self.watched.update({k: server.writes.get(k, 0) for k in args})
+                return OK
+            if cmd == "UNWATCH":
+                self.watched = {}
+                return OK
+            return server.apply(cmd, args)
+
+    def _encode(self, reply):
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(self._encode(r) for r in reply)
+        if isinstance(reply, Status):
+            return b"+%s\r\n" % reply.encode()
+        if isinstance(reply, Exception):
+            return b"-ERR %s\r\n" % str(reply).encode()
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class FakeRedis(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RedisHandler)
+        self.data = {}        # key -> (value, expires_at or None)
+        self.writes = Counter()  # key -> write count, for WATCH
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def _get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            self.writes[key] += 1
+            return None
+        return value
+
+    def apply(self, cmd, args):
+        """Run one command (caller holds self.lock)."""
+        if cmd in ("PING", "SELECT", "AUTH"):
+            return Status("PONG") if cmd == "PING" else OK
+        if cmd == "GET":
+            return self._get(args[0])
+        if cmd == "DEL":
+            removed = sum(self._get(k) is not None for k in args)
+            for k in args:
+                self.data.pop(k, None)
+                self.writes[k] += 1
+            return removed
+        if cmd == "SET":
+            key, value, opts = args[0], args[1], [o.upper() for o in args[2:]]
+            if "NX" in opts and self._get(key) is not None:
+                return None
+            ttl_ms = int(args[2 + opts.index("PX") + 1]) if "PX" in opts else None
+            self.data[key] = (value, time.time() + ttl_ms / 1000 if ttl_ms else None)
+            self.writes[key] += 1
+            return OK
+        return ValueError(f"unknown command '{cmd}'")
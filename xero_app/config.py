@@ -11,10 +11,12 @@ SCOPES = os.getenv("XERO_SCOPES")
 
 AUTH_URL = "https://login.xero.com/identity/connect/authorize"
 TOKEN_URL = "https://identity.xero.com/connect/token"
-CONNECTIONS_URL = "https://api.xero.com/connections"
-TOKENS_FILE = "xero_tokens.json"
+XERO_API_URL = os.getenv("XERO_API_URL", "https://api.xero.com")  # overridden by benchmarks (local stand-in)
+CONNECTIONS_URL = f"{XERO_API_URL}/connections"
+TOKENS_FILE = os.getenv("TOKENS_FILE", "xero_tokens.json")
 
 SQUARE_ENV = SquareEnvironment.SANDBOX
+SQUARE_BASE_URL = os.getenv("SQUARE_BASE_URL") or None  # unset = the SDK's URL for SQUARE_ENV
 
 if SQUARE_ENV is SquareEnvironment.PRODUCTION:
     SQUARE_ACCESS_TOKEN = os.getenv("SQUARE_PROD_ACCESS_TOKEN")
@@ -25,7 +27,115 @@ elif SQUARE_ENV is SquareEnvironment.SANDBOX:
 else:
     raise RuntimeError(f"Unsupported SQUARE_ENV: {SQUARE_ENV}")
 
+# Invoice dates are the order's created_at in the merchant's time zone (the Square location's, e.g. Australia/Sydney)
+MERCHANT_TIMEZONE = os.getenv("MERCHANT_TIMEZONE", "UTC")
+
 XERO_ACCOUNT_CODES = {
     "beauty": "261",
     "collections": "260",
-}
\ No newline at end of file
+}
+
+# Account-code rules (services/account_rules.py); XERO_ACCOUNT_CODES is used when the file is absent
+ACCOUNT_RULES_FILE = os.getenv("ACCOUNT_RULES_FILE", "account_rules.json")
+ACCOUNT_RULES_CHECK_INTERVAL = float(os.getenv("ACCOUNT_RULES_CHECK_INTERVAL", "5"))  # seconds between mtime checks
+
+# Webhook event queue (SQLite WAL) + background workers
+EVENT_QUEUE_DB = os.getenv("EVENT_QUEUE_DB", "event_queue.db")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+QUEUE_VISIBILITY_TIMEOUT = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT", "120"))  # seconds a claimed event stays hidden
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "5"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1.0"))
+QUEUE_DEFER_INTERVAL = int(os.getenv("QUEUE_DEFER_INTERVAL", "30"))     # seconds between checks for an event waiting on another
+QUEUE_DEFER_MAX_AGE = int(os.getenv("QUEUE_DEFER_MAX_AGE", "86400"))    # then it's retried as a failure (the daily Xero limit can hold an order this long)
+
+# Shared keep-alive HTTP pool for api.xero.com
+XERO_POOL_SIZE = int(os.getenv("XERO_POOL_SIZE", "10"))
+XERO_TIMEOUT = int(os.getenv("XERO_TIMEOUT", "15"))  # read timeout, seconds
+
+# Local Square customer → Xero ContactID index
+CONTACT_INDEX_DB = os.getenv("CONTACT_INDEX_DB", "contact_index.db")
+CONTACT_INDEX_SIZE = int(os.getenv("CONTACT_INDEX_SIZE", "5000"))                # in-memory LRU entries
+CONTACT_INDEX_TTL = int(os.getenv("CONTACT_INDEX_TTL", str(7 * 24 * 3600)))       # re-verify matches weekly
+CONTACT_NEGATIVE_TTL = int(os.getenv("CONTACT_NEGATIVE_TTL", "600"))              # remember "not in Xero" briefly
+
+# Local ledger of Square order → Xero invoice
+SYNC_LEDGER_DB = os.getenv("SYNC_LEDGER_DB", "sync_ledger.db")
+
+# Micro-batching of invoice creation (0 = off, one POST per order)
+XERO_INVOICE_BATCH_WINDOW = float(os.getenv("XERO_INVOICE_BATCH_WINDOW", "0"))  # seconds to wait for more invoices
+XERO_INVOICE_BATCH_MAX = int(os.getenv("XERO_INVOICE_BATCH_MAX", "50"))
+
+# Collapse bursts of payment.created/payment.updated for one order into one reference write
+PAYMENT_DEBOUNCE_SECONDS = float(os.getenv("PAYMENT_DEBOUNCE_SECONDS", "5"))
+
+# Webhook de-duplication by Square event_id
+DEDUPE_DB = os.getenv("DEDUPE_DB", EVENT_QUEUE_DB)
+DEDUPE_TTL = int(os.getenv("DEDUPE_TTL", str(3 * 24 * 3600)))   # Square retries for up to 3 days
+DEDUPE_MEMORY_SIZE = int(os.getenv("DEDUPE_MEMORY_SIZE", "10000"))
+
+# Xero API limits (per tenant), enforced across all workers on this host
+XERO_RATE_DB = os.getenv("XERO_RATE_DB", "xero_rate.db")
+XERO_CALLS_PER_MINUTE = int(os.getenv("XERO_CALLS_PER_MINUTE", "60"))
+XERO_MAX_CONCURRENT = int(os.getenv("XERO_MAX_CONCURRENT", "5"))
+XERO_BACKFILL_RESERVE = int(os.getenv("XERO_BACKFILL_RESERVE", "10"))   # per-minute calls backfill may not touch
+XERO_DAY_RESERVE = int(os.getenv("XERO_DAY_RESERVE", "500"))            # daily calls backfill may not touch
+XERO_MAX_429_RETRIES = int(os.getenv("XERO_MAX_429_RETRIES", "3"))
+XERO_BACKFILL_MAX_WAIT = float(os.getenv("XERO_BACKFILL_MAX_WAIT", "900"))  # seconds a backfill call may wait for a slot
+
+# Outbound HTTP resilience (Xero + Square)
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))          # idempotent requests only
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))    # seconds, doubled per attempt (full jitter)
+HTTP_BACKOFF_CAP = float(os.getenv("HTTP_BACKOFF_CAP", "8"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+SQUARE_TIMEOUT = int(os.getenv("SQUARE_TIMEOUT", "15"))
+
+# Square catalog snapshot (variation → item / product_type / category)
+CATALOG_SNAPSHOT_FILE = os.getenv("CATALOG_SNAPSHOT_FILE", "catalog_snapshot.json")
+CATALOG_MISSING_TTL = int(os.getenv("CATALOG_MISSING_TTL", "300"))  # seconds before an ID batch_get didn't return is asked for again
+
+# Square customer cache (invalidated by customer.updated / customer.deleted webhooks)
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "2000"))
+CUSTOMER_CACHE_TTL = int(os.getenv("CUSTOMER_CACHE_TTL", "3600"))   # safety net if a webhook is missed
+CUSTOMER_CACHE_DB = os.getenv("CUSTOMER_CACHE_DB", EVENT_QUEUE_DB)  # shared invalidations
+
+# asyncio pipeline (asgi.py): events processed concurrently per process
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "50"))
+
+# Structured logging (utils/log.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")           # e.g. "payment.updated=0.1,order.created=1"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))     # records buffered before new ones are dropped
+
+# Background Xero token refresher (services/token_refresher.py)
+TOKEN_REFRESH_AHEAD = int(os.getenv("TOKEN_REFRESH_AHEAD", "600"))              # renew this long before expiry (tokens last 30 min)
+TOKEN_REFRESH_MAX_BACKOFF = int(os.getenv("TOKEN_REFRESH_MAX_BACKOFF", "300"))  # cap on retry delay after failures
+TOKEN_REFRESH_CHECK_INTERVAL = int(os.getenv("TOKEN_REFRESH_CHECK_INTERVAL", "60"))  # re-read expiry at least this often
+
+# Multi-tenant Xero (services/tenants.py): Square location / merchant → Xero tenant
+TENANT_ROUTES_FILE = os.getenv("TENANT_ROUTES_FILE", "tenant_routes.json")
+QUEUE_MAX_PER_TENANT = int(os.getenv("QUEUE_MAX_PER_TENANT", os.getenv("XERO_MAX_CONCURRENT", "5")))  # in-flight events per tenant
+
+# Shared Xero token store (services/token_store.py): "file", "sqlite" or "redis"
+TOKEN_STORE = os.getenv("TOKEN_STORE", "file")
+TOKEN_STORE_DB = os.getenv("TOKEN_STORE_DB", "xero_tokens.db")
+TOKEN_STORE_REDIS_URL = os.getenv("TOKEN_STORE_REDIS_URL", "redis://localhost:6379/0")
+TOKEN_STORE_KEY = os.getenv("TOKEN_STORE_KEY", "xero:tokens")
+TOKEN_STORE_CHECK_INTERVAL = float(os.getenv("TOKEN_STORE_CHECK_INTERVAL", "5"))  # sqlite/redis: re-check for other instances' writes
+TOKEN_REFRESH_LOCK_TTL = int(os.getenv("TOKEN_REFRESH_LOCK_TTL", "60"))            # lease on the refresh lock
+
+# Square webhook signature (Developer Dashboard → Webhooks → Signature key); unset = don't verify
+SQUARE_WEBHOOK_SIGNATURE_KEY = os.getenv("SQUARE_WEBHOOK_SIGNATURE_KEY")
+SQUARE_WEBHOOK_URL = os.getenv("SQUARE_WEBHOOK_URL")  # notification URL exactly as registered (default: the request URL)
+
+# Batched Square order fetches (services/order_batcher.py); 0 = one orders.get per order
+SQUARE_ORDER_BATCH_WINDOW = float(os.getenv("SQUARE_ORDER_BATCH_WINDOW", "0.02"))  # seconds to wait for more order IDs
+SQUARE_ORDER_BATCH_MAX = int(os.getenv("SQUARE_ORDER_BATCH_MAX", "100"))          # Square's limit per batch_get
+
+# Local mirror of Xero contacts (services/contact_mirror.py); CONTACT_MIRROR_INTERVAL=0 = off (live Xero queries)
+CONTACT_MIRROR_DB = os.getenv("CONTACT_MIRROR_DB", "contact_mirror.db")
+CONTACT_MIRROR_INTERVAL = int(os.getenv("CONTACT_MIRROR_INTERVAL", "300"))            # seconds between incremental pulls
+CONTACT_MIRROR_MAX_STALENESS = int(os.getenv("CONTACT_MIRROR_MAX_STALENESS", "3600"))  # older than this = not trusted
+CONTACT_MIRROR_MISS_MAX_AGE = int(os.getenv("CONTACT_MIRROR_MISS_MAX_AGE", "5"))       # on a miss, pull first unless this fresh
+CONTACT_MIRROR_MISS_WAIT = int(os.getenv("CONTACT_MIRROR_MISS_WAIT", "10"))            # ...and wait this long for another process's pull
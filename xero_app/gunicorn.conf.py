@@ -0,0 +1,22 @@
+# gunicorn.conf.py — picked up automatically by `gunicorn app:app` (see ProcFile)
+"""
+Prometheus multiprocess mode: every worker writes its metrics to
+PROMETHEUS_MULTIPROC_DIR and /metrics merges them (utils/metrics.py).
+The variable must be set before any worker imports prometheus_client.
+"""
+import os, shutil
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.abspath("prometheus_multiproc"))
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):
+    # Samples from a previous run would otherwise be merged into this one
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
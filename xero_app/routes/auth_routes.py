@@ -3,7 +3,8 @@ from flask import Blueprint, jsonify, request, redirect
 import requests, urllib.parse
 from config import CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SCOPES, AUTH_URL, TOKEN_URL, CONNECTIONS_URL
 from utils.auth import basic_auth_header
-from services.token_service import save_tokens
+from services.token_service import save_connection, list_tenants
+from services import token_refresher
 
 auth_bp = Blueprint("auth", __name__)
 
@@ -25,7 +26,7 @@ def xero_connect():
 
 @auth_bp.route("/xero/callback")
 def xero_callback():
-    """Handle Xero OAuth2 callback and save tokens + tenant."""
+    """Handle Xero OAuth2 callback and save tokens + every tenant the user connected."""
     if request.args.get("state") != STATE:
         return "State mismatch.", 400
 
@@ -58,17 +59,30 @@ def xero_callback():
     if con.status_code != 200:
         return jsonify({"connections_error": con.status_code, "body": con.text}), 400
 
-    conns = con.json()
+    conns = [c for c in con.json() if c.get("tenantType", "ORGANISATION") == "ORGANISATION"]
     if not conns:
         return "❌ No tenant connections found.", 400
 
-    tenant_id = conns[0]["tenantId"]
-
-    # ✅ Save both tokens + tenantId
-    save_tokens(TOKENS, tenant_id)
+    # ✅ Save tokens + every connected organisation (route studios to them in TENANT_ROUTES_FILE)
+    save_connection(TOKENS, conns)
+    token_refresher.start_token_refresher()
+    token_refresher.notify()
 
     return jsonify({
         "connected": True,
-        "tenant_id": tenant_id,
+        "tenant_ids": [c["tenantId"] for c in conns],
         "tokens_saved": True
     })
+
+
+@auth_bp.route("/xero/tenants")
+def xero_tenants():
+    """Connected Xero organisations (tenant_id, name, which one is the default)."""
+    return jsonify({"tenants": list_tenants()})
+
+
+@auth_bp.route("/xero/token-health")
+def xero_token_health():
+    """Background token refresher status (503 unless the token is usable)."""
+    health = token_refresher.health()
+    return jsonify(health), 200 if health["status"] in ("ok", "degraded") else 503
@@ -6,8 +6,13 @@ contact_bp = Blueprint("contact", __name__)
 
 @contact_bp.route("/xero/customers")
 def xero_customers():
-    """Fetch first 5 contacts (customers)."""
-    contacts, error, status = fetch_contacts(limit=5)
+    """First N contacts (customers), optionally filtered by ?account_number= / ?email= / ?phone=."""
+    contacts, error, status = fetch_contacts(
+        limit=request.args.get("limit", 5, type=int),
+        account_number=request.args.get("account_number"),
+        email=request.args.get("email"),
+        phone=request.args.get("phone"),
+    )
     if error:
         return jsonify(error), status
     return jsonify(contacts), status
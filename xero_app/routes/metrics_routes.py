@@ -0,0 +1,12 @@
+# routes/metrics_routes.py
+from flask import Blueprint, Response
+from utils import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (all gunicorn workers, see utils/metrics.py)."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
@@ -1,72 +1,93 @@
 from flask import Blueprint, request, jsonify
-from services.square_service import format_tender_reference, get_order, get_customer, extract_services_from_order, client
-from services.xero_service import find_or_create_contact_from_square, create_xero_invoice, get_xero_invoice_by_order_id, update_xero_invoice_reference
+from services.square_service import client, customer_cache, order_batcher, get_customer
+from services import event_queue, webhook_gate
+from services.event_dedupe import get_deduper
+from services.worker import start_workers, notify
+from services.token_refresher import start_token_refresher
+from services.contact_mirror import start_contact_mirror
+from utils.circuit_breaker import breaker_states
+from utils import metrics
+from utils.log import get_logger, event_fields
+from utils import log as log_module
+
+log = get_logger(__name__)
 
 square_bp = Blueprint("square", __name__)
 
+
+@square_bp.record_once
+def _start_workers(state):
+    # Drain anything left in the queue from before a restart
+    start_workers()
+    start_token_refresher()
+    start_contact_mirror()
+
+
 @square_bp.route("/square-webhook", methods=["POST"])
 def square_webhook():
-    event = request.get_json()
-    print("📩 New Square event:", event)
-
-    if event.get("type") == "order.created":
-        order_id = event["data"]["object"]["order_created"]["order_id"]
-        print("✅ New order created:", order_id)
-
-        order = get_order(order_id)
-
-        services, variation_names, prices, quantities = extract_services_from_order(order)
-
-        if services:
-            if getattr(order, "customer_id", None):
-                cust = get_customer(order.customer_id)
-                if cust:
-                    try:
-                        xero_contact, created = find_or_create_contact_from_square(cust)
-                        print(f"✅ Xero contact {'created' if created else 'found'}:")
-                        items = []
-                        for desc, var_name, price, qty in zip(services, variation_names, prices, quantities):
-                            items.append({
-                                "description": desc,  
-                                "var_name": var_name,
-                                "quantity": qty,
-                                "unit_amount": price,
-                            })
-                        invoice = create_xero_invoice(
-                            contact_id=xero_contact.get("ContactID"),
-                            items=items,
-                            square_order_id=order.id,
-                            reference="Square (Pending Payment)"
-                        )
-
-                        print("🧾 Xero invoice created:", invoice)
-
-                    except Exception as e:
-                        print("❌ Xero contact/invoice sync error:", e)
-    elif event.get("type") in ("payment.created", "payment.updated"):
-        payment = event["data"]["object"]["payment"]
-        order_id = payment.get("order_id")
-        order = get_order(order_id)
-
-        # Only update if we have the mapping
-        invoice = get_xero_invoice_by_order_id(order_id)
-        if invoice:
-            invoice_id = invoice["InvoiceID"]
-            ref_text = format_tender_reference(order)
-            update_xero_invoice_reference(invoice_id, ref_text)
-
-        if invoice_id:
-            ref_text = format_tender_reference(order)
-
-            update_xero_invoice_reference(
-                invoice_id=invoice_id,
-                reference=ref_text
-            )
-            print(f"🔄 Updated Xero invoice {invoice_id} with ref {ref_text}")
+    """
+    Persist the event to the local queue and acknowledge straight away.
+    The Square/Xero calls happen in the background workers (services/worker.py).
+    Forged, unhandled and duplicate deliveries are turned away before the body
+    is decoded (services/webhook_gate.py).
+    """
+    raw = request.get_data()
+    event_type, event_id, rejection = webhook_gate.screen(raw, request.headers.get(webhook_gate.SIGNATURE_HEADER), request.url)
+    if rejection:
+        return _rejected(event_type, rejection)
+
+    # Square redelivers on timeouts/errors — drop anything we've already queued
+    deduper = get_deduper()
+    if deduper.is_duplicate(event_id):
+        metrics.WEBHOOK_REQUESTS.labels(type=event_type, outcome="duplicate").inc()
+        return jsonify({"status": "duplicate"})
+
+    event, rejection = webhook_gate.decode(raw)
+    if rejection:
+        deduper.forget(event_id)  # a corrected redelivery with this event_id must still get through
+        return _rejected(event_type, rejection)
+
+    log.info("webhook received", **event_fields(event.body))
+
+    try:
+        event_queue.enqueue_webhook(event.body, raw=event.raw)
+    except Exception:
+        deduper.forget(event_id)
+        metrics.WEBHOOK_REQUESTS.labels(type=event.type, outcome="error").inc()
+        raise
+    metrics.WEBHOOK_REQUESTS.labels(type=event.type, outcome="queued").inc()
+    start_workers()
+    start_token_refresher()
+    start_contact_mirror()
+    notify()
 
     return jsonify({"status": "ok"})
 
 
+def _rejected(event_type, rejection):
+    if rejection == "ignored":
+        # Acknowledge, or Square keeps redelivering an event we'll never use
+        metrics.WEBHOOK_REQUESTS.labels(type="other", outcome="ignored").inc()
+        return jsonify({"status": "ignored"})
+    metrics.WEBHOOK_REQUESTS.labels(type="unknown", outcome=rejection).inc()
+    if rejection == "forged":
+        log.warning("webhook signature rejected", event_type=event_type)
+        return jsonify({"error": "invalid_signature"}), 401
+    return jsonify({"error": "invalid_event"}), 400
+
+
+@square_bp.route("/square/queue-stats", methods=["GET"])
+def queue_stats():
+    return jsonify({
+        **event_queue.stats(),
+        "dedupe": get_deduper().get_stats(),
+        "customer_cache": customer_cache.get_stats(),
+        "order_batcher": {**order_batcher.stats, "calls_per_order": order_batcher.calls_per_order()},
+        "circuits": breaker_states(),
+        "log_records_dropped": log_module.dropped,  # this process only; log_records_dropped_total on /metrics sums them
+    })
+
+
 @square_bp.route("/square/latest-order", methods=["GET"])
 def latest_order():
     """
@@ -93,8 +114,7 @@ def latest_order():
         # Fetch customer info if present
         customer_info = None
         if getattr(order, "customer_id", None):
-            cust_resp = client.customers.get(order.customer_id)
-            cust = getattr(cust_resp, "customer", None)
+            cust = get_customer(order.customer_id)
 
             if cust:
                 # Manually extract key fields
@@ -112,9 +132,9 @@ def latest_order():
             "customer": customer_info
         }
 
-        print("🆕 Most recent order:", result, flush=True)
+        log.info("latest order", order_id=order.id, **result)  # PII fields are redacted by the logger
         return "Check your console/logs for order + customer info"
 
     except Exception as e:
-        print("❌ Error fetching latest order:", str(e), flush=True)
+        log.error("latest order fetch failed", error=str(e))
         return jsonify({"error": str(e)}), 500
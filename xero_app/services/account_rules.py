@@ -0,0 +1,140 @@
+# services/account_rules.py
+"""
+Xero AccountCode for an invoice line, from compiled rules.
+
+Rule tiers, first hit wins:
+  1) exact catalog variation ID   (dict lookup)
+  2) exact catalog item ID        (dict lookup)
+  3) catalog category ID          (dict lookup)
+  4) keyword in the description   (one regex pass over all keywords; earlier keywords win)
+  5) default
+
+Rules come from ACCOUNT_RULES_FILE (see account_rules.example.json) or, if
+there is no file, from XERO_ACCOUNT_CODES with default "200" (the old
+behaviour). The file is re-checked by mtime every ACCOUNT_RULES_CHECK_INTERVAL
+seconds and recompiled on change, so edits apply without a restart. A file
+that fails to parse is ignored and the previous rules stay in use.
+"""
+import json, os, re, threading, time
+from utils.log import get_logger
+from config import XERO_ACCOUNT_CODES, ACCOUNT_RULES_FILE, ACCOUNT_RULES_CHECK_INTERVAL
+
+DEFAULT_ACCOUNT_CODE = "200"
+
+log = get_logger(__name__)
+
+
+class CompiledRules:
+    def __init__(self, spec):
+        self.variations = dict(spec.get("variations") or {})
+        self.items = dict(spec.get("items") or {})
+        self.categories = dict(spec.get("categories") or {})
+        self.default = str(spec.get("default") or DEFAULT_ACCOUNT_CODE)
+
+        keywords = [(k.lower(), str(code)) for k, code in (spec.get("keywords") or {}).items() if k]
+        self.keyword_codes = [code for _, code in keywords]
+        # Zero-width lookahead so every start position is tried once: overlapping
+        # keywords are all seen, and the earliest-listed one wins.
+        self._priority = {kw: i for i, (kw, _) in reversed(list(enumerate(keywords)))}
+        self.keyword_pattern = (
+            re.compile("(?=(" + "|".join(re.escape(kw) for kw, _ in keywords) + "))") if keywords else None
+        )
+
+    def _keyword_code(self, text):
+        if not self.keyword_pattern or not text:
+            return None
+        best = None
+        for m in self.keyword_pattern.finditer(text.lower()):
+            rank = self._priority[m.group(1)]
+            if best is None or rank < best:
+                best = rank
+                if rank == 0:
+                    break
+        return None if best is None else self.keyword_codes[best]
+
+    def code_for(self, line):
+        """line: invoice item dict (variation_id / item_id / category_id / description)."""
+        return (
+            self.variations.get(line.get("variation_id"))
+            or self.items.get(line.get("item_id"))
+            or self.categories.get(line.get("category_id"))
+            or self._keyword_code(line.get("description"))
+            or self.default
+        )
+
+
+def _default_spec():
+    return {"keywords": XERO_ACCOUNT_CODES, "default": DEFAULT_ACCOUNT_CODE}
+
+
+class AccountRules:
+    def __init__(self, path=ACCOUNT_RULES_FILE, check_interval=ACCOUNT_RULES_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.compiled = CompiledRules(_default_spec())
+        self._maybe_reload(force=True)
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if not force and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            try:
+                if mtime is None:
+                    compiled = CompiledRules(_default_spec())
+                else:
+                    with open(self.path) as f:
+                        compiled = CompiledRules(json.load(f))
+            except (OSError, ValueError, AttributeError) as e:
+                self._mtime = mtime  # don't retry (and re-log) until the file changes again
+                log.error("account rules not reloaded", path=self.path, error=str(e))
+                return
+            self.compiled = compiled  # one reference swap: readers never see half a rule set
+            self._mtime = mtime
+            log.info(
+                "account rules loaded", path=self.path if mtime else None,
+                variations=len(compiled.variations), items=len(compiled.items),
+                categories=len(compiled.categories), keywords=len(compiled.keyword_codes),
+            )
+
+    def code_for(self, line):
+        self._maybe_reload()
+        return self.compiled.code_for(line)
+
+    def map_many(self, lines):
+        """AccountCodes for many lines (e.g. a backfill page), one rules check, repeated lines computed once."""
+        self._maybe_reload()
+        compiled = self.compiled
+        memo, codes = {}, []
+        for line in lines:
+            key = (line.get("variation_id"), line.get("item_id"), line.get("category_id"), line.get("description"))
+            code = memo.get(key)
+            if code is None:
+                code = memo[key] = compiled.code_for(line)
+            codes.append(code)
+        return codes
+
+
+_rules = None
+_rules_lock = threading.Lock()
+
+
+def get_account_rules():
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = AccountRules()
+    return _rules
@@ -0,0 +1,245 @@
+# services/async_sync.py
+"""
+asyncio version of the Square → Xero pipeline (services/sync_service.py),
+used by the ASGI entry point (asgi.py).
+
+Square / Xero calls are awaited instead of blocking a thread:
+  order.created  – the sync path's skip and contact-match rules
+                   (xero_service.contact_rules), driven over the async client
+  payment.*      – tender read from the payload (invoice lookup ‖ order fetch
+                   only when the payload lacks it)
+Local state (ledger, contact index, caches) is shared with the sync path.
+"""
+import asyncio, contextvars, time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from square import AsyncSquare
+from services.async_xero_client import AsyncXeroClient
+from services.square_service import format_tender_reference, tender_reference_from_payment, customer_cache, catalog_cache, order_batcher, square_breaker, _upstream_failure, READ_OPTIONS
+from services.sync_service import order_invoice_items, order_invoice_date, skip_reason, check_invoice_expected, invoice_from_lost_attempt
+from services.xero_service import (
+    contact_rules, step_contact_rules, build_xero_invoice, get_invoice_batcher,
+    ContactRejected, raise_if_contact_rejected, check_invoice_response, XERO_INVOICES_URL,
+)
+from services.invoice_batcher import InvoiceValidationError
+from services import sync_ledger, tenants
+from utils import metrics
+from utils.log import get_logger
+from config import (
+    SQUARE_ACCESS_TOKEN, SQUARE_ENV, SQUARE_BASE_URL, SQUARE_TIMEOUT, SQUARE_ORDER_BATCH_WINDOW,
+    XERO_INVOICE_BATCH_WINDOW, XERO_POOL_SIZE,
+)
+
+square = AsyncSquare(
+    token=SQUARE_ACCESS_TOKEN,
+    environment=SQUARE_ENV,
+    base_url=SQUARE_BASE_URL,
+    timeout=SQUARE_TIMEOUT,
+    httpx_client=httpx.AsyncClient(timeout=SQUARE_TIMEOUT, transport=metrics.AsyncMeteredTransport()),
+)
+log = get_logger(__name__)
+_xero_clients = {}  # tenant_id -> AsyncXeroClient, created inside the running loop by get_async_xero()
+_xero_executor = ThreadPoolExecutor(max_workers=XERO_POOL_SIZE, thread_name_prefix="xero-sync")
+
+
+def get_async_xero(tenant_id=None):
+    """Client (own connection pool) for tenant_id, else the current tenant, else the default one."""
+    tenant_id = tenant_id or tenants.current()
+    client = _xero_clients.get(tenant_id)
+    if client is None:
+        client = _xero_clients[tenant_id] = AsyncXeroClient(tenant_id)
+    return client
+
+
+async def close_async_xero():
+    clients = list(_xero_clients.values())
+    _xero_clients.clear()
+    await asyncio.gather(*(c.aclose() for c in clients))
+
+
+async def _square_call(fn, *args, **kwargs):
+    """Await a Square SDK call through the same circuit breaker as the sync path."""
+    return await square_breaker.call_async(fn, *args, request_options=READ_OPTIONS, is_failure=_upstream_failure, **kwargs)
+
+
+async def handle_event_async(event: dict):
+    with tenants.use_tenant(tenants.tenant_for_event(event)):
+        await _dispatch_async(event)
+
+
+async def _dispatch_async(event: dict):
+    event_type = event.get("type")
+
+    if event_type == "order.created":
+        await sync_order_async(event["data"]["object"]["order_created"]["order_id"])
+    elif event_type in ("payment.created", "payment.updated"):
+        await sync_payment_async(event["data"]["object"]["payment"])
+    elif event_type == "catalog.version.updated":
+        await asyncio.to_thread(catalog_cache.refresh)
+    elif event_type in ("customer.updated", "customer.deleted"):
+        data = event.get("data") or {}
+        customer = (data.get("object") or {}).get("customer") or {}
+        await asyncio.to_thread(customer_cache.invalidate, data.get("id") or customer.get("id"), customer.get("version"))
+
+
+async def get_order_async(order_id):
+    if SQUARE_ORDER_BATCH_WINDOW > 0:
+        # Concurrent coroutines' fetches share one orders.batch_get
+        return await asyncio.wrap_future(order_batcher.submit(order_id))
+    return (await _square_call(square.orders.get, order_id)).order
+
+
+async def get_customer_async(customer_id):
+    customer = await asyncio.to_thread(customer_cache.peek, customer_id)
+    if customer is not None:
+        return customer
+    started = time.time()
+    with metrics.stage("square_customer_fetch"):
+        customer = (await _square_call(square.customers.get, customer_id)).customer
+    await asyncio.to_thread(customer_cache.store, customer_id, customer, started)
+    return customer
+
+
+async def _in_xero_thread(fn, *args):
+    """
+    Run a blocking sync-path function that talks to Xero (it may wait minutes for a
+    rate-limit slot) on its own bounded pool, so it can't starve the default executor
+    that webhook de-duplication and enqueueing use. Context (tenant, priority) is carried over.
+    """
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_xero_executor, ctx.run, fn, *args)
+
+
+async def find_or_create_contact_async(cust, rejected_contact_id=None):
+    started = time.perf_counter()
+    contact, created, tier = await _run_contact_rules_async(contact_rules(cust, rejected_contact_id))
+    metrics.observe_contact(tier, time.perf_counter() - started)
+    return contact, created
+
+
+async def _run_contact_rules_async(rules):
+    """
+    Drive the sync path's contact_rules() over the async client: each Xero call is
+    awaited here, the local steps between them (index, mirror) run on the Xero pool.
+    """
+    xero = get_async_xero()
+    state, value = await _in_xero_thread(step_contact_rules, rules)
+    while state == "request":
+        method, url, kwargs = value
+        try:
+            response = await getattr(xero, method)(url, **kwargs)
+        except Exception as e:
+            state, value = await _in_xero_thread(step_contact_rules, rules, None, e)
+        else:
+            state, value = await _in_xero_thread(step_contact_rules, rules, response)
+    return value
+
+
+async def sync_order_async(order_id):
+    if await asyncio.to_thread(sync_ledger.is_synced, order_id):
+        log.info("order already synced")
+        return None
+    await asyncio.to_thread(sync_ledger.mark_received, order_id)
+    existing = await _in_xero_thread(invoice_from_lost_attempt, order_id)
+    if existing:
+        log.info("xero invoice found from an earlier attempt", invoice_id=existing.get("InvoiceID"))
+        return {"Invoices": [existing]}
+
+    with metrics.stage("square_order_fetch"):
+        order = await get_order_async(order_id)
+    # Same skip rules, in the same order, as sync_order — no customer fetch for skipped orders
+    items = await asyncio.to_thread(order_invoice_items, order)
+    reason = skip_reason(order, items)
+    if reason:
+        await asyncio.to_thread(sync_ledger.record_skipped, order_id, reason)
+        return None
+
+    cust = await get_customer_async(order.customer_id)
+    if not cust:
+        await asyncio.to_thread(sync_ledger.record_skipped, order_id, "customer_not_found")
+        return None
+
+    contact, created = await find_or_create_contact_async(cust)
+    try:
+        return await _invoice_order_async(order, items, contact, created)
+    except ContactRejected as e:
+        # The cached/mirrored contact is archived or gone in Xero: forget it and match again
+        log.warning("xero contact rejected", contact_id=e.contact_id)
+        contact, created = await find_or_create_contact_async(cust, rejected_contact_id=e.contact_id)
+        return await _invoice_order_async(order, items, contact, created)
+
+
+async def _invoice_order_async(order, items, contact, created):
+    log.info("xero contact resolved", contact_id=contact.get("ContactID"), created=created)
+    await asyncio.to_thread(sync_ledger.record_contact, order.id, contact.get("ContactID"))
+
+    invoice = build_xero_invoice(
+        contact.get("ContactID"), items, order.id, reference="Square (Pending Payment)", invoice_date=order_invoice_date(order),
+    )
+    with metrics.stage("invoice_create"):
+        if XERO_INVOICE_BATCH_WINDOW > 0:
+            # Same per-tenant batcher as create_xero_invoice: one POST with the other orders being invoiced now
+            try:
+                data = {"Invoices": [await asyncio.wrap_future(get_invoice_batcher().submit(invoice))]}
+            except InvoiceValidationError as e:
+                raise_if_contact_rejected(e.messages, contact.get("ContactID"), e)
+                raise
+        else:
+            resp = await get_async_xero().post(XERO_INVOICES_URL, json={"Invoices": [invoice]})
+            check_invoice_response(resp, contact.get("ContactID"))
+            data = resp.json()
+    for created_invoice in data.get("Invoices", [])[:1]:
+        await asyncio.to_thread(sync_ledger.record_invoice, order.id, created_invoice)
+    log.info("xero invoice created", invoice_id=(data.get("Invoices") or [{}])[0].get("InvoiceID"))
+    return data
+
+
+async def get_invoice_by_order_id_async(order_id):
+    entry = await asyncio.to_thread(sync_ledger.get, order_id)
+    if entry and entry["invoice_id"]:
+        return sync_ledger.as_invoice(entry)
+
+    resp = await get_async_xero().get(XERO_INVOICES_URL, params={"InvoiceNumbers": f"SQUARE - {order_id}"})
+    if resp.status_code != 200:
+        raise RuntimeError(f"Xero invoice lookup failed: {resp.status_code} {resp.text}")
+    invoices = resp.json().get("Invoices", [])
+    if not invoices:
+        return None
+    await asyncio.to_thread(sync_ledger.record_invoice, order_id, invoices[0])
+    return invoices[0]
+
+
+async def sync_payment_async(payment: dict):
+    order_id = payment.get("order_id")
+    if not order_id:
+        return
+
+    ref_text = tender_reference_from_payment(payment)
+    if ref_text is not None:
+        metrics.TENDER_REFERENCES.labels(source="payment").inc()
+        invoice = await get_invoice_by_order_id_async(order_id)
+        if not invoice:
+            await asyncio.to_thread(check_invoice_expected, order_id)  # raises (retry) unless never invoiced
+            return
+    else:
+        # Payload lacks the tender: invoice lookup ‖ order fetch
+        metrics.TENDER_REFERENCES.labels(source="order").inc()
+        invoice, order = await asyncio.gather(
+            get_invoice_by_order_id_async(order_id),
+            get_order_async(order_id),
+        )
+        if not invoice:
+            await asyncio.to_thread(check_invoice_expected, order_id)
+            return
+        ref_text = format_tender_reference(order)
+
+    if invoice.get("Reference") == ref_text:
+        return
+
+    payload = {"Invoices": [{"InvoiceID": invoice["InvoiceID"], "Reference": ref_text}]}
+    with metrics.stage("reference_update"):
+        resp = await get_async_xero().post(XERO_INVOICES_URL, json=payload)
+    if resp.status_code not in (200, 201):
+        raise RuntimeError(f"Xero invoice update failed: {resp.status_code} {resp.text}")
+    await asyncio.to_thread(sync_ledger.record_reference, invoice["InvoiceID"], ref_text)
+    log.info("invoice reference updated", invoice_id=invoice["InvoiceID"], reference=ref_text)
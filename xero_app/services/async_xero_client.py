@@ -0,0 +1,106 @@
+# services/async_xero_client.py
+"""
+asyncio counterpart of XeroClient (httpx.AsyncClient, keep-alive pool).
+
+Same guarantees as the sync session: the shared per-tenant rate limiter,
+a 429 retry after Retry-After, jittered retries for GETs and the api.xero.com
+circuit breaker. The limiter and token store are SQLite/file based, so
+those calls are pushed to a thread to keep the event loop free; waiting for
+a limiter slot is an asyncio.sleep, not a parked thread.
+"""
+import asyncio
+import httpx
+from urllib.parse import urlparse
+from services.token_service import get_valid_access_token
+from services.xero_client import XeroNotConnected
+from services.xero_rate_limiter import get_rate_limiter
+from utils.circuit_breaker import get_breaker
+from utils import metrics
+from utils.http import backoff_delay, retryable_response, RETRY_STATUSES, IDEMPOTENT_METHODS
+from config import XERO_API_URL, XERO_POOL_SIZE, XERO_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_RETRIES, XERO_MAX_429_RETRIES
+
+
+def _upstream_error(e):
+    """Transport failures count against api.xero.com; anything else says nothing about it."""
+    return True if isinstance(e, httpx.TransportError) else None
+
+
+class AsyncXeroClient:
+    def __init__(self, tenant_id=None, pool_size=XERO_POOL_SIZE, timeout=XERO_TIMEOUT):
+        self.tenant_id = tenant_id  # None = the default tenant
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+        )
+        self.limiter = get_rate_limiter()
+        self.breaker = get_breaker(urlparse(XERO_API_URL).hostname)  # same breaker as the sync session
+        self._headers_for = None
+        self._headers = {}
+
+    async def headers(self, json=False):
+        access_token, tenant_id = await asyncio.to_thread(get_valid_access_token, self.tenant_id)
+        if not access_token or not tenant_id:
+            raise XeroNotConnected("Not connected to Xero. Run the Xero OAuth flow first.")
+        if self._headers_for != (access_token, tenant_id):
+            base = {
+                "Authorization": f"Bearer {access_token}",
+                "Xero-tenant-id": tenant_id,
+                "Accept": "application/json",
+            }
+            self._headers = {False: base, True: {**base, "Content-Type": "application/json"}}
+            self._headers_for = (access_token, tenant_id)
+        return self._headers[json]
+
+    async def _send_once(self, method, url, headers, **kwargs):
+        """
+        One call under the rate limiter, retrying 429s after Retry-After. The breaker
+        slot is taken after the limiter slot, as in XeroRateLimitAdapter.
+        """
+        tenant_id = headers["Xero-tenant-id"]
+        for attempt in range(XERO_MAX_429_RETRIES + 1):
+            self.breaker.check()
+            lease_id = await self.limiter.acquire_async(tenant_id)
+            response = None
+            try:
+                response = await self.breaker.call_async(
+                    self._transmit, method, url, headers=headers,
+                    is_failure=_upstream_error, bad_result=retryable_response, **kwargs,
+                )
+            finally:
+                await asyncio.to_thread(self.limiter.release, tenant_id, lease_id, response)
+            if response.status_code != 429 or attempt == XERO_MAX_429_RETRIES:
+                return response
+
+    async def _transmit(self, method, url, **kwargs):
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except httpx.TransportError:
+            metrics.record_call(urlparse(url).hostname, "error")
+            raise
+        metrics.record_call(urlparse(url).hostname, response.status_code)
+        return response
+
+    async def request(self, method, url, json=None, params=None, headers=None):
+        base = await self.headers(json=json is not None)
+        headers = {**base, **headers} if headers else base
+        retries = HTTP_MAX_RETRIES if method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            try:
+                response = await self._send_once(method, url, headers, json=json, params=params)
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+            await asyncio.sleep(backoff_delay(attempt))
+
+    async def get(self, url, params=None):
+        return await self.request("GET", url, params=params)
+
+    async def post(self, url, json=None, params=None, headers=None):
+        return await self.request("POST", url, json=json, params=params, headers=headers)
+
+    async def aclose(self):
+        await self.http.aclose()
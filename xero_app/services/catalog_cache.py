@@ -0,0 +1,190 @@
+# services/catalog_cache.py
+"""
+In-memory map of Square catalog variations → parent item, product_type and
+category, so line items can be classified without the two
+client.catalog.object.get calls per line described in square_structure.md.
+
+- First use: bulk load every ITEM / ITEM_VARIATION via the paginated catalog list.
+- Snapshot persisted to CATALOG_SNAPSHOT_FILE; other processes pick it up by mtime.
+- catalog.version.updated webhooks → refresh(): catalog search since the last
+  seen latest_time (incremental, deleted objects included).
+- Variations we still don't know are resolved with one batch_get per order;
+  IDs Square doesn't return (deleted variations) aren't asked for again for
+  CATALOG_MISSING_TTL seconds.
+"""
+import json, os, threading, time
+from utils.circuit_breaker import get_breaker
+from utils.log import get_logger
+from config import CATALOG_SNAPSHOT_FILE, CATALOG_MISSING_TTL
+
+_TYPES = ["ITEM", "ITEM_VARIATION"]
+
+log = get_logger(__name__)
+
+
+def _category_id(item_data):
+    reporting = getattr(item_data, "reporting_category", None)
+    if reporting and getattr(reporting, "id", None):
+        return reporting.id
+    categories = getattr(item_data, "categories", None) or []
+    if categories:
+        return getattr(categories[0], "id", None)
+    return getattr(item_data, "category_id", None)
+
+
+class CatalogCache:
+    def __init__(self, client, path=CATALOG_SNAPSHOT_FILE):
+        self.client = client
+        self.path = path
+        self.items = {}       # item_id -> {"name", "product_type", "category_id"}
+        self.variations = {}  # variation_id -> {"item_id", "name"}
+        self._missing = {}    # variation_id -> monotonic time batch_get may be tried again
+        self.latest_time = None
+        self._mtime = None
+        self._loaded = False
+        self._lock = threading.RLock()
+        self.breaker = get_breaker("connect.squareup.com")
+
+    # --- applying catalog objects ------------------------------------------
+
+    def _apply(self, obj):
+        obj_id = getattr(obj, "id", None)
+        if not obj_id:
+            return
+        if getattr(obj, "is_deleted", False):
+            self.items.pop(obj_id, None)
+            self.variations.pop(obj_id, None)
+            return
+
+        if obj.type == "ITEM" and getattr(obj, "item_data", None):
+            data = obj.item_data
+            self.items[obj_id] = {
+                "name": getattr(data, "name", None),
+                "product_type": getattr(data, "product_type", None),
+                "category_id": _category_id(data),
+            }
+            # Items carry their variations inline
+            for var in getattr(data, "variations", None) or []:
+                self._apply(var)
+        elif obj.type == "ITEM_VARIATION" and getattr(obj, "item_variation_data", None):
+            data = obj.item_variation_data
+            self.variations[obj_id] = {"item_id": data.item_id, "name": getattr(data, "name", None)}
+            self._missing.pop(obj_id, None)
+
+    # --- snapshot ----------------------------------------------------------
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"items": self.items, "variations": self.variations, "latest_time": self.latest_time}, f)
+        os.replace(tmp, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _load_snapshot(self):
+        """Load the snapshot if it changed on disk. Returns False if there is none."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.items = data.get("items", {})
+            self.variations = data.get("variations", {})
+            self.latest_time = data.get("latest_time")
+            self._mtime = mtime
+        return True
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._load_snapshot():
+                self._loaded = True
+            elif not self._loaded:
+                self.full_load()
+
+    # --- Square calls ------------------------------------------------------
+
+    def full_load(self):
+        """Page through the whole catalog (ITEM + ITEM_VARIATION) and snapshot it."""
+        with self._lock:
+            self.items, self.variations = {}, {}
+            pager = self.breaker.call(self.client.catalog.list, types=",".join(_TYPES))
+            for obj in pager:
+                self._apply(obj)
+            # Incremental refreshes start from the newest change we now know about
+            self.latest_time = self._search_latest_time()
+            self._loaded = True
+            self._save()
+            log.info("catalog cache loaded", items=len(self.items), variations=len(self.variations))
+
+    def _search_latest_time(self):
+        resp = self.breaker.call(self.client.catalog.search, object_types=_TYPES, limit=1)
+        return getattr(resp, "latest_time", None)
+
+    def refresh(self):
+        """Apply catalog changes since the last refresh (catalog.version.updated)."""
+        with self._lock:
+            self._load_snapshot()
+            if not self.latest_time:
+                return self.full_load()
+
+            cursor, changed = None, 0
+            latest_time = self.latest_time
+            while True:
+                resp = self.breaker.call(
+                    self.client.catalog.search,
+                    object_types=_TYPES,
+                    begin_time=self.latest_time,
+                    include_deleted_objects=True,
+                    cursor=cursor,
+                )
+                for obj in getattr(resp, "objects", None) or []:
+                    self._apply(obj)
+                    changed += 1
+                latest_time = getattr(resp, "latest_time", None) or latest_time
+                cursor = getattr(resp, "cursor", None)
+                if not cursor:
+                    break
+
+            self.latest_time = latest_time
+            self._loaded = True
+            self._save()
+            log.info("catalog cache refreshed", changed=changed)
+
+    def resolve(self, variation_ids):
+        """Fetch any variations we don't know yet (and their parent items) in one batch call."""
+        self._ensure_loaded()
+        now = time.monotonic()
+        with self._lock:
+            missing = [
+                v for v in set(variation_ids)
+                if v and v not in self.variations and self._missing.get(v, 0) <= now
+            ]
+            if not missing:
+                return
+            resp = self.breaker.call(self.client.catalog.batch_get, object_ids=missing, include_related_objects=True)
+            for obj in (getattr(resp, "objects", None) or []) + (getattr(resp, "related_objects", None) or []):
+                self._apply(obj)
+            # Deleted variations: remember them briefly so every order line doesn't re-ask
+            for v in missing:
+                if v not in self.variations:
+                    self._missing[v] = now + CATALOG_MISSING_TTL
+            self._save()
+
+    # --- lookups -----------------------------------------------------------
+
+    def lookup(self, variation_id):
+        """{"item_id", "variation_name", "item_name", "product_type", "category_id"} or None. Never calls Square."""
+        with self._lock:
+            self._load_snapshot()
+        var = self.variations.get(variation_id)
+        if not var:
+            return None
+        item = self.items.get(var["item_id"]) or {}
+        return {
+            "item_id": var["item_id"],
+            "variation_name": var["name"],
+            "item_name": item.get("name"),
+            "product_type": item.get("product_type"),
+            "category_id": item.get("category_id"),
+        }
@@ -0,0 +1,145 @@
+# services/contact_index.py
+"""
+Local index of Square customer keys → Xero ContactID, consulted before any
+Xero Contacts lookup.
+
+Keys are (kind, value) with kind one of:
+  "square" – raw Square customer ID (our AccountNumber)
+  "legacy" – old 'SQ-<id>' AccountNumber
+  "email"  – lower-cased, stripped email address
+
+Contact IDs only mean something inside one Xero organisation, so there is
+one index per tenant; its keys are stored as "<tenant_id>:<kind>".
+
+Entries live in SQLite (shared by all workers, survives restarts) with an LRU
+dict in front. A None contact_id is a negative entry ("Xero has no such
+contact") and expires after CONTACT_NEGATIVE_TTL; positive entries expire
+after CONTACT_INDEX_TTL. A contact Xero rejects for an invoice, or that the
+contact mirror sees archived, is forgotten straight away (forget_contact).
+"""
+import threading, time
+from collections import OrderedDict
+from utils.db import connect
+from services.token_service import resolve_tenant
+from config import CONTACT_INDEX_DB, CONTACT_INDEX_SIZE, CONTACT_INDEX_TTL, CONTACT_NEGATIVE_TTL
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contact_index (
+    kind           TEXT NOT NULL,
+    value          TEXT NOT NULL,
+    contact_id     TEXT,
+    account_number TEXT,
+    expires_at     REAL NOT NULL,
+    PRIMARY KEY (kind, value)
+);
+CREATE INDEX IF NOT EXISTS contact_index_contact ON contact_index (contact_id);
+"""
+
+_MISS = (False, None, None)
+
+
+def normalize_email(email: str) -> str:
+    return (email or "").strip().lower()
+
+
+class ContactIndex:
+    def __init__(self, tenant_id=None, path=CONTACT_INDEX_DB, size=CONTACT_INDEX_SIZE):
+        self.prefix = f"{tenant_id}:" if tenant_id else ""
+        self.path = path
+        self.size = size
+        self._lru = OrderedDict()  # (kind, value) -> (contact_id, account_number, expires_at)
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready:
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def get(self, kind, value):
+        """
+        Returns (found, contact_id, account_number).
+        found=True with contact_id=None means a cached negative.
+        """
+        if not value:
+            return _MISS
+        key = (self.prefix + kind, value)
+        now = time.time()
+
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry[2] > now:
+                    self._lru.move_to_end(key)
+                    return True, entry[0], entry[1]
+                del self._lru[key]
+
+        row = self._db().execute(
+            "SELECT contact_id, account_number, expires_at FROM contact_index WHERE kind = ? AND value = ?",
+            key,
+        ).fetchone()
+        if not row or row[2] <= now:
+            return _MISS
+
+        self._remember(key, row)
+        return True, row[0], row[1]
+
+    def put(self, kind, value, contact_id, account_number=None):
+        """Record a match (or a negative when contact_id is None)."""
+        if not value:
+            return
+        ttl = CONTACT_INDEX_TTL if contact_id else CONTACT_NEGATIVE_TTL
+        entry = (contact_id, account_number, time.time() + ttl)
+        key = (self.prefix + kind, value)
+        self._db().execute(
+            "INSERT OR REPLACE INTO contact_index (kind, value, contact_id, account_number, expires_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (*key, *entry),
+        )
+        self._remember(key, entry)
+
+    def put_contact(self, contact: dict, square_id=None, email=None):
+        """Index every key we know for a contact we just found, created or patched."""
+        contact_id = (contact or {}).get("ContactID")
+        if not contact_id:
+            return
+        account_number = contact.get("AccountNumber")
+        if square_id:
+            self.put("square", square_id, contact_id, account_number)
+        if account_number and account_number.startswith("SQ-"):
+            self.put("legacy", account_number, contact_id, account_number)
+        for e in (email, contact.get("EmailAddress")):
+            if e:
+                self.put("email", normalize_email(e), contact_id, account_number)
+
+    def forget_contact(self, contact_id):
+        """Drop every key pointing at a contact (e.g. it was archived or merged in Xero)."""
+        self._db().execute("DELETE FROM contact_index WHERE contact_id = ?", (contact_id,))
+        with self._lock:
+            for key in [k for k, v in self._lru.items() if v[0] == contact_id]:
+                del self._lru[key]
+
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def get_contact_index(tenant_id=None):
+    """Index for tenant_id, else the current tenant (services/tenants.py), else the default one."""
+    tenant_id = resolve_tenant(tenant_id)
+    index = _indexes.get(tenant_id)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(tenant_id)
+            if index is None:
+                index = _indexes[tenant_id] = ContactIndex(tenant_id)
+    return index
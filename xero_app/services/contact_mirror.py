@@ -0,0 +1,372 @@
+# services/contact_mirror.py
+"""
+Local mirror of every Xero contact, so contact matching needs no Xero reads.
+
+One full paginated load of /Contacts, then incremental pulls with
+If-Modified-Since every CONTACT_MIRROR_INTERVAL seconds (at backfill priority
+under the rate limiter). Contacts are kept in memory with hash indexes on:
+  account – AccountNumber (raw Square ID, or legacy 'SQ-<id>')
+  email   – lower-cased, stripped EmailAddress
+  phone   – digits-only phone number (with and without country/area code)
+
+The mirror is persisted in SQLite (CONTACT_MIRROR_DB). Only one process pulls
+at a time (a lease on the tenant's state row); the others pick up its rows by
+sequence number, so a restart or an extra worker costs no Xero calls.
+
+ready() is False until the first full load finished, or when the last pull is
+older than CONTACT_MIRROR_MAX_STALENESS — callers then fall back to live
+Xero queries. One mirror per Xero tenant, like the contact index.
+"""
+import json, os, random, threading, time
+from utils.db import connect, transaction
+from utils.log import get_logger
+from services.token_service import resolve_tenant, list_tenants
+from services.xero_client import get_xero_client
+from services.xero_rate_limiter import backfill_priority
+from services.contact_index import get_contact_index
+from config import (
+    XERO_API_URL, CONTACT_MIRROR_DB, CONTACT_MIRROR_INTERVAL, CONTACT_MIRROR_MAX_STALENESS,
+)
+
+CONTACTS_URL = f"{XERO_API_URL}/api.xro/2.0/Contacts"
+PAGE_SIZE = 100           # Xero's /Contacts page size
+PULL_LEASE = 300          # seconds a pulling process may hold the lease
+MODIFIED_SINCE_SKEW = 60  # re-read this much before the last pull (clock skew, in-flight edits)
+CATCH_UP_INTERVAL = 1.0   # seconds between checks for rows another process wrote
+LEASE_POLL_INTERVAL = 0.2  # seconds between checks while waiting for another process's pull
+MIN_PHONE_DIGITS = 8
+
+_FIELDS = ("ContactID", "Name", "FirstName", "LastName", "EmailAddress", "AccountNumber", "ContactStatus", "UpdatedDateUTC")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contact_mirror (
+    tenant     TEXT NOT NULL,
+    contact_id TEXT NOT NULL,
+    body       TEXT NOT NULL,
+    seq        INTEGER NOT NULL,
+    PRIMARY KEY (tenant, contact_id)
+);
+CREATE INDEX IF NOT EXISTS contact_mirror_seq ON contact_mirror (tenant, seq);
+CREATE TABLE IF NOT EXISTS contact_mirror_state (
+    tenant         TEXT PRIMARY KEY,
+    loaded         INTEGER NOT NULL DEFAULT 0,   -- full load finished
+    modified_since REAL,                         -- next pull's If-Modified-Since
+    pulled_at      REAL NOT NULL DEFAULT 0,      -- last successful pull
+    pulling_until  REAL NOT NULL DEFAULT 0       -- pull lease
+);
+"""
+
+log = get_logger(__name__)
+
+
+class MirrorBusy(RuntimeError):
+    pass
+
+
+def digits_only(s: str) -> str:
+    return "".join(ch for ch in (s or "") if ch.isdigit())
+
+
+def _compact(contact):
+    """The fields we match and display on, in Xero's own names."""
+    out = {k: contact.get(k) for k in _FIELDS if contact.get(k) is not None}
+    out["Phones"] = [
+        {k: p.get(k) for k in ("PhoneType", "PhoneCountryCode", "PhoneAreaCode", "PhoneNumber") if p.get(k)}
+        for p in contact.get("Phones") or [] if p.get("PhoneNumber")
+    ]
+    return out
+
+
+def _keys(contact):
+    """(index, key) pairs a contact is findable by."""
+    keys = []
+    if contact.get("AccountNumber"):
+        keys.append(("account", contact["AccountNumber"]))
+    email = (contact.get("EmailAddress") or "").strip().lower()
+    if email:
+        keys.append(("email", email))
+    for p in contact.get("Phones") or []:
+        number = digits_only(p.get("PhoneNumber"))
+        area = digits_only(p.get("PhoneAreaCode"))
+        country = digits_only(p.get("PhoneCountryCode"))
+        for phone in {number, area + number, country + area + number}:
+            if len(phone) >= MIN_PHONE_DIGITS:
+                keys.append(("phone", phone))
+    return keys
+
+
+class ContactMirror:
+    def __init__(self, tenant_id=None, path=CONTACT_MIRROR_DB):
+        self.tenant = tenant_id or "default"
+        self.tenant_id = tenant_id
+        self.path = path
+        self.contacts = {}                                    # ContactID -> compact contact
+        self._index = {"account": {}, "email": {}, "phone": {}}  # index -> key -> {ContactID}
+        self._seq = 0
+        self._state = {"loaded": 0, "pulled_at": 0.0}
+        self._caught_up_at = 0.0
+        self._lock = threading.Lock()
+        self._pull_lock = threading.Lock()
+        self._ready_db = False
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready_db:
+            conn.executescript(_SCHEMA)
+            self._ready_db = True
+        return conn
+
+    # --- in-memory indexes --------------------------------------------------
+
+    def _apply(self, contact):
+        """
+        Index one contact (caller holds self._lock). Archived contacts are dropped from
+        the indexes; returns True when a contact we had as active was archived.
+        """
+        contact_id = contact["ContactID"]
+        old = self.contacts.pop(contact_id, None)
+        for index, key in _keys(old or {}):
+            ids = self._index[index].get(key)
+            if ids:
+                ids.discard(contact_id)
+                if not ids:
+                    del self._index[index][key]
+        if contact.get("ContactStatus") == "ARCHIVED":
+            return old is not None
+        self.contacts[contact_id] = contact
+        for index, key in _keys(contact):
+            self._index[index].setdefault(key, set()).add(contact_id)
+        return False
+
+    def _catch_up(self, force=False):
+        """Load rows (and pull state) other processes wrote since we last looked."""
+        now = time.monotonic()
+        if not force and now - self._caught_up_at < CATCH_UP_INTERVAL:
+            return
+        self._caught_up_at = now
+        conn = self._db()
+        rows = conn.execute(
+            "SELECT body, seq FROM contact_mirror WHERE tenant = ? AND seq > ? ORDER BY seq",
+            (self.tenant, self._seq),
+        ).fetchall()
+        state = conn.execute(
+            "SELECT loaded, pulled_at FROM contact_mirror_state WHERE tenant = ?", (self.tenant,)
+        ).fetchone()
+        archived = []
+        with self._lock:
+            for body, seq in rows:
+                contact = json.loads(body)
+                if self._apply(contact):
+                    archived.append(contact["ContactID"])
+                self._seq = max(self._seq, seq)
+            if state:
+                self._state = {"loaded": state[0], "pulled_at": state[1]}
+        if archived:
+            # Every process catches up, so every process's contact index LRU is cleared too
+            index = get_contact_index(self.tenant_id)
+            for contact_id in archived:
+                index.forget_contact(contact_id)
+
+    def ready(self):
+        if CONTACT_MIRROR_INTERVAL <= 0:
+            return False
+        self._catch_up()
+        return bool(self._state["loaded"]) and time.time() - self._state["pulled_at"] < CONTACT_MIRROR_MAX_STALENESS
+
+    def _one(self, index, key, unique=False):
+        ids = self._index[index].get(key) if key else None
+        if not ids or (unique and len(ids) > 1):
+            return None
+        return self.contacts.get(min(ids))
+
+    def match(self, account_number=None, legacy_account_number=None, email=None, phone=None):
+        """
+        (contact, kind) for the first hit in match-priority order —
+        kind is "account", "legacy", "email" or "phone" — or (None, None).
+        A phone number only matches when exactly one contact has it.
+        """
+        self._catch_up()
+        phone = digits_only(phone)
+        with self._lock:
+            for kind, index, key, unique in (
+                ("account", "account", account_number, False),
+                ("legacy", "account", legacy_account_number, False),
+                ("email", "email", (email or "").strip().lower(), False),
+                ("phone", "phone", phone if len(phone) >= MIN_PHONE_DIGITS else None, True),
+            ):
+                contact = self._one(index, key, unique)
+                if contact:
+                    return contact, kind
+        return None, None
+
+    def search(self, account_number=None, email=None, phone=None, limit=5):
+        """Contacts (by Name) matching every given field; all contacts when none is given."""
+        self._catch_up()
+        with self._lock:
+            candidates = None
+            for index, key in (("account", account_number), ("email", (email or "").strip().lower()), ("phone", digits_only(phone))):
+                if key:
+                    ids = self._index[index].get(key, set())
+                    candidates = set(ids) if candidates is None else candidates & ids
+            contacts = list(self.contacts.values()) if candidates is None else [self.contacts[i] for i in candidates if i in self.contacts]
+        return sorted(contacts, key=lambda c: (c.get("Name") or "").lower())[:limit]
+
+    # --- writes ---------------------------------------------------------------
+
+    def _store(self, contacts, state=None):
+        """Persist contacts (and optionally new pull state) and index them here."""
+        conn = self._db()
+        with transaction(conn):
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM contact_mirror").fetchone()[0]
+            for contact in contacts:
+                seq += 1
+                conn.execute(
+                    "INSERT OR REPLACE INTO contact_mirror (tenant, contact_id, body, seq) VALUES (?, ?, ?, ?)",
+                    (self.tenant, contact["ContactID"], json.dumps(contact), seq),
+                )
+            if state:
+                conn.execute(
+                    "UPDATE contact_mirror_state SET loaded = 1, modified_since = ?, pulled_at = ?, pulling_until = 0 "
+                    "WHERE tenant = ?",
+                    (state["modified_since"], state["pulled_at"], self.tenant),
+                )
+        self._catch_up(force=True)
+
+    def put(self, contact):
+        """Record a contact we just created or changed (merged into what we already have)."""
+        if not contact or not contact.get("ContactID"):
+            return
+        compact = _compact(contact)
+        if "Phones" not in contact:
+            del compact["Phones"]  # partial update (e.g. an AccountNumber backfill): keep the phones we have
+        with self._lock:
+            merged = {**self.contacts.get(contact["ContactID"], {}), **compact}
+        self._store([merged])
+
+    def drop(self, contact_id):
+        """Stop matching a contact Xero rejected (stored as archived, so other processes drop it too)."""
+        with self._lock:
+            known = contact_id in self.contacts
+        if known:
+            self._store([{"ContactID": contact_id, "ContactStatus": "ARCHIVED"}])
+
+    # --- pulls from Xero ------------------------------------------------------
+
+    def _claim_pull(self, max_age):
+        """
+        Take the pull lease unless someone pulled within max_age or is pulling now.
+        Returns (state, busy): state is None when not claimed, busy when another process holds the lease.
+        """
+        now = time.time()
+        conn = self._db()
+        with transaction(conn):
+            conn.execute("INSERT OR IGNORE INTO contact_mirror_state (tenant) VALUES (?)", (self.tenant,))
+            loaded, modified_since, pulled_at, pulling_until = conn.execute(
+                "SELECT loaded, modified_since, pulled_at, pulling_until FROM contact_mirror_state WHERE tenant = ?",
+                (self.tenant,),
+            ).fetchone()
+            if loaded and now - pulled_at < max_age:
+                return None, False
+            if pulling_until > now:
+                return None, True
+            conn.execute(
+                "UPDATE contact_mirror_state SET pulling_until = ? WHERE tenant = ?", (now + PULL_LEASE, self.tenant)
+            )
+        return {"loaded": loaded, "modified_since": modified_since}, False
+
+    def _fetch(self, modified_since):
+        """Every contact changed since modified_since (all of them when None), archived ones included."""
+        xero = get_xero_client(self.tenant_id)
+        headers = {}
+        if modified_since:
+            headers["If-Modified-Since"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(modified_since))
+        contacts, page = [], 1
+        while True:
+            r = xero.get(CONTACTS_URL, params={"page": page, "includeArchived": "true"}, headers=headers)
+            if r.status_code == 304:
+                break
+            if r.status_code != 200:
+                raise RuntimeError(f"Xero contacts pull failed: {r.status_code} {r.text}")
+            batch = r.json().get("Contacts") or []
+            contacts.extend(_compact(c) for c in batch)
+            if len(batch) < PAGE_SIZE:
+                break
+            page += 1
+        return contacts
+
+    def sync(self, max_age=CONTACT_MIRROR_INTERVAL, wait=0):
+        """
+        Pull from Xero unless any process did within max_age seconds.
+        Returns the number of contacts pulled, or None when skipped. While another
+        process holds the pull lease, waits up to `wait` seconds for its pull to
+        land, then raises MirrorBusy.
+        """
+        deadline = time.monotonic() + wait
+        with self._pull_lock:
+            claim, busy = self._claim_pull(max_age)
+            while busy and time.monotonic() < deadline:
+                time.sleep(LEASE_POLL_INTERVAL)
+                claim, busy = self._claim_pull(max_age)
+            if busy and wait:
+                raise MirrorBusy(f"Contact mirror for {self.tenant} is being pulled by another process")
+            if claim is None:
+                self._catch_up(force=True)
+                return None
+            started = time.time()
+            full = not claim["loaded"]
+            try:
+                contacts = self._fetch(None if full else claim["modified_since"])
+                self._store(contacts, {"modified_since": started - MODIFIED_SINCE_SKEW, "pulled_at": time.time()})
+            except BaseException:
+                # Hand the lease back, or every process skips pulling until it expires
+                self._db().execute(
+                    "UPDATE contact_mirror_state SET pulling_until = 0 WHERE tenant = ?", (self.tenant,)
+                )
+                raise
+            log.info("xero contacts pulled", tenant=self.tenant, full=full, contacts=len(contacts), mirrored=len(self.contacts))
+            return len(contacts)
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_contact_mirror(tenant_id=None):
+    """Mirror for tenant_id, else the current tenant (services/tenants.py), else the default one."""
+    tenant_id = resolve_tenant(tenant_id)
+    mirror = _mirrors.get(tenant_id)
+    if mirror is None:
+        with _mirrors_lock:
+            mirror = _mirrors.get(tenant_id)
+            if mirror is None:
+                mirror = _mirrors[tenant_id] = ContactMirror(tenant_id)
+    return mirror
+
+
+# --- background puller ---------------------------------------------------------
+
+_lock = threading.Lock()
+_started_pid = None
+
+
+def start_contact_mirror():
+    """Start the pull loop once per process (safe to call on every request, and after fork)."""
+    global _started_pid
+    if CONTACT_MIRROR_INTERVAL <= 0 or _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        threading.Thread(target=_run, name="contact-mirror", daemon=True).start()
+        _started_pid = os.getpid()
+
+
+def _run():
+    while True:
+        for tenant in list_tenants():
+            try:
+                with backfill_priority():  # never take rate-limit budget from webhook work
+                    get_contact_mirror(tenant["tenant_id"]).sync()
+            except Exception as e:
+                log.error("xero contacts pull failed", tenant=tenant["tenant_id"], error=str(e))
+        time.sleep(CONTACT_MIRROR_INTERVAL * random.uniform(0.9, 1.1))
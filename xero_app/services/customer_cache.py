@@ -0,0 +1,154 @@
+# services/customer_cache.py
+"""
+Bounded LRU of Square customers so returning clients don't cost a
+client.customers.get per order.
+
+customer.updated / customer.deleted webhooks invalidate an entry. The
+invalidation is recorded in SQLite so every gunicorn process drops its copy,
+not just the one whose worker handled the webhook. Entries also expire after
+CUSTOMER_CACHE_TTL in case a webhook is missed.
+"""
+import threading, time
+from collections import OrderedDict
+from utils.db import connect
+from config import CUSTOMER_CACHE_SIZE, CUSTOMER_CACHE_TTL, CUSTOMER_CACHE_DB
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS customer_invalidations (
+    customer_id    TEXT PRIMARY KEY,
+    version        INTEGER,
+    invalidated_at REAL NOT NULL
+);
+"""
+
+BULK_LIMIT = 100  # customer IDs per bulk-retrieve call
+
+
+def _is_current(customer, version):
+    return version is not None and (getattr(customer, "version", None) or 0) >= version
+
+
+class CustomerCache:
+    def __init__(self, fetch_one, fetch_many, size=CUSTOMER_CACHE_SIZE, ttl=CUSTOMER_CACHE_TTL, path=CUSTOMER_CACHE_DB):
+        """
+        fetch_one(customer_id) -> customer or None
+        fetch_many([ids]) -> {customer_id: customer}
+        """
+        self.fetch_one = fetch_one
+        self.fetch_many = fetch_many
+        self.size = size
+        self.ttl = ttl
+        self.path = path
+        self._lru = OrderedDict()  # customer_id -> (customer, fetched_at)
+        self._lock = threading.Lock()
+        self._ready = False
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "api_calls": 0}
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready:
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _cached(self, customer_id):
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(customer_id)
+        if entry is None:
+            return None
+        customer, fetched_at = entry
+        if now - fetched_at > self.ttl:
+            return None
+        row = self._db().execute(
+            "SELECT version, invalidated_at FROM customer_invalidations WHERE customer_id = ?", (customer_id,)
+        ).fetchone()
+        if row and row[1] >= fetched_at and not _is_current(customer, row[0]):
+            return None
+        with self._lock:
+            if customer_id in self._lru:
+                self._lru.move_to_end(customer_id)
+        return customer
+
+    def _store(self, customer_id, customer, fetched_at):
+        # fetched_at = when the fetch *started*, so an invalidation that raced the fetch still wins
+        with self._lock:
+            self._lru[customer_id] = (customer, fetched_at)
+            self._lru.move_to_end(customer_id)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def get(self, customer_id):
+        customer = self._cached(customer_id)
+        if customer is not None:
+            self._count("hits")
+            return customer
+
+        self._count("misses")
+        self._count("api_calls")
+        started = time.time()
+        customer = self.fetch_one(customer_id)
+        if customer is not None:
+            self._store(customer_id, customer, started)
+        return customer
+
+    def peek(self, customer_id):
+        """Cached customer or None — never calls Square (for callers that fetch themselves, e.g. async)."""
+        customer = self._cached(customer_id)
+        self._count("hits" if customer is not None else "misses")
+        return customer
+
+    def store(self, customer_id, customer, fetched_at):
+        """Add a customer the caller fetched itself after a peek() miss."""
+        self._count("api_calls")
+        if customer is not None:
+            self._store(customer_id, customer, fetched_at)
+
+    def get_many(self, customer_ids):
+        """Resolve many customers at once: cache first, then bulk-retrieve the rest (100 per call)."""
+        found, missing = {}, []
+        for cid in dict.fromkeys(c for c in customer_ids if c):
+            customer = self._cached(cid)
+            if customer is not None:
+                found[cid] = customer
+            else:
+                missing.append(cid)
+        self._count("hits", len(found))
+        self._count("misses", len(missing))
+
+        for i in range(0, len(missing), BULK_LIMIT):
+            chunk = missing[i:i + BULK_LIMIT]
+            self._count("api_calls")
+            started = time.time()
+            for cid, customer in self.fetch_many(chunk).items():
+                if customer is not None:
+                    self._store(cid, customer, started)
+                    found[cid] = customer
+        return found
+
+    def invalidate(self, customer_id, version=None):
+        """
+        Drop a customer in every process. Copies already at (or past) `version`
+        — the version carried by the webhook — are kept.
+        """
+        self._count("invalidations")
+        with self._lock:
+            entry = self._lru.get(customer_id)
+            if entry and not _is_current(entry[0], version):
+                del self._lru[customer_id]
+        self._db().execute(
+            "INSERT OR REPLACE INTO customer_invalidations (customer_id, version, invalidated_at) VALUES (?, ?, ?)",
+            (customer_id, version, time.time()),
+        )
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["saved_calls"] = lookups - stats["api_calls"]
+        return stats
@@ -0,0 +1,109 @@
+# services/event_dedupe.py
+"""
+Drops redelivered Square webhooks by event_id before anything else happens.
+
+A bounded in-memory LRU answers repeat deliveries to the same process; a
+SQLite seen-set (shared by every gunicorn worker, survives restarts) catches
+the rest. Entries expire after DEDUPE_TTL.
+"""
+import threading, time
+from collections import OrderedDict
+from utils.db import connect
+from config import DEDUPE_DB, DEDUPE_TTL, DEDUPE_MEMORY_SIZE
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_events (
+    event_id TEXT PRIMARY KEY,
+    seen_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seen_events_age ON seen_events (seen_at);
+"""
+
+_PURGE_EVERY = 1000  # inserts between purges of expired rows
+
+
+class EventDeduper:
+    def __init__(self, path=DEDUPE_DB, ttl=DEDUPE_TTL, size=DEDUPE_MEMORY_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self._lru = OrderedDict()  # event_id -> seen_at
+        self._lock = threading.Lock()
+        self._ready = False
+        self._inserts = 0
+        self.stats = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready:
+            conn.executescript(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def _remember(self, event_id, seen_at):
+        with self._lock:
+            self._lru[event_id] = seen_at
+            self._lru.move_to_end(event_id)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def is_duplicate(self, event_id) -> bool:
+        """Mark event_id as seen; True if it already was (within the TTL)."""
+        if not event_id:
+            return False
+        now = time.time()
+
+        with self._lock:
+            seen_at = self._lru.get(event_id)
+            if seen_at is not None and seen_at > now - self.ttl:
+                self._lru.move_to_end(event_id)
+                self.stats["memory_hits"] += 1
+                return True
+
+        # Atomic claim across processes: only one INSERT/UPDATE wins for a fresh event_id
+        cur = self._db().execute(
+            "INSERT INTO seen_events (event_id, seen_at) VALUES (?, ?) "
+            "ON CONFLICT (event_id) DO UPDATE SET seen_at = excluded.seen_at "
+            "WHERE seen_events.seen_at <= ?",
+            (event_id, now, now - self.ttl),
+        )
+        if cur.rowcount == 0:
+            self._remember(event_id, now)
+            with self._lock:
+                self.stats["store_hits"] += 1
+            return True
+
+        self._remember(event_id, now)
+        with self._lock:
+            self.stats["misses"] += 1
+            self._inserts += 1
+            purge = self._inserts % _PURGE_EVERY == 0
+        if purge:
+            self._db().execute("DELETE FROM seen_events WHERE seen_at <= ?", (now - self.ttl,))
+        return False
+
+    def forget(self, event_id):
+        """Un-mark an event we failed to decode or enqueue, so Square's retry is accepted."""
+        with self._lock:
+            self._lru.pop(event_id, None)
+        self._db().execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        total = sum(stats.values())
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["store_hits"]) / total if total else 0.0
+        return stats
+
+
+_deduper = None
+_deduper_lock = threading.Lock()
+
+
+def get_deduper():
+    global _deduper
+    if _deduper is None:
+        with _deduper_lock:
+            if _deduper is None:
+                _deduper = EventDeduper()
+    return _deduper
@@ -0,0 +1,207 @@
+# services/event_queue.py
+"""
+Durable on-disk queue for Square webhook events (SQLite in WAL mode).
+
+The webhook route only enqueue()s and returns; background workers claim()
+events, process them and ack()/nack(). A claimed event is hidden for
+QUEUE_VISIBILITY_TIMEOUT seconds — if the worker (or the whole process) dies
+before acking, the event simply becomes visible again and is retried.
+
+Events enqueued with a coalesce_key (e.g. all payment events for one order)
+replace any earlier one with the same key that no worker has picked up yet,
+so a burst collapses into a single job for the latest event.
+
+Each event records the Xero tenant it is routed to (services/tenants.py).
+claim() passes over tenants that already have QUEUE_MAX_PER_TENANT events
+in flight, so a backlog for one busy studio can't occupy every worker while
+other studios' events wait behind it.
+
+A handler that raises RetryLater (e.g. a payment whose order isn't invoiced
+yet) is deferred: re-run every QUEUE_DEFER_INTERVAL seconds without using up
+an attempt, until it is QUEUE_DEFER_MAX_AGE old.
+"""
+import json, time, uuid
+from utils.db import connect, transaction
+from services.tenants import tenant_for_event
+from config import (
+    EVENT_QUEUE_DB, QUEUE_VISIBILITY_TIMEOUT, QUEUE_MAX_ATTEMPTS, PAYMENT_DEBOUNCE_SECONDS, QUEUE_MAX_PER_TENANT,
+    QUEUE_DEFER_INTERVAL, QUEUE_DEFER_MAX_AGE,
+)
+
+DEFAULT_TENANT = "default"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id     TEXT,
+    type         TEXT,
+    coalesce_key TEXT,
+    body         TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',   -- pending | dead
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    visible_at   REAL NOT NULL,
+    claim_token  TEXT,
+    created_at   REAL NOT NULL,
+    last_error   TEXT,
+    tenant       TEXT NOT NULL DEFAULT 'default'
+);
+CREATE INDEX IF NOT EXISTS events_ready ON events (status, visible_at);
+CREATE INDEX IF NOT EXISTS events_coalesce ON events (coalesce_key);
+"""
+_INDEXES = "CREATE INDEX IF NOT EXISTS events_tenant ON events (tenant, status, visible_at);"
+
+_initialised = set()
+
+
+class RetryLater(RuntimeError):
+    """Raised by a handler whose event is waiting on another one, not failing — see defer()."""
+
+
+def _db():
+    conn = connect(EVENT_QUEUE_DB)
+    if EVENT_QUEUE_DB not in _initialised:
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(events)")}
+        if "tenant" not in columns:  # queue created before multi-tenant support
+            conn.execute("ALTER TABLE events ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'")
+        conn.executescript(_INDEXES)
+        _initialised.add(EVENT_QUEUE_DB)
+    return conn
+
+
+def enqueue(event: dict, coalesce_key=None, delay=0, raw=None):
+    """
+    Persist a raw webhook event. Returns the queue row id.
+
+    coalesce_key: drop any not-yet-claimed event with the same key (this one supersedes it).
+    delay: seconds before the event becomes visible — gives later events a chance to supersede it.
+    raw: the request body `event` was decoded from, stored as-is instead of re-encoding it.
+    """
+    now = time.time()
+    tenant = tenant_for_event(event) or DEFAULT_TENANT
+    body = raw.decode() if raw is not None else json.dumps(event)
+    row = (event.get("event_id"), event.get("type"), coalesce_key, body, now + delay, now, tenant)
+    conn = _db()
+    with transaction(conn):
+        if coalesce_key:
+            conn.execute(
+                "DELETE FROM events WHERE coalesce_key = ? AND status = 'pending' AND claim_token IS NULL",
+                (coalesce_key,),
+            )
+        cur = conn.execute(
+            "INSERT INTO events (event_id, type, coalesce_key, body, visible_at, created_at, tenant) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            row,
+        )
+    return cur.lastrowid
+
+
+def enqueue_webhook(event: dict, raw=None):
+    """Queue a Square webhook event with the coalescing rules for its type."""
+    if event["type"] in ("payment.created", "payment.updated"):
+        # Square sends several of these per payment — keep only the latest per order
+        payment = ((event.get("data") or {}).get("object") or {}).get("payment") or {}
+        order_id = payment.get("order_id")
+        return enqueue(
+            event,
+            coalesce_key=f"payment:{order_id}" if order_id else None,
+            delay=PAYMENT_DEBOUNCE_SECONDS,
+            raw=raw,
+        )
+    if event["type"] == "catalog.version.updated":
+        # One incremental refresh covers any number of queued version bumps
+        return enqueue(event, coalesce_key="catalog", raw=raw)
+    return enqueue(event, raw=raw)
+
+
+def claim():
+    """
+    Claim the oldest visible event whose tenant is below QUEUE_MAX_PER_TENANT in-flight events.
+    Returns (row_id, claim_token, event, attempts) or None when nothing is claimable.
+    """
+    now = time.time()
+    token = uuid.uuid4().hex
+    conn = _db()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT id, body, attempts FROM events "
+            "WHERE status = 'pending' AND visible_at <= ? AND tenant NOT IN ("
+            "  SELECT tenant FROM events "
+            "  WHERE status = 'pending' AND claim_token IS NOT NULL AND visible_at > ? "
+            "  GROUP BY tenant HAVING COUNT(*) >= ?"
+            ") ORDER BY id LIMIT 1",
+            (now, now, QUEUE_MAX_PER_TENANT),
+        ).fetchone()
+        if not row:
+            return None
+        row_id, body, attempts = row
+        conn.execute(
+            "UPDATE events SET visible_at = ?, claim_token = ?, attempts = attempts + 1 WHERE id = ?",
+            (now + QUEUE_VISIBILITY_TIMEOUT, token, row_id),
+        )
+    return row_id, token, json.loads(body), attempts + 1
+
+
+def ack(row_id, token):
+    """Remove a processed event. Ignored if our claim already expired and someone else holds it."""
+    _db().execute("DELETE FROM events WHERE id = ? AND claim_token = ?", (row_id, token))
+
+
+def nack(row_id, token, error=None):
+    """
+    Return a failed event to the queue with exponential backoff,
+    or park it as 'dead' once it has used up QUEUE_MAX_ATTEMPTS.
+    """
+    conn = _db()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT attempts FROM events WHERE id = ? AND claim_token = ?", (row_id, token)
+        ).fetchone()
+        if not row:
+            return
+        attempts = row[0]
+        if attempts >= QUEUE_MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE events SET status = 'dead', claim_token = NULL, last_error = ? WHERE id = ?",
+                (error, row_id),
+            )
+        else:
+            delay = min(2 ** attempts, 300)
+            conn.execute(
+                "UPDATE events SET visible_at = ?, claim_token = NULL, last_error = ? WHERE id = ?",
+                (time.time() + delay, error, row_id),
+            )
+
+
+def defer(row_id, token, error=None, delay=QUEUE_DEFER_INTERVAL):
+    """
+    Return an event to the queue to run again in `delay` seconds without using up
+    an attempt. Once it is QUEUE_DEFER_MAX_AGE old it is nack()ed like a failure.
+    """
+    conn = _db()
+    with transaction(conn):
+        row = conn.execute(
+            "SELECT created_at FROM events WHERE id = ? AND claim_token = ?", (row_id, token)
+        ).fetchone()
+        if not row:
+            return
+        if time.time() - row[0] < QUEUE_DEFER_MAX_AGE:
+            conn.execute(
+                "UPDATE events SET visible_at = ?, claim_token = NULL, attempts = attempts - 1, last_error = ? WHERE id = ?",
+                (time.time() + delay, error, row_id),
+            )
+            return
+    nack(row_id, token, error)
+
+
+def stats():
+    """Counts of ready / in-flight (claimed or backing off) / dead events."""
+    now = time.time()
+    pending, in_flight, dead = _db().execute(
+        "SELECT "
+        "  COALESCE(SUM(status = 'pending' AND visible_at <= ?), 0), "
+        "  COALESCE(SUM(status = 'pending' AND visible_at > ?), 0), "
+        "  COALESCE(SUM(status = 'dead'), 0) "
+        "FROM events",
+        (now, now),
+    ).fetchone()
+    return {"pending": pending, "in_flight": in_flight, "dead": dead}
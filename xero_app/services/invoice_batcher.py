@@ -0,0 +1,85 @@
+# services/invoice_batcher.py
+"""
+Coalesces invoice creations from concurrent workers into one multi-invoice
+POST /Invoices (Xero accepts many invoices per request).
+
+Callers submit() a single invoice dict and block on the returned Future.
+A background thread waits up to `window` seconds (or `max_size` invoices),
+posts the batch with summarizeErrors=false, and hands each caller back its
+own invoice — or its own validation errors.
+"""
+import threading, time
+from concurrent.futures import Future
+
+
+class InvoiceValidationError(RuntimeError):
+    def __init__(self, message, messages=()):
+        super().__init__(message)
+        self.messages = list(messages)  # Xero's ValidationErrors messages
+
+
+class InvoiceBatcher:
+    def __init__(self, post, window: float, max_size: int):
+        """
+        post: callable(payload, params) -> requests.Response (e.g. XeroClient.post bound to the Invoices URL)
+        """
+        self.post = post
+        self.window = window
+        self.max_size = max_size
+        self._pending = []  # [(invoice, future)]
+        self._cond = threading.Condition()
+        self.stats = {"invoices": 0, "requests": 0}
+        threading.Thread(target=self._run, name="invoice-batcher", daemon=True).start()
+
+    def submit(self, invoice: dict) -> Future:
+        fut = Future()
+        with self._cond:
+            self._pending.append((invoice, fut))
+            self._cond.notify()
+        return fut
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending[:self.max_size], self._pending[self.max_size:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _flush(self, batch):
+        self.stats["requests"] += 1
+        self.stats["invoices"] += len(batch)
+
+        resp = self.post({"Invoices": [inv for inv, _ in batch]}, {"summarizeErrors": "false"})
+        if resp.status_code not in (200, 201):
+            raise RuntimeError(f"Xero invoice create failed: {resp.status_code} {resp.text}")
+
+        # Xero returns the invoices in request order, each flagged OK/ERROR
+        results = resp.json().get("Invoices", [])
+        for i, (_, fut) in enumerate(batch):
+            result = results[i] if i < len(results) else None
+            if result is None:
+                fut.set_exception(RuntimeError("Xero invoice create failed: missing result in batch response"))
+            elif result.get("HasErrors") or result.get("StatusAttributeString") == "ERROR":
+                errors = [e.get("Message") for e in result.get("ValidationErrors", [])]
+                fut.set_exception(InvoiceValidationError(f"Xero invoice create failed: {errors}", errors))
+            else:
+                fut.set_result(result)
+
+    def calls_per_invoice(self):
+        return self.stats["requests"] / self.stats["invoices"] if self.stats["invoices"] else 0.0
@@ -0,0 +1,107 @@
+# services/order_batcher.py
+"""
+Coalesces Square order fetches into orders.batch_get calls (up to 100 IDs each).
+
+Workers submit() one order ID and block on the returned Future. A background
+thread waits up to `window` seconds (or `max_size` IDs), retrieves them in
+one call and hands each caller its own order. Concurrent requests for the
+same ID share one Future. Bulk jobs call get_many(), which skips the window
+and goes straight to chunks of `max_size`.
+"""
+import os, threading, time
+from concurrent.futures import Future
+
+SQUARE_BATCH_LIMIT = 100  # orders.batch_get accepts at most 100 order IDs
+
+
+class OrderNotFound(RuntimeError):
+    pass
+
+
+class OrderBatcher:
+    def __init__(self, fetch_many, window: float, max_size: int = SQUARE_BATCH_LIMIT):
+        """
+        fetch_many: callable(order_ids) -> {order_id: order} (orders Square didn't return are missing)
+        """
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_size = min(max_size, SQUARE_BATCH_LIMIT)
+        self._pending = {}  # order_id -> Future, in submission order
+        self._cond = threading.Condition()
+        self.stats = {"orders": 0, "requests": 0}
+        self._started_pid = None
+
+    def _start(self):
+        """Flush thread, started on first use in each process (module import may happen before fork)."""
+        if self._started_pid == os.getpid():
+            return
+        with self._cond:
+            if self._started_pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name="order-batcher", daemon=True).start()
+            self._started_pid = os.getpid()
+
+    def submit(self, order_id) -> Future:
+        self._start()
+        with self._cond:
+            fut = self._pending.get(order_id)
+            if fut is None:
+                fut = self._pending[order_id] = Future()
+                self._cond.notify()
+        return fut
+
+    def get(self, order_id):
+        return self.submit(order_id).result()
+
+    def get_many(self, order_ids):
+        """{order_id: order} for many IDs, max_size per call, no window. Missing orders are left out."""
+        ids = list(dict.fromkeys(i for i in order_ids if i))
+        found = {}
+        for start in range(0, len(ids), self.max_size):
+            chunk = ids[start:start + self.max_size]
+            self._count(len(chunk))
+            found.update(self.fetch_many(chunk))
+        return found
+
+    def _count(self, n):
+        with self._cond:
+            self.stats["requests"] += 1
+            self.stats["orders"] += n
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = list(self._pending.items())[:self.max_size]
+            for order_id, _ in batch:
+                del self._pending[order_id]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _flush(self, batch):
+        self._count(len(batch))
+        orders = self.fetch_many([order_id for order_id, _ in batch])
+        for order_id, fut in batch:
+            order = orders.get(order_id)
+            if order is None:
+                fut.set_exception(OrderNotFound(f"Square order {order_id} not found"))
+            else:
+                fut.set_result(order)
+
+    def calls_per_order(self):
+        return self.stats["requests"] / self.stats["orders"] if self.stats["orders"] else 0.0
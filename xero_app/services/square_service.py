@@ -1,27 +1,77 @@
+import httpx
 from square import Square
-from config import SQUARE_ACCESS_TOKEN, SQUARE_ENV
+from utils.circuit_breaker import get_breaker
+from utils import metrics
+from utils.log import get_logger
+from services.catalog_cache import CatalogCache
+from services.customer_cache import CustomerCache
+from services.order_batcher import OrderBatcher
+from config import (
+    SQUARE_ACCESS_TOKEN, SQUARE_ENV, SQUARE_BASE_URL, SQUARE_TIMEOUT, HTTP_MAX_RETRIES,
+    SQUARE_ORDER_BATCH_WINDOW, SQUARE_ORDER_BATCH_MAX,
+)
+
+client = Square(
+    token=SQUARE_ACCESS_TOKEN,
+    environment=SQUARE_ENV,
+    base_url=SQUARE_BASE_URL,
+    timeout=SQUARE_TIMEOUT,
+    httpx_client=httpx.Client(timeout=SQUARE_TIMEOUT, transport=metrics.MeteredTransport()),  # counts calls for /metrics
+)
+
+log = get_logger(__name__)
+
+# Reads are idempotent: let the SDK retry them (exponential backoff) and trip
+# the breaker when Square keeps failing, so workers fail fast instead of hanging.
+READ_OPTIONS = {"max_retries": HTTP_MAX_RETRIES, "timeout_in_seconds": SQUARE_TIMEOUT}
+square_breaker = get_breaker("connect.squareup.com")
+catalog_cache = CatalogCache(client)
+
+APPOINTMENT_PRODUCT_TYPES = {"APPOINTMENTS_SERVICE"}
+
+
+def _upstream_failure(e):
+    """Only 5xx/429/transport errors count against Square — a 404 is our problem, not theirs."""
+    status = getattr(e, "status_code", None)
+    return status is None or status == 429 or status >= 500
 
-client = Square(token=SQUARE_ACCESS_TOKEN, environment=SQUARE_ENV)
 
 def extract_services_from_order(order):
     """
-    Extract services, variation names, prices, and quantities
-    for Beauty Services and Photoshoot Deposit Collections.
+    Extract services, variation names, prices, quantities and catalog refs
+    ({"variation_id", "item_id", "category_id"}, for account-code rules)
+    for appointment services (Beauty Services, Photoshoot Deposit Collections, ...).
+
+    Line items are classified by their catalog item's product_type (see
+    square_structure.md) using the local catalog cache. Lines without a catalog
+    object (custom amounts) or that the catalog can't resolve fall back to the
+    ALLOWED_NAMES list.
     """
-    services, variation_names, prices, quantities = [], [], [], []
+    services, variation_names, prices, quantities, catalog_refs = [], [], [], [], []
 
     if not getattr(order, "line_items", None):
-        return services, variation_names, prices, quantities
+        return services, variation_names, prices, quantities, catalog_refs
 
     ALLOWED_NAMES = {
         "beauty services (discounted)",
         "deposit - photoshoot collections",
     }
 
-    for li in order.line_items:
-        name = (getattr(li, "name", "") or "").lower()
-        if name not in ALLOWED_NAMES:
-            continue
+    catalog_ids = [getattr(li, "catalog_object_id", None) for li in order.line_items]
+    try:
+        catalog_cache.resolve(catalog_ids)
+    except Exception as e:
+        log.warning("catalog lookup failed, falling back to names", error=str(e))
+
+    for li, catalog_id in zip(order.line_items, catalog_ids):
+        info = catalog_cache.lookup(catalog_id) if catalog_id else None
+        if info and info["product_type"]:
+            if info["product_type"] not in APPOINTMENT_PRODUCT_TYPES:
+                continue
+        else:
+            name = (getattr(li, "name", "") or "").lower()
+            if name not in ALLOWED_NAMES:
+                continue
 
         services.append(li.name)
         variation_names.append(getattr(li, "variation_name", None))
@@ -29,19 +79,116 @@ def extract_services_from_order(order):
             (getattr(li, "total_money", None).amount if getattr(li, "total_money", None) else 0) / 100
         )
         quantities.append(int(getattr(li, "quantity", "0")))
+        catalog_refs.append({
+            "variation_id": catalog_id,
+            "item_id": info["item_id"] if info else None,
+            "category_id": info["category_id"] if info else None,
+        })
 
-    return services, variation_names, prices, quantities
+    return services, variation_names, prices, quantities, catalog_refs
+
+
+def _fetch_orders(order_ids):
+    resp = square_breaker.call(
+        client.orders.batch_get,
+        order_ids=order_ids, request_options=READ_OPTIONS, is_failure=_upstream_failure,
+    )
+    return {o.id: o for o in (getattr(resp, "orders", None) or [])}
+
+
+# Shares one orders.batch_get with whatever other orders are being fetched right now
+order_batcher = OrderBatcher(_fetch_orders, window=SQUARE_ORDER_BATCH_WINDOW, max_size=SQUARE_ORDER_BATCH_MAX)
 
 
 def get_order(order_id):
-    order_resp = client.orders.get(order_id)
+    with metrics.stage("square_order_fetch"):
+        if SQUARE_ORDER_BATCH_WINDOW > 0:
+            return order_batcher.get(order_id)
+        order_resp = square_breaker.call(
+            client.orders.get, order_id, request_options=READ_OPTIONS, is_failure=_upstream_failure
+        )
     order = order_resp.order
     return order
     # return client.orders.retrieve_order(order_id).body.get("order")
 
 
+def get_orders(order_ids):
+    """{order_id: order} for many IDs (reconciliation, bulk jobs) — up to 100 per Square call."""
+    with metrics.stage("square_order_fetch"):
+        return order_batcher.get_many(order_ids)
+
+
+def _fetch_customer(customer_id):
+    return square_breaker.call(
+        client.customers.get, customer_id, request_options=READ_OPTIONS, is_failure=_upstream_failure
+    ).customer
+
+
+def _fetch_customers(customer_ids):
+    resp = square_breaker.call(
+        client.customers.bulk_retrieve_customers,
+        customer_ids=customer_ids, request_options=READ_OPTIONS, is_failure=_upstream_failure,
+    )
+    return {cid: getattr(r, "customer", None) for cid, r in (getattr(resp, "responses", None) or {}).items()}
+
+
+customer_cache = CustomerCache(_fetch_customer, _fetch_customers)
+
+
 def get_customer(customer_id):
-    return client.customers.get(customer_id).customer
+    with metrics.stage("square_customer_fetch"):
+        return customer_cache.get(customer_id)
+
+
+def get_customers(customer_ids):
+    """{customer_id: customer} for many IDs — cached ones free, the rest via bulk retrieve."""
+    return customer_cache.get_many(customer_ids)
+
+
+_SETTLED_PAYMENT_STATUSES = ("COMPLETED", "APPROVED")
+
+
+def tender_reference_from_payment(payment: dict):
+    """
+    The same reference format_tender_reference() builds from the order's tender,
+    taken straight from a webhook's payment object — no Square call. Returns None
+    when the payment lacks the fields, or isn't COMPLETED / APPROVED (a failed or
+    canceled card attempt); the caller then uses the order's tenders, which only
+    hold captured / approved payments.
+    For a split-tender order this describes the payment that fired the event.
+    """
+    source_type = payment.get("source_type")
+    if not source_type or payment.get("status") not in _SETTLED_PAYMENT_STATUSES:
+        return None
+
+    if source_type == "CARD":
+        card = (payment.get("card_details") or {}).get("card") or {}
+        brand, last4 = card.get("card_brand"), card.get("last_4")
+        if brand == "SQUARE_GIFT_CARD":
+            return "Square SQUARE_GIFT_CARD"  # the order's tender type for gift cards
+        if not brand or not last4:
+            return None
+        return f"Square {brand} ****{last4}"
+
+    elif source_type == "CASH":
+        return "Square Cash"
+
+    elif source_type == "EXTERNAL":
+        return "EXTERNAL"  # tender type OTHER
+
+    else:
+        return f"Square {source_type}"
+
+
+def payment_tender_reference(payment: dict, order_id) -> str:
+    """Tender reference for a payment event: from the payload when possible, else from the order."""
+    reference = tender_reference_from_payment(payment)
+    if reference is not None:
+        metrics.TENDER_REFERENCES.labels(source="payment").inc()
+        return reference
+    metrics.TENDER_REFERENCES.labels(source="order").inc()
+    return format_tender_reference(get_order(order_id))
+
 
 def format_tender_reference(order) -> str:
     """
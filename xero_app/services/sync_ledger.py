@@ -0,0 +1,126 @@
+# services/sync_ledger.py
+"""
+Local ledger (SQLite WAL) of which Square order became which Xero invoice.
+
+Written as an order moves through the pipeline, so payment events and
+"already synced?" checks are answered locally instead of asking Xero.
+"""
+import time
+from utils.db import connect
+from config import SYNC_LEDGER_DB
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id             TEXT PRIMARY KEY,
+    invoice_id           TEXT,
+    invoice_number       TEXT,
+    contact_id           TEXT,
+    status               TEXT,
+    reference            TEXT,
+    received_at          REAL,   -- order.created handled
+    contact_resolved_at  REAL,   -- Xero contact found/created
+    invoiced_at          REAL,   -- Xero invoice created
+    reference_updated_at REAL,   -- tender reference written
+    skipped              TEXT,   -- why the order will never get an invoice (no_items, no_customer, ...)
+    updated_at           REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_invoice ON orders (invoice_id);
+"""
+
+_COLUMNS = (
+    "order_id", "invoice_id", "invoice_number", "contact_id", "status", "reference",
+    "received_at", "contact_resolved_at", "invoiced_at", "reference_updated_at", "skipped", "updated_at",
+)
+
+_initialised = set()
+
+
+def _db():
+    conn = connect(SYNC_LEDGER_DB)
+    if SYNC_LEDGER_DB not in _initialised:
+        conn.executescript(_SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(orders)")}
+        if "skipped" not in columns:  # ledger created before skipped orders were recorded
+            conn.execute("ALTER TABLE orders ADD COLUMN skipped TEXT")
+        _initialised.add(SYNC_LEDGER_DB)
+    return conn
+
+
+def _upsert(order_id, **fields):
+    # None means "unknown", never "clear it"
+    fields = {k: v for k, v in fields.items() if v is not None}
+    fields["updated_at"] = time.time()
+    names = ", ".join(fields)
+    marks = ", ".join("?" for _ in fields)
+    updates = ", ".join(f"{k} = excluded.{k}" for k in fields)
+    _db().execute(
+        f"INSERT INTO orders (order_id, {names}) VALUES (?, {marks}) "
+        f"ON CONFLICT (order_id) DO UPDATE SET {updates}",
+        (order_id, *fields.values()),
+    )
+
+
+def get(order_id):
+    """Ledger row for an order as a dict, or None."""
+    row = _db().execute(f"SELECT {', '.join(_COLUMNS)} FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    return dict(zip(_COLUMNS, row)) if row else None
+
+
+def is_synced(order_id) -> bool:
+    """True once a Xero invoice exists for the order."""
+    row = _db().execute("SELECT invoice_id FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    return bool(row and row[0])
+
+
+def invoice_attempted(order_id) -> bool:
+    """True when the invoice POST may already have reached Xero (contact resolved) but no invoice is recorded."""
+    row = _db().execute("SELECT contact_resolved_at, invoice_id FROM orders WHERE order_id = ?", (order_id,)).fetchone()
+    return bool(row and row[0] and not row[1])
+
+
+def mark_received(order_id):
+    _db().execute(
+        "INSERT INTO orders (order_id, received_at, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT (order_id) DO NOTHING",
+        (order_id, time.time(), time.time()),
+    )
+
+
+def record_skipped(order_id, reason):
+    """The order isn't one we invoice (payments for it can be dropped)."""
+    _upsert(order_id, skipped=reason)
+
+
+def record_contact(order_id, contact_id):
+    _upsert(order_id, contact_id=contact_id, contact_resolved_at=time.time())
+
+
+def record_invoice(order_id, invoice: dict, invoiced_at=None):
+    """Store a Xero invoice (as returned by the API) against its Square order."""
+    _upsert(
+        order_id,
+        invoice_id=invoice.get("InvoiceID"),
+        invoice_number=invoice.get("InvoiceNumber"),
+        contact_id=(invoice.get("Contact") or {}).get("ContactID"),
+        status=invoice.get("Status"),
+        reference=invoice.get("Reference"),
+        invoiced_at=invoiced_at or time.time(),
+    )
+
+
+def record_reference(invoice_id, reference):
+    _db().execute(
+        "UPDATE orders SET reference = ?, reference_updated_at = ?, updated_at = ? WHERE invoice_id = ?",
+        (reference, time.time(), time.time(), invoice_id),
+    )
+
+
+def as_invoice(entry: dict):
+    """Shape a ledger row like the Xero invoice dict callers already expect."""
+    return {
+        "InvoiceID": entry["invoice_id"],
+        "InvoiceNumber": entry["invoice_number"],
+        "Status": entry["status"],
+        "Reference": entry["reference"],
+        "Contact": {"ContactID": entry["contact_id"]},
+    }
@@ -0,0 +1,188 @@
+# services/sync_service.py
+"""
+Square → Xero sync handlers. Called by the queue workers, not by the webhook route.
+Handlers raise on failure so the event is nacked and retried.
+"""
+from services.square_service import payment_tender_reference, get_order, get_customer, extract_services_from_order, catalog_cache, customer_cache
+from services.xero_service import find_or_create_contact_from_square, create_xero_invoice, get_xero_invoice_by_order_id, update_xero_invoice_reference, ContactRejected
+from services import sync_ledger, tenants
+from services.event_queue import RetryLater
+from utils.log import get_logger
+from config import MERCHANT_TIMEZONE
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+log = get_logger(__name__)
+
+
+def handle_event(event: dict):
+    """Dispatch a queued Square webhook event to its handler, against the event's Xero tenant."""
+    with tenants.use_tenant(tenants.tenant_for_event(event)):
+        _dispatch(event)
+
+
+def _dispatch(event: dict):
+    event_type = event.get("type")
+
+    if event_type == "order.created":
+        order_id = event["data"]["object"]["order_created"]["order_id"]
+        if sync_ledger.is_synced(order_id):
+            log.info("order already synced")
+            return
+        sync_ledger.mark_received(order_id)
+        sync_order(get_order(order_id))
+    elif event_type in ("payment.created", "payment.updated"):
+        sync_payment(event["data"]["object"]["payment"])
+    elif event_type == "catalog.version.updated":
+        catalog_cache.refresh()
+    elif event_type in ("customer.updated", "customer.deleted"):
+        data = event.get("data") or {}
+        customer = (data.get("object") or {}).get("customer") or {}
+        customer_cache.invalidate(data.get("id") or customer.get("id"), customer.get("version"))
+
+
+def order_invoice_items(order):
+    """Invoice line dicts for the order's appointment services (empty if none)."""
+    services, variation_names, prices, quantities, catalog_refs = extract_services_from_order(order)
+    items = []
+    for desc, var_name, price, qty, refs in zip(services, variation_names, prices, quantities, catalog_refs):
+        items.append({
+            "description": desc,
+            "var_name": var_name,
+            "quantity": qty,
+            "unit_amount": price,
+            **refs,
+        })
+    return items
+
+
+def order_invoice_date(order):
+    """The order's created_at as a date in MERCHANT_TIMEZONE, or None (invoice dated today)."""
+    created_at = getattr(order, "created_at", None)
+    if not created_at:
+        return None
+    try:
+        created = datetime.fromisoformat(created_at.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return created.astimezone(ZoneInfo(MERCHANT_TIMEZONE)).date()
+
+
+def skip_reason(order, items):
+    """Why an order won't be invoiced (before the customer fetch), or None."""
+    if not items:
+        return "no_items"
+    if not getattr(order, "customer_id", None):
+        return "no_customer"
+    return None
+
+
+class InvoiceNotReady(RetryLater):
+    """A payment's order may still be invoiced; the queue defers the payment (no attempt used)."""
+
+
+def check_invoice_expected(order_id):
+    """
+    Called when a payment's order has no Xero invoice. Returns quietly when the order
+    will never be invoiced; raises InvoiceNotReady while it still may be (the payment
+    beat order.created, or the order is mid-sync).
+    """
+    entry = sync_ledger.get(order_id)
+    if entry and entry["skipped"]:
+        return
+    if entry is None:
+        # order.created not handled yet: decide from the order itself
+        order = get_order(order_id)
+        reason = skip_reason(order, order_invoice_items(order))
+        if reason:
+            sync_ledger.record_skipped(order_id, reason)
+            return
+    raise InvoiceNotReady(f"No Xero invoice yet for order {order_id}")
+
+
+def invoice_from_lost_attempt(order_id):
+    """
+    The invoice an earlier attempt created without us seeing the response (timeout /
+    5xx after Xero saved it), looked up by InvoiceNumber — or None. Only asked when
+    the ledger shows that attempt got as far as the invoice POST.
+    """
+    if not sync_ledger.invoice_attempted(order_id):
+        return None
+    return get_xero_invoice_by_order_id(order_id)
+
+
+def sync_order(order):
+    """Create the Xero contact (if needed) and invoice for a Square order."""
+    log.info("syncing order", order_id=order.id)
+    if sync_ledger.is_synced(order.id):
+        return None
+    existing = invoice_from_lost_attempt(order.id)
+    if existing:
+        log.info("xero invoice found from an earlier attempt", invoice_id=existing.get("InvoiceID"))
+        return {"Invoices": [existing]}
+
+    items = order_invoice_items(order)
+    reason = skip_reason(order, items)
+    if reason:
+        sync_ledger.record_skipped(order.id, reason)
+        return None
+
+    cust = get_customer(order.customer_id)
+    if not cust:
+        sync_ledger.record_skipped(order.id, "customer_not_found")
+        return None
+
+    xero_contact, created = find_or_create_contact_from_square(cust)
+    try:
+        invoice = _invoice_order(order, items, xero_contact, created)
+    except ContactRejected as e:
+        # The cached/mirrored contact is archived or gone in Xero: forget it and match again
+        log.warning("xero contact rejected", contact_id=e.contact_id)
+        xero_contact, created = find_or_create_contact_from_square(cust, rejected_contact_id=e.contact_id)
+        invoice = _invoice_order(order, items, xero_contact, created)
+
+    created_invoice = (invoice.get("Invoices") or [{}])[0]
+    log.info("xero invoice created", invoice_id=created_invoice.get("InvoiceID"))
+    return invoice
+
+
+def _invoice_order(order, items, xero_contact, created):
+    log.info("xero contact resolved", contact_id=xero_contact.get("ContactID"), created=created)
+    sync_ledger.record_contact(order.id, xero_contact.get("ContactID"))
+    return create_xero_invoice(
+        contact_id=xero_contact.get("ContactID"),
+        items=items,
+        square_order_id=order.id,
+        reference="Square (Pending Payment)",
+        invoice_date=order_invoice_date(order),  # backfilled orders belong to their own period
+    )
+
+
+def sync_payment(payment: dict):
+    """
+    Write the tender (card brand / last 4, cash, ...) onto the order's Xero invoice.
+    The tender comes from the payment payload itself; the order is only fetched
+    when the payload is missing those fields.
+    Bursts of payment events are already collapsed by the queue (coalesce_key per order);
+    the write is skipped when the invoice already carries this reference. A payment
+    that arrives before its order's invoice exists is retried, not dropped.
+    """
+    order_id = payment.get("order_id")
+    if not order_id:
+        return
+
+    invoice = get_xero_invoice_by_order_id(order_id)
+    if not invoice:
+        check_invoice_expected(order_id)  # raises (retry later) unless the order is never invoiced
+        return
+
+    ref_text = payment_tender_reference(payment, order_id)
+    if invoice.get("Reference") == ref_text:
+        log.info("invoice reference unchanged", invoice_id=invoice["InvoiceID"])
+        return
+
+    update_xero_invoice_reference(
+        invoice_id=invoice["InvoiceID"],
+        reference=ref_text
+    )
+    log.info("invoice reference updated", invoice_id=invoice["InvoiceID"], reference=ref_text)
@@ -0,0 +1,87 @@
+# services/tenants.py
+"""
+Which Xero tenant (organisation) a Square event belongs to.
+
+Routes come from TENANT_ROUTES_FILE (see tenant_routes.example.json):
+
+    {"locations": {"<square location_id>": "<xero tenant_id>", ...},
+     "merchants": {"<square merchant_id>": "<xero tenant_id>", ...}}
+
+A location route wins over a merchant route; with no match (or no file) the
+event goes to the default tenant chosen at /xero/callback. The file is
+re-checked by mtime, so a new studio can be routed without a restart.
+
+The tenant for the work in progress is carried in a contextvar —
+`with use_tenant(tenant_id):` — so every Xero client, contact index and
+invoice batcher below the handler picks it up without threading it through
+each call.
+"""
+import contextvars, json, os, threading
+from contextlib import contextmanager
+from utils.log import get_logger
+from config import TENANT_ROUTES_FILE
+
+log = get_logger(__name__)
+
+_current = contextvars.ContextVar("xero_tenant", default=None)
+_routes = {"mtime": None, "locations": {}, "merchants": {}}
+_routes_lock = threading.Lock()
+
+
+@contextmanager
+def use_tenant(tenant_id):
+    """Run the block against tenant_id (None = the default tenant)."""
+    token = _current.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def _load_routes():
+    try:
+        mtime = os.stat(TENANT_ROUTES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == _routes["mtime"]:
+        return _routes
+
+    with _routes_lock:
+        if mtime == _routes["mtime"]:
+            return _routes
+        spec = {}
+        if mtime is not None:
+            try:
+                with open(TENANT_ROUTES_FILE) as f:
+                    spec = json.load(f)
+            except (OSError, ValueError) as e:
+                _routes["mtime"] = mtime  # keep the previous routes until the file changes again
+                log.error("tenant routes not reloaded", path=TENANT_ROUTES_FILE, error=str(e))
+                return _routes
+        _routes.update(
+            mtime=mtime,
+            locations=dict(spec.get("locations") or {}),
+            merchants=dict(spec.get("merchants") or {}),
+        )
+        log.info("tenant routes loaded", locations=len(_routes["locations"]), merchants=len(_routes["merchants"]))
+        return _routes
+
+
+def tenant_for(location_id=None, merchant_id=None):
+    """Xero tenant_id routed for a Square location / merchant, or None for the default tenant."""
+    routes = _load_routes()
+    return routes["locations"].get(location_id) or routes["merchants"].get(merchant_id)
+
+
+def tenant_for_event(event: dict):
+    """Xero tenant_id for a Square webhook event, or None for the default tenant."""
+    obj = ((event.get("data") or {}).get("object") or {})
+    location_id = next(
+        (o.get("location_id") for o in (obj.get("order_created"), obj.get("order_updated"), obj.get("payment")) if o),
+        None,
+    )
+    return tenant_for(location_id=location_id, merchant_id=event.get("merchant_id"))
@@ -0,0 +1,96 @@
+# services/token_refresher.py
+"""
+Background thread that renews the Xero access token TOKEN_REFRESH_AHEAD
+seconds before it expires, so webhook/sync requests only ever read a ready
+token (services/token_service.py) instead of paying for the identity.xero.com
+round-trip themselves.
+
+Every process runs one; the token file lock and re-check in refresh_if_due()
+mean only one of them actually calls Xero, the rest just pick up the new file.
+Failures are retried with jittered exponential backoff (capped at
+TOKEN_REFRESH_MAX_BACKOFF) and reported by health().
+"""
+import os, random, threading, time
+from services.token_service import refresh_if_due, token_expires_at
+from utils import metrics
+from utils.log import get_logger
+from config import TOKEN_REFRESH_AHEAD, TOKEN_REFRESH_MAX_BACKOFF, TOKEN_REFRESH_CHECK_INTERVAL
+
+log = get_logger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_started_pid = None
+_state = {"last_refresh_at": None, "last_error": None, "last_error_at": None, "consecutive_failures": 0}
+
+
+def start_token_refresher():
+    """Start the refresher thread once per process (safe to call repeatedly, and after fork)."""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        threading.Thread(target=_run, name="xero-token-refresher", daemon=True).start()
+        _started_pid = os.getpid()
+
+
+def notify():
+    """Re-check now (e.g. right after the OAuth callback saved new tokens)."""
+    _wakeup.set()
+
+
+def _backoff(failures):
+    return random.uniform(0, min(TOKEN_REFRESH_MAX_BACKOFF, 2 ** failures))
+
+
+def _run():
+    while True:
+        try:
+            refreshed = refresh_if_due(TOKEN_REFRESH_AHEAD)
+        except Exception as e:
+            _state["consecutive_failures"] += 1
+            _state["last_error"] = str(e)
+            _state["last_error_at"] = time.time()
+            metrics.TOKEN_REFRESH_FAILURES.inc()
+            log.error("xero token refresh failed", failures=_state["consecutive_failures"], error=str(e))
+            delay = _backoff(_state["consecutive_failures"])
+        else:
+            if refreshed:
+                _state["last_refresh_at"] = time.time()
+                log.info("xero token refreshed", expires_at=token_expires_at())
+            _state["consecutive_failures"] = 0
+            _state["last_error"] = None
+            expires_at = token_expires_at()
+            due_in = expires_at - TOKEN_REFRESH_AHEAD - time.time() if expires_at else TOKEN_REFRESH_CHECK_INTERVAL
+            # Wake at least every check interval: another process may have refreshed (or a reconnect happened)
+            delay = min(max(due_in, 1), TOKEN_REFRESH_CHECK_INTERVAL)
+        _wakeup.wait(delay)
+        _wakeup.clear()
+
+
+def health():
+    """
+    Token status for monitoring:
+      ok           – every token valid and the last refresh attempt (if any) succeeded
+      degraded     – token still valid but refreshes are failing
+      expired      – a token expired (requests will fail or fall back to a blocking refresh)
+      disconnected – no tokens (run the Xero OAuth flow)
+    """
+    expires_at = token_expires_at()
+    now = time.time()
+    if expires_at is None:
+        status = "disconnected"
+    elif expires_at <= now:
+        status = "expired"
+    elif _state["consecutive_failures"]:
+        status = "degraded"
+    else:
+        status = "ok"
+    return {
+        "status": status,
+        "refresher_running": _started_pid == os.getpid(),
+        "expires_in": round(expires_at - now) if expires_at else None,
+        **_state,
+    }
@@ -1,35 +1,247 @@
-import json, os, time, requests
+"""
+Xero OAuth tokens for every connected tenant (organisation).
+
+One OAuth consent ("grant", keyed by Xero's authEventId) can cover several
+tenants, and the grant's refresh token rotates on every refresh — so tokens
+are stored per grant and tenants point at their grant:
+
+    {"grants":  {grant_id: {"tokens": {...}, "obtained_at": ...}},
+     "tenants": {tenant_id: {"grant": grant_id, "name": ...}},
+     "default_tenant": tenant_id}
+
+The single-tenant file written by older versions ({"tokens", "tenant_id",
+"obtained_at"}) is read as one grant called "default".
+
+The document lives in the shared token store (services/token_store.py: local
+file, SQLite or Redis). Every write is a compare-and-swap against the version
+that was read, so processes and instances sharing one store never overwrite
+each other's newer tokens.
+"""
+import time, threading
+import requests
 from utils.auth import basic_auth_header
-from config import CLIENT_ID, CLIENT_SECRET, TOKEN_URL, TOKENS_FILE
+from utils.http import build_session, timeout_for
+from utils import metrics
+from utils.log import get_logger
+from services import tenants
+from services.token_store import get_token_store
+from config import CLIENT_ID, CLIENT_SECRET, TOKEN_URL, TOKEN_REFRESH_LOCK_TTL
+
+REFRESH_MARGIN = 120  # request-path fallback: refresh this close to expiry if the background refresher didn't
+CAS_ATTEMPTS = 5
+# A refresh that fails any of these ways leaves that grant for the next pass (Xero error, network, bad JSON)
+_REFRESH_ERRORS = (RuntimeError, requests.RequestException, ValueError)
+
+log = get_logger(__name__)
+_store = get_token_store()
+
+# Process-wide copy of the stored document, reloaded only when the store's stamp changes
+_cache = {"stamp": None, "checked_at": None, "grants": {}, "tenants": {}, "default_tenant": None}
+_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_session = build_session(pool_connections=1, pool_maxsize=2)  # refresh POSTs are never retried (rotating token)
+
+
+def _parse(data):
+    if "grants" in data:
+        return data
+    if not data.get("tokens"):
+        return {"grants": {}, "tenants": {}, "default_tenant": None}
+    # Single-tenant layout from before multi-tenant support
+    tenant_id = data.get("tenant_id")
+    return {
+        "grants": {"default": {"tokens": data["tokens"], "obtained_at": data.get("obtained_at", 0)}},
+        "tenants": {tenant_id: {"grant": "default", "name": None}} if tenant_id else {},
+        "default_tenant": tenant_id,
+    }
+
+
+def _reload(force=False):
+    """Re-read the stored document into the cache if it changed (or if forced)."""
+    now = time.monotonic()
+    checked_at = _cache["checked_at"]
+    if not force and checked_at is not None and now - checked_at < _store.check_interval:
+        return _cache
+
+    stamp = _store.stamp()
+    with _cache_lock:
+        _cache["checked_at"] = now
+        if not force and stamp == _cache["stamp"]:
+            return _cache
+        data, _ = _store.read()
+        _cache.update(stamp=stamp, **_parse(data))
+        return _cache
+
+
+def _update(change):
+    """
+    Read-modify-write the stored document. `change(data)` edits it in place,
+    or returns False to leave the store as it is. Retried from a fresh read
+    whenever another writer got in first. Returns whether a write happened.
+    """
+    for _ in range(CAS_ATTEMPTS):
+        raw, version = _store.read()
+        data = _parse(raw)
+        if change(data) is False:
+            return False
+        if _store.compare_and_swap(version, data):
+            _reload(force=True)
+            return True
+    raise RuntimeError("Xero token store busy: compare-and-swap kept losing to other writers")
+
+
+def save_connection(tokens: dict, connections: list):
+    """
+    Store the tokens from one OAuth consent and every tenant it connected
+    (the /connections response). The first tenant becomes the default if there is none yet.
+    """
+    grant_id = next((c.get("authEventId") for c in connections if c.get("authEventId")), None) or "default"
+
+    def change(data):
+        data["grants"][grant_id] = {"tokens": tokens, "obtained_at": int(time.time())}
+        for conn in connections:
+            data["tenants"][conn["tenantId"]] = {"grant": grant_id, "name": conn.get("tenantName")}
+        if data["default_tenant"] not in data["tenants"]:
+            data["default_tenant"] = connections[0]["tenantId"] if connections else None
+        # Drop grants no tenant uses any more (that tenant was re-connected under a newer consent)
+        in_use = {t["grant"] for t in data["tenants"].values()}
+        data["grants"] = {g: v for g, v in data["grants"].items() if g in in_use}
+
+    _update(change)
+
 
 def save_tokens(tokens: dict, tenant_id: str = None):
-    data = {"tokens": tokens, "tenant_id": tenant_id, "obtained_at": int(time.time())}
-    with open(TOKENS_FILE, "w") as f:
-        json.dump(data, f)
-
-def load_tokens():
-    if not os.path.exists(TOKENS_FILE):
-        return None, None
-    with open(TOKENS_FILE, "r") as f:
-        data = json.load(f)
-    return data.get("tokens"), data.get("tenant_id")
-
-def get_valid_access_token():
-    tokens, tenant_id = load_tokens()
-    if not tokens:
-        return None, None
-
-    now = int(time.time())
-    if now > tokens.get("obtained_at", 0) + tokens.get("expires_in", 0) - 60:
-        headers = {
-            "Authorization": basic_auth_header(CLIENT_ID, CLIENT_SECRET),
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        data = {"grant_type": "refresh_token", "refresh_token": tokens["refresh_token"]}
-        resp = requests.post(TOKEN_URL, headers=headers, data=data, timeout=30)
-        if resp.status_code != 200:
-            return None, tenant_id
-        tokens = resp.json()
-        save_tokens(tokens, tenant_id)
-
-    return tokens["access_token"], tenant_id
+    """Single-tenant save (kept for callers that only know one tenant)."""
+    save_connection(tokens, [{"tenantId": tenant_id}] if tenant_id else [])
+
+
+def _save_refreshed(grant_id, used_tokens, new_tokens):
+    """
+    Store a grant's refreshed tokens — unless someone else already replaced the
+    refresh token we used (their rotation is the one Xero honours now).
+    """
+    def change(data):
+        grant = data["grants"].get(grant_id)
+        if not grant or grant["tokens"].get("refresh_token") != used_tokens.get("refresh_token"):
+            return False
+        data["grants"][grant_id] = {"tokens": new_tokens, "obtained_at": int(time.time())}
+
+    if not _update(change):
+        log.warning("refreshed xero tokens discarded: grant changed in the store meanwhile", grant=grant_id)
+
+
+def resolve_tenant(tenant_id=None):
+    """Explicit tenant, else the one bound by tenants.use_tenant(), else the default tenant."""
+    return tenant_id or tenants.current() or _reload()["default_tenant"]
+
+
+def list_tenants():
+    cached = _reload()
+    return [
+        {"tenant_id": tid, "name": t.get("name"), "default": tid == cached["default_tenant"]}
+        for tid, t in cached["tenants"].items()
+    ]
+
+
+def load_tokens(tenant_id=None):
+    tenant_id = resolve_tenant(tenant_id)
+    grant = _grant_for(_reload(), tenant_id)
+    return (grant["tokens"] if grant else None), tenant_id
+
+
+def _grant_for(cached, tenant_id):
+    tenant = cached["tenants"].get(tenant_id)
+    return cached["grants"].get(tenant["grant"]) if tenant else None
+
+
+def _expires_at(grant):
+    if not grant or not grant.get("tokens"):
+        return None
+    return grant["obtained_at"] + grant["tokens"].get("expires_in", 0)
+
+
+def _is_fresh(grant, margin=REFRESH_MARGIN):
+    expires_at = _expires_at(grant)
+    return expires_at is not None and time.time() < expires_at - margin
+
+
+def token_expires_at():
+    """Unix time the soonest-expiring access token expires (None when not connected)."""
+    expiries = [e for e in map(_expires_at, _reload()["grants"].values()) if e is not None]
+    return min(expiries) if expiries else None
+
+
+def _refresh(grant_id, tokens):
+    headers = {
+        "Authorization": basic_auth_header(CLIENT_ID, CLIENT_SECRET),
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    data = {"grant_type": "refresh_token", "refresh_token": tokens["refresh_token"]}
+    with metrics.stage("token_refresh"):
+        resp = _session.post(TOKEN_URL, headers=headers, data=data, timeout=timeout_for(30))
+    if resp.status_code != 200:
+        raise RuntimeError(f"Xero token refresh failed for grant {grant_id}: {resp.status_code} {resp.text}")
+    new_tokens = resp.json()
+    _save_refreshed(grant_id, tokens, new_tokens)
+    return new_tokens
+
+
+def refresh_if_due(ahead, grant_ids=None):
+    """
+    Refresh every grant (or just `grant_ids`) whose access token expires within
+    `ahead` seconds. Used by the background refresher (services/token_refresher.py).
+    Returns how many were refreshed; raises if any refresh failed.
+
+    Single-flight: one refresh per process (thread lock) and per store (the
+    store's "refresh" lock). Whoever waited re-reads the store first — the
+    refresh token rotates, so refreshing twice with the same one would lock
+    us out. If the store lock is still held after TOKEN_REFRESH_LOCK_TTL, the
+    holder may be mid-refresh: nothing is refreshed (returns 0) and the caller
+    sees whatever the store holds. The write itself is a compare-and-swap
+    (see _save_refreshed).
+    """
+    refreshed, errors = 0, []
+    with _refresh_lock, _store.lock("refresh", TOKEN_REFRESH_LOCK_TTL) as acquired:
+        if not acquired:
+            log.warning("xero token refresh skipped: another process still holds the refresh lock")
+            _reload(force=True)
+            return 0
+        grants = _reload(force=True)["grants"]
+        for grant_id, grant in list(grants.items()):
+            if grant_ids is not None and grant_id not in grant_ids:
+                continue
+            if _is_fresh(grant, margin=ahead):
+                continue
+            try:
+                _refresh(grant_id, grant["tokens"])
+                refreshed += 1
+            except _REFRESH_ERRORS as e:
+                errors.append(f"grant {grant_id}: {e}")
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return refreshed
+
+
+def get_valid_access_token(tenant_id=None):
+    """
+    (access_token, tenant_id) for the tenant (see resolve_tenant), or (None, ...)
+    when it isn't connected. The background refresher keeps tokens well ahead
+    of expiry, so refreshing here is only a fallback (refresher not running,
+    or failing right up to the last REFRESH_MARGIN seconds).
+    """
+    tenant_id = resolve_tenant(tenant_id)
+    cached = _reload()
+    grant = _grant_for(cached, tenant_id)
+    if not grant:
+        return None, tenant_id
+    if _is_fresh(grant):
+        return grant["tokens"]["access_token"], tenant_id
+
+    try:
+        refresh_if_due(REFRESH_MARGIN, grant_ids={cached["tenants"][tenant_id]["grant"]})
+    except _REFRESH_ERRORS:
+        return None, tenant_id
+    grant = _grant_for(_reload(), tenant_id)
+    if not _is_fresh(grant, margin=0):  # gone, or the refresh was skipped / failed past expiry
+        return None, tenant_id
+    return grant["tokens"]["access_token"], tenant_id
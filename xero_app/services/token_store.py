@@ -0,0 +1,245 @@
+# services/token_store.py
+"""
+Where the Xero token document (see token_service.py) lives, so that every
+process — and, with the sqlite/redis backends, every instance — shares one
+Xero connection.
+
+TOKEN_STORE selects the backend:
+  file   – TOKENS_FILE on local disk: one host only (default)
+  sqlite – TOKEN_STORE_DB: one host, or a shared volume
+  redis  – TOKEN_STORE_REDIS_URL (any Redis-protocol server): many instances
+
+Every backend offers the same four operations:
+  stamp()                  cheap value that changes whenever the document does (cache key)
+  read()                   (document, version); ({}, 0) when nothing is stored
+  compare_and_swap(v, doc) store doc as version v+1 only if the stored version is still v
+  lock(name, ttl)          best-effort cross-process mutex; a crashed holder's lease expires after ttl
+
+Refreshing rotates the refresh token, so the lock keeps instances from
+refreshing at the same time, and compare-and-swap keeps a writer working from a
+stale read (e.g. a lock lease that expired mid-refresh) from overwriting newer tokens.
+"""
+import fcntl, json, os, threading, time, uuid
+from contextlib import contextmanager
+from utils.db import connect, transaction
+from utils.resp import RespClient
+from config import (
+    TOKEN_STORE, TOKENS_FILE, TOKEN_STORE_DB, TOKEN_STORE_REDIS_URL, TOKEN_STORE_KEY, TOKEN_STORE_CHECK_INTERVAL,
+)
+
+LOCK_POLL_INTERVAL = 0.05
+
+
+class TokenStore:
+    check_interval = TOKEN_STORE_CHECK_INTERVAL  # seconds a reader may trust its cached copy without calling stamp()
+
+    def stamp(self):
+        raise NotImplementedError
+
+    def read(self):
+        raise NotImplementedError
+
+    def compare_and_swap(self, version, data):
+        raise NotImplementedError
+
+    def _try_lock(self, name, holder, ttl):
+        raise NotImplementedError
+
+    def _unlock(self, name, holder):
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, name, ttl):
+        """Hold `name` for the block, waiting up to ttl for it. Yields whether it was acquired."""
+        holder = uuid.uuid4().hex
+        deadline = time.monotonic() + ttl
+        acquired = self._try_lock(name, holder, ttl)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            acquired = self._try_lock(name, holder, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._unlock(name, holder)
+
+
+class FileTokenStore(TokenStore):
+    """JSON file, replaced atomically (write-then-rename); fcntl locks next to it."""
+
+    check_interval = 0  # stat() is cheap: check on every read
+
+    def __init__(self, path=TOKENS_FILE):
+        self.path = path
+
+    def stamp(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}, 0
+        return data, data.pop("version", 0)
+
+    def compare_and_swap(self, version, data):
+        with self._flock("write"):
+            _, current = self.read()
+            if current != version:
+                return False
+            tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({**data, "version": version + 1}, f)
+            os.replace(tmp, self.path)
+            return True
+
+    @contextmanager
+    def _flock(self, name):
+        with open(f"{self.path}.{name}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def lock(self, name, ttl):
+        # The kernel drops an flock when its holder dies, so no lease is needed
+        with self._flock(name):
+            yield True
+
+
+class SQLiteTokenStore(TokenStore):
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS token_store (
+        name    TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        data    TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS token_locks (
+        name       TEXT PRIMARY KEY,
+        holder     TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path=TOKEN_STORE_DB, name="xero"):
+        self.path = path
+        self.name = name
+        self._ready = False
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready:
+            conn.executescript(self._SCHEMA)
+            self._ready = True
+        return conn
+
+    def stamp(self):
+        row = self._db().execute("SELECT version FROM token_store WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else None
+
+    def read(self):
+        row = self._db().execute("SELECT data, version FROM token_store WHERE name = ?", (self.name,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else ({}, 0)
+
+    def compare_and_swap(self, version, data):
+        conn = self._db()
+        body = json.dumps(data)
+        with transaction(conn):
+            if version == 0:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO token_store (name, version, data) VALUES (?, 1, ?)", (self.name, body)
+                )
+            else:
+                cur = conn.execute(
+                    "UPDATE token_store SET version = version + 1, data = ? WHERE name = ? AND version = ?",
+                    (body, self.name, version),
+                )
+        return cur.rowcount == 1
+
+    def _try_lock(self, name, holder, ttl):
+        now = time.time()
+        conn = self._db()
+        with transaction(conn):
+            cur = conn.execute(
+                "INSERT INTO token_locks (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE token_locks.expires_at <= ?",
+                (name, holder, now + ttl, now),
+            )
+        return cur.rowcount == 1
+
+    def _unlock(self, name, holder):
+        self._db().execute("DELETE FROM token_locks WHERE name = ? AND holder = ?", (name, holder))
+
+
+class RedisTokenStore(TokenStore):
+    """
+    Document at <key>, its version at <key>:version (the cheap stamp), locks at
+    <key>:lock:<name> (SET NX PX). Compare-and-swap is WATCH / MULTI / EXEC.
+    """
+
+    def __init__(self, url=TOKEN_STORE_REDIS_URL, key=TOKEN_STORE_KEY):
+        self.redis = RespClient(url)
+        self.key = key
+        self.version_key = f"{key}:version"
+
+    def stamp(self):
+        return self.redis.execute("GET", self.version_key)
+
+    def read(self):
+        self.redis.execute("MULTI")  # document and version from the same instant
+        self.redis.execute("GET", self.key)
+        self.redis.execute("GET", self.version_key)
+        data, version = self.redis.execute("EXEC")
+        return (json.loads(data) if data else {}), int(version or 0)
+
+    def compare_and_swap(self, version, data):
+        r = self.redis
+        r.execute("WATCH", self.version_key)
+        try:
+            if int(r.execute("GET", self.version_key) or 0) != version:
+                return False
+            r.execute("MULTI")
+            r.execute("SET", self.key, json.dumps(data))
+            r.execute("SET", self.version_key, version + 1)
+            return r.execute("EXEC") is not None  # None: the version changed after WATCH
+        finally:
+            r.execute("UNWATCH")
+
+    def _try_lock(self, name, holder, ttl):
+        return self.redis.execute("SET", f"{self.key}:lock:{name}", holder, "NX", "PX", int(ttl * 1000)) == "OK"
+
+    def _unlock(self, name, holder):
+        lock_key = f"{self.key}:lock:{name}"
+        r = self.redis
+        r.execute("WATCH", lock_key)
+        try:
+            if r.execute("GET", lock_key) == holder.encode():
+                r.execute("MULTI")
+                r.execute("DEL", lock_key)
+                r.execute("EXEC")
+        finally:
+            r.execute("UNWATCH")
+
+
+BACKENDS = {"file": FileTokenStore, "sqlite": SQLiteTokenStore, "redis": RedisTokenStore}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_token_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if TOKEN_STORE not in BACKENDS:
+                    raise RuntimeError(f"Unknown TOKEN_STORE {TOKEN_STORE!r} (expected one of {', '.join(BACKENDS)})")
+                _store = BACKENDS[TOKEN_STORE]()
+    return _store
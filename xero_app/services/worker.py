@@ -0,0 +1,76 @@
+# services/worker.py
+"""
+Background worker pool that drains the webhook event queue.
+Each gunicorn process runs its own pool; SQLite claims keep them from double-processing.
+"""
+import os, threading, time
+from services import event_queue
+from services.sync_service import handle_event
+from utils import metrics
+from utils.log import get_logger, bind
+from config import WEBHOOK_WORKERS, QUEUE_POLL_INTERVAL
+
+log = get_logger(__name__)
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_started_pid = None
+
+
+def start_workers(n: int = WEBHOOK_WORKERS):
+    """Start the worker threads once per process (safe to call on every request, and after fork)."""
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        for i in range(n):
+            t = threading.Thread(target=_run, name=f"webhook-worker-{i}", daemon=True)
+            t.start()
+        _started_pid = os.getpid()
+
+
+def notify():
+    """Wake an idle worker now instead of waiting for the next poll."""
+    _wakeup.set()
+
+
+def process_one():
+    """Claim and process a single event. Returns False when the queue is empty."""
+    claimed = event_queue.claim()
+    if not claimed:
+        return False
+
+    row_id, token, event, attempts = claimed
+    with bind(event):
+        started = time.perf_counter()
+        try:
+            with metrics.track_event(event.get("type")):
+                handle_event(event)
+        except event_queue.RetryLater as e:
+            log.info("event deferred", attempt=attempts, reason=str(e), duration_ms=_ms_since(started))
+            event_queue.defer(row_id, token, error=str(e))
+        except Exception as e:
+            log.error("event failed", attempt=attempts, error=str(e), duration_ms=_ms_since(started))
+            event_queue.nack(row_id, token, error=str(e))
+        else:
+            log.info("event handled", attempt=attempts, duration_ms=_ms_since(started))
+            event_queue.ack(row_id, token)
+    return True
+
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _run():
+    while True:
+        try:
+            if process_one():
+                continue
+        except Exception:
+            # Queue itself failed (disk, lock timeout) — back off and keep the thread alive
+            log.exception("queue worker error")
+        _wakeup.wait(QUEUE_POLL_INTERVAL)
+        _wakeup.clear()
@@ -0,0 +1,91 @@
+# services/xero_client.py
+import threading
+from services.token_service import get_valid_access_token, resolve_tenant
+from services.xero_rate_limiter import XeroRateLimitAdapter
+from utils.http import build_session, timeout_for, safe_get, safe_post
+from config import XERO_POOL_SIZE, XERO_TIMEOUT
+
+
+class XeroNotConnected(RuntimeError):
+    pass
+
+
+class XeroClient:
+    """
+    One keep-alive Session to api.xero.com per Xero tenant, shared by every
+    service function working for that tenant — one busy tenant can't use up
+    another's connections. Auth/tenant headers are built once per access token,
+    not once per call. Every request goes through the shared Xero rate limiter
+    (see xero_rate_limiter.py), which budgets each tenant separately.
+    """
+
+    def __init__(self, tenant_id=None, pool_size=XERO_POOL_SIZE, timeout=XERO_TIMEOUT):
+        self.tenant_id = tenant_id
+        self.session = build_session(pool_connections=2, pool_maxsize=pool_size, adapter_cls=XeroRateLimitAdapter)
+        self.timeout = timeout
+        self._headers_for = None  # (access_token, tenant_id) the cached headers were built from
+        self._headers = {}
+        self._lock = threading.Lock()
+
+    def headers(self, json=False):
+        """Headers for the current token, or None when Xero isn't connected."""
+        access_token, tenant_id = get_valid_access_token(self.tenant_id)
+        if not access_token or not tenant_id:
+            return None
+
+        if self._headers_for != (access_token, tenant_id):
+            with self._lock:
+                if self._headers_for != (access_token, tenant_id):
+                    base = {
+                        "Authorization": f"Bearer {access_token}",
+                        "Xero-tenant-id": tenant_id,
+                        "Accept": "application/json",
+                    }
+                    self._headers = {False: base, True: {**base, "Content-Type": "application/json"}}
+                    self._headers_for = (access_token, tenant_id)
+        return self._headers[json]
+
+    def _require_headers(self, json=False):
+        headers = self.headers(json=json)
+        if headers is None:
+            raise XeroNotConnected("Not connected to Xero. Run the Xero OAuth flow first.")
+        return headers
+
+    def get(self, url, params=None, headers=None):
+        """headers: extra request headers (e.g. If-Modified-Since) on top of the auth/tenant ones."""
+        base = self._require_headers()
+        return self.session.get(url, headers={**base, **headers} if headers else base, params=params, timeout=timeout_for(self.timeout))
+
+    def post(self, url, json=None, params=None, headers=None):
+        """headers: extra request headers (e.g. Idempotency-Key) on top of the auth/tenant ones."""
+        base = self._require_headers(json=True)
+        return self.session.post(url, headers={**base, **headers} if headers else base, json=json, params=params, timeout=timeout_for(self.timeout))
+
+    # (data, error, status) variants used by the /xero/* routes
+    def safe_get(self, url, params=None):
+        headers = self.headers()
+        if headers is None:
+            return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
+        return safe_get(url, headers=headers, params=params, timeout=self.timeout, session=self.session)
+
+    def safe_post(self, url, json=None):
+        headers = self.headers(json=True)
+        if headers is None:
+            return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
+        return safe_post(url, headers=headers, json=json, timeout=self.timeout, session=self.session)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_xero_client(tenant_id=None):
+    """Client for tenant_id, else the current tenant (services/tenants.py), else the default one."""
+    tenant_id = resolve_tenant(tenant_id)
+    client = _clients.get(tenant_id)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(tenant_id)
+            if client is None:
+                client = _clients[tenant_id] = XeroClient(tenant_id)
+    return client
@@ -0,0 +1,259 @@
+# services/xero_rate_limiter.py
+"""
+Keeps us inside Xero's per-tenant limits (60 calls/minute, 5 concurrent,
+daily cap) across every gunicorn worker on the host.
+
+State lives in SQLite: a token bucket per tenant plus one lease row per
+in-flight call (leases expire, so a crashed worker can't leak a slot).
+The bucket is corrected from X-MinLimit-Remaining / X-DayLimit-Remaining
+and paused on Retry-After.
+
+Webhook traffic always has priority: backfill calls (run inside
+`with backfill_priority():`) leave XERO_BACKFILL_RESERVE per-minute calls
+and XERO_DAY_RESERVE daily calls untouched, and give up with
+RateLimitTimeout after XERO_BACKFILL_MAX_WAIT seconds without a slot. The
+daily count is forgotten at the UTC day boundary until Xero reports it again.
+"""
+import asyncio, contextvars, random, threading, time, uuid
+from contextlib import contextmanager
+from utils.http import ResilientAdapter
+from utils.db import connect, transaction
+from utils.log import get_logger
+from config import (
+    XERO_RATE_DB, XERO_CALLS_PER_MINUTE, XERO_MAX_CONCURRENT,
+    XERO_BACKFILL_RESERVE, XERO_DAY_RESERVE, XERO_MAX_429_RETRIES, XERO_TIMEOUT, XERO_BACKFILL_MAX_WAIT,
+)
+
+WEBHOOK, BACKFILL = "webhook", "backfill"
+
+log = get_logger(__name__)
+
+_priority = contextvars.ContextVar("xero_priority", default=WEBHOOK)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    tenant_id     TEXT PRIMARY KEY,
+    tokens        REAL NOT NULL,
+    refilled_at   REAL NOT NULL,
+    day_remaining INTEGER,
+    day           INTEGER,                    -- UTC day (epoch days) day_remaining was reported on
+    blocked_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    id         TEXT PRIMARY KEY,
+    tenant_id  TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class RateLimitTimeout(RuntimeError):
+    pass
+
+
+def _utc_day(now):
+    return int(now // 86400)
+
+
+@contextmanager
+def backfill_priority():
+    """Run the enclosed Xero calls as low-priority (backfill) traffic."""
+    token = _priority.set(BACKFILL)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class XeroRateLimiter:
+    def __init__(self, path=XERO_RATE_DB, per_minute=XERO_CALLS_PER_MINUTE, max_concurrent=XERO_MAX_CONCURRENT):
+        self.path = path
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.max_concurrent = max_concurrent
+        self.lease_ttl = XERO_TIMEOUT + 30
+        self._ready = False
+
+    def _db(self):
+        conn = connect(self.path)
+        if not self._ready:
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(buckets)")}
+            if "day" not in columns:  # limiter DB created before the daily count was dated
+                conn.execute("ALTER TABLE buckets ADD COLUMN day INTEGER")
+            self._ready = True
+        return conn
+
+    def _try_acquire(self, tenant_id, priority):
+        """One attempt. Returns (lease_id, 0) or (None, seconds_to_wait)."""
+        now = time.time()
+        conn = self._db()
+        with transaction(conn):
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            row = conn.execute(
+                "SELECT tokens, refilled_at, day_remaining, day, blocked_until FROM buckets WHERE tenant_id = ?",
+                (tenant_id,),
+            ).fetchone()
+            if row is None:
+                row = (float(self.capacity), now, None, None, 0.0)
+                conn.execute(
+                    "INSERT INTO buckets (tenant_id, tokens, refilled_at) VALUES (?, ?, ?)",
+                    (tenant_id, row[0], now),
+                )
+            tokens, refilled_at, day_remaining, day, blocked_until = row
+            tokens = min(self.capacity, tokens + (now - refilled_at) * self.rate)
+            if day_remaining is not None and day != _utc_day(now):
+                # New UTC day: the count is stale until the next response reports it
+                day_remaining = None
+                conn.execute("UPDATE buckets SET day_remaining = NULL, day = NULL WHERE tenant_id = ?", (tenant_id,))
+
+            if now < blocked_until:
+                wait = blocked_until - now
+            else:
+                in_flight = conn.execute("SELECT COUNT(*) FROM leases WHERE tenant_id = ?", (tenant_id,)).fetchone()[0]
+                reserve = XERO_BACKFILL_RESERVE if priority == BACKFILL else 0
+                if priority == BACKFILL and day_remaining is not None and day_remaining <= XERO_DAY_RESERVE:
+                    # Daily budget is nearly gone — leave it to webhooks (re-checked at the latest at midnight UTC)
+                    wait = min(60.0, (_utc_day(now) + 1) * 86400 - now)
+                elif in_flight >= self.max_concurrent:
+                    wait = 0.05
+                elif tokens < 1 + reserve:
+                    wait = (1 + reserve - tokens) / self.rate
+                else:
+                    lease_id = uuid.uuid4().hex
+                    conn.execute(
+                        "UPDATE buckets SET tokens = ?, refilled_at = ?, "
+                        "day_remaining = CASE WHEN day_remaining IS NULL THEN NULL ELSE day_remaining - 1 END "
+                        "WHERE tenant_id = ?",
+                        (tokens - 1, now, tenant_id),
+                    )
+                    conn.execute(
+                        "INSERT INTO leases (id, tenant_id, expires_at) VALUES (?, ?, ?)",
+                        (lease_id, tenant_id, now + self.lease_ttl),
+                    )
+                    return lease_id, 0
+
+            conn.execute(
+                "UPDATE buckets SET tokens = ?, refilled_at = ? WHERE tenant_id = ?",
+                (tokens, now, tenant_id),
+            )
+            return None, wait
+
+    def acquire(self, tenant_id, priority=None, timeout=None):
+        """
+        Block until a call slot is available for this tenant. Returns a lease id for release().
+        Raises RateLimitTimeout after `timeout` seconds (default: none for webhook
+        calls, XERO_BACKFILL_MAX_WAIT for backfill).
+        """
+        priority = priority or _priority.get()
+        deadline = self._deadline(priority, timeout)
+        while True:
+            lease_id, wait = self._try_acquire(tenant_id, priority)
+            if lease_id:
+                return lease_id
+            # Jitter so waiting workers don't stampede the lock together
+            time.sleep(self._pause(tenant_id, wait, deadline))
+
+    async def acquire_async(self, tenant_id, priority=None, timeout=None):
+        """acquire() for the event loop: each short attempt runs in a thread, the waits are asyncio.sleep()."""
+        priority = priority or _priority.get()
+        deadline = self._deadline(priority, timeout)
+        while True:
+            lease_id, wait = await asyncio.to_thread(self._try_acquire, tenant_id, priority)
+            if lease_id:
+                return lease_id
+            await asyncio.sleep(self._pause(tenant_id, wait, deadline))
+
+    @staticmethod
+    def _deadline(priority, timeout):
+        if timeout is None and priority == BACKFILL:
+            timeout = XERO_BACKFILL_MAX_WAIT
+        return time.monotonic() + timeout if timeout is not None else None
+
+    @staticmethod
+    def _pause(tenant_id, wait, deadline):
+        pause = min(wait, 1.0) * (0.5 + random.random() / 2)
+        if deadline is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise RateLimitTimeout(f"No Xero call slot for tenant {tenant_id} in time")
+            pause = min(pause, left)
+        return pause
+
+    def release(self, tenant_id, lease_id, response=None):
+        """Free the concurrency slot and learn from Xero's rate-limit headers."""
+        now = time.time()
+        conn = self._db()
+        with transaction(conn):
+            conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+            if response is None:
+                return
+            headers = response.headers
+            minute_left = _int_header(headers, "X-MinLimit-Remaining")
+            day_left = _int_header(headers, "X-DayLimit-Remaining")
+            retry_after = _int_header(headers, "Retry-After")
+
+            if minute_left is not None:
+                conn.execute(
+                    "UPDATE buckets SET tokens = MIN(tokens, ?) WHERE tenant_id = ?",
+                    (float(minute_left), tenant_id),
+                )
+            if day_left is not None:
+                conn.execute(
+                    "UPDATE buckets SET day_remaining = ?, day = ? WHERE tenant_id = ?", (day_left, _utc_day(now), tenant_id)
+                )
+            if response.status_code == 429:
+                conn.execute(
+                    "UPDATE buckets SET tokens = 0, refilled_at = ?, blocked_until = MAX(blocked_until, ?) WHERE tenant_id = ?",
+                    (now, now + (retry_after if retry_after is not None else 60), tenant_id),
+                )
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class XeroRateLimitAdapter(ResilientAdapter):
+    """
+    Transport adapter for the Xero session: every attempt (including
+    ResilientAdapter's retries) waits for a slot from the shared limiter,
+    and a 429 is retried (after Retry-After) instead of surfacing to the caller.
+    The breaker slot is taken only once the limiter slot is held, so a
+    half-open trial isn't parked behind a rate-limit wait.
+    """
+
+    def __init__(self, limiter=None, **kwargs):
+        self.limiter = limiter or get_rate_limiter()
+        super().__init__(**kwargs)
+
+    def _send_once(self, request, breaker, **kwargs):
+        tenant_id = request.headers.get("Xero-tenant-id") or "default"
+        for attempt in range(XERO_MAX_429_RETRIES + 1):
+            breaker.check()  # fail fast without spending a call slot while Xero is down
+            lease_id = self.limiter.acquire(tenant_id)
+            response = None
+            try:
+                response = super()._send_once(request, breaker, **kwargs)
+            finally:
+                self.limiter.release(tenant_id, lease_id, response)
+            if response.status_code != 429 or attempt == XERO_MAX_429_RETRIES:
+                return response
+            log.warning("xero rate limited", tenant_id=tenant_id, retry_after=response.headers.get("Retry-After"))
+            response.close()
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = XeroRateLimiter()
+    return _limiter
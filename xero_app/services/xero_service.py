@@ -1,60 +1,46 @@
 # services/xero_service.py
-from services.token_service import get_valid_access_token, load_tokens
-from utils.http import safe_get, safe_post
-import requests 
-import os
+import threading, time
+from services.xero_client import get_xero_client
+from services.contact_index import get_contact_index, normalize_email
+from services.contact_mirror import get_contact_mirror, MirrorBusy
+from services import sync_ledger, tenants
+from services.invoice_batcher import InvoiceBatcher, InvoiceValidationError
+from services.account_rules import get_account_rules
+from utils import metrics
 from datetime import date
 
-from config import XERO_ACCOUNT_CODES 
+from config import (
+    XERO_INVOICE_BATCH_WINDOW, XERO_INVOICE_BATCH_MAX, XERO_API_URL, CONTACT_MIRROR_MISS_MAX_AGE, CONTACT_MIRROR_MISS_WAIT,
+)
 
-BASE_URL = "https://api.xero.com/api.xro/2.0"
-
-def get_headers(access_token, tenant_id, json=False):
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Xero-tenant-id": tenant_id,
-        "Accept": "application/json",
-    }
-    if json:
-        headers["Content-Type"] = "application/json"
-    return headers
+BASE_URL = f"{XERO_API_URL}/api.xro/2.0"
 
 
 def fetch_invoices(page=1):
     """Fetch invoices from Xero (paginated)."""
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
-
-    url = f"{BASE_URL}/Invoices"
-    headers = get_headers(access_token, tenant_id)
-    return safe_get(url, headers=headers, params={"page": page})
+    return get_xero_client().safe_get(f"{BASE_URL}/Invoices", params={"page": page})
 
 
 def create_invoice(invoice_body):
     """Create an invoice in Xero."""
-    tokens, tenant_id = load_tokens()
-    if not tokens or not tenant_id:
-        return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
-
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        return None, {"error": "auth_failed", "message": "Missing access token or tenant ID"}, 400
+    return get_xero_client().safe_post(f"{BASE_URL}/Invoices", json=invoice_body)
 
-    url = f"{BASE_URL}/Invoices"
-    headers = get_headers(access_token, tenant_id, json=True)
-    return safe_post(url, headers=headers, json=invoice_body)
 
-
-def fetch_contacts(limit=5):
-    """Fetch first N contacts from Xero."""
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
-
-    url = f"{BASE_URL}/Contacts"
-    headers = get_headers(access_token, tenant_id)
-    data, error, status = safe_get(url, headers=headers, params={"page": 1})
+def fetch_contacts(limit=5, account_number=None, email=None, phone=None):
+    """
+    First N contacts (optionally only those with this AccountNumber / email / phone),
+    from the local contact mirror — or from Xero while the mirror isn't loaded.
+    """
+    mirror = get_contact_mirror()
+    if mirror.ready():
+        return mirror.search(account_number=account_number, email=email, phone=phone, limit=limit), None, 200
+
+    params = {"page": 1}
+    where = [f'AccountNumber=="{account_number}"'] if account_number else []
+    where += [f'EmailAddress=="{email}"'] if email else []
+    if where:
+        params["where"] = " AND ".join(where)
+    data, error, status = get_xero_client().safe_get(f"{BASE_URL}/Contacts", params=params)
     if error:
         return None, error, status
     return data.get("Contacts", [])[:limit], None, 200
@@ -62,150 +48,311 @@ def fetch_contacts(limit=5):
 
 def create_contact(contact_payload):
     """Create a contact in Xero (idempotent — you can check before inserting)."""
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        return None, {"error": "not_connected", "message": "Visit /xero/connect first"}, 400
+    return get_xero_client().safe_post(f"{BASE_URL}/Contacts", json=contact_payload)
 
-    url = f"{BASE_URL}/Contacts"
-    headers = get_headers(access_token, tenant_id, json=True)
-    return safe_post(url, headers=headers, json=contact_payload)
 
-
-XERO_CONTACTS_URL = "https://api.xero.com/api.xro/2.0/Contacts"
+XERO_CONTACTS_URL = f"{BASE_URL}/Contacts"
 
 def _where(q: str): return {"where": q}
 def _digits_only(s: str) -> str: return "".join(ch for ch in (s or "") if ch.isdigit())
-# services/xero_service.py
-import requests
-from services.token_service import get_valid_access_token
 
-XERO_CONTACTS_URL = "https://api.xero.com/api.xro/2.0/Contacts"
+def needs_account_number_backfill(contact: dict, account_number, legacy_account_number) -> bool:
+    """A legacy / email / phone match gets AccountNumber set to the raw Square ID if it's missing or legacy."""
+    return bool(account_number) and (
+        not contact.get("AccountNumber") or contact.get("AccountNumber") == legacy_account_number
+    )
+
+
+def account_number_patch(contact: dict, account_number: str):
+    return {"Contacts": [{"ContactID": contact.get("ContactID"), "AccountNumber": account_number}]}
+
+
+def _backfill_account_number(contact: dict, account_number: str):
+    """Normalize a contact's AccountNumber to the raw Square ID (best effort)."""
+    patch_payload = account_number_patch(contact, account_number)
+    try:
+        r = yield ("post", XERO_CONTACTS_URL, {"json": patch_payload})
+        if r.status_code in (200, 201):
+            contact["AccountNumber"] = account_number
+    except Exception:
+        pass
+
+
+def new_contact_payload(cust):
+    """Contacts payload for a Square customer we couldn't match."""
+    square_id = getattr(cust, "id", "") or ""
+    given     = getattr(cust, "given_name", "") or ""
+    family    = getattr(cust, "family_name", "") or ""
+    email     = getattr(cust, "email_address", "") or ""
+    phone     = getattr(cust, "phone_number", "") or ""
+
+    name_for_xero = email if email else f"Square [{square_id or 'no-id'}]"
+    return {
+        "Contacts": [
+            {
+                "Name": name_for_xero,                 # we do NOT use Name for matching
+                "FirstName": given or None,
+                "LastName": family or None,
+                "EmailAddress": email or None,
+                "AccountNumber": square_id or None,    # <-- raw Square ID (Zapier-style)
+                "Phones": (
+                    [{"PhoneType": "MOBILE", "PhoneNumber": _digits_only(phone)[:50]}]
+                    if phone else []
+                ),
+            }
+        ]
+    }
+
+
+def contact_idempotency_key(cust, rejected_contact_id=None):
+    """
+    Idempotency-Key for creating a Square customer's contact: a retry whose first
+    POST Xero saved (but we never saw the response for) gets that contact back
+    instead of a second one. Re-creating after a rejection is a new request.
+    """
+    square_id = getattr(cust, "id", "") or ""
+    if not square_id:
+        return None
+    return f"contact-{square_id}-{rejected_contact_id}" if rejected_contact_id else f"contact-{square_id}"
+
+
+class ContactRejected(RuntimeError):
+    """Xero refused an invoice because its contact is archived or gone."""
+
+    def __init__(self, message, contact_id):
+        super().__init__(message)
+        self.contact_id = contact_id
+
+
+_REJECTED_CONTACT_HINTS = ("archived", "not found", "could not be found", "does not exist", "deleted")
 
-def _where(q: str): return {"where": q}
-def _digits_only(s: str) -> str: return "".join(ch for ch in (s or "") if ch.isdigit())
 
-def find_or_create_contact_from_square(cust):
+def rejects_contact(messages) -> bool:
+    """True when Xero's validation messages say the invoice's contact can't be used."""
+    return any(
+        "contact" in m.lower() and any(hint in m.lower() for hint in _REJECTED_CONTACT_HINTS)
+        for m in messages if m
+    )
+
+
+def _validation_messages(resp):
+    try:
+        elements = resp.json().get("Elements") or []
+    except ValueError:
+        return []
+    return [e.get("Message") for el in elements for e in el.get("ValidationErrors") or []]
+
+
+def forget_rejected_contact(contact_id):
+    """Stop serving a contact Xero rejected from the contact index and the mirror."""
+    get_contact_index().forget_contact(contact_id)
+    get_contact_mirror().drop(contact_id)
+
+
+def find_or_create_contact_from_square(cust, rejected_contact_id=None):
+    """
+    (contact, created) for a Square customer — see contact_rules for the match rules.
+    rejected_contact_id: a contact Xero just refused (archived / deleted); it is
+    forgotten locally before matching again.
+    """
+    started = time.perf_counter()
+    contact, created, tier = run_contact_rules(contact_rules(cust, rejected_contact_id), get_xero_client())
+    metrics.observe_contact(tier, time.perf_counter() - started)
+    return contact, created
+
+
+def step_contact_rules(rules, response=None, error=None):
+    """
+    Resume contact_rules() with the response to the request it last yielded (or the
+    exception that request raised). Returns ("request", (method, url, kwargs)) for
+    the next Xero call, or ("done", (contact, created, tier)).
+    """
+    try:
+        if error is not None:
+            return "request", rules.throw(error)
+        return "request", rules.send(response)
+    except StopIteration as done:
+        return "done", done.value
+
+
+def run_contact_rules(rules, xero):
+    """Drive contact_rules() with a blocking client (XeroClient); see async_sync for the asyncio driver."""
+    state, value = step_contact_rules(rules)
+    while state == "request":
+        method, url, kwargs = value
+        try:
+            response = getattr(xero, method)(url, **kwargs)
+        except Exception as e:
+            state, value = step_contact_rules(rules, error=e)
+        else:
+            state, value = step_contact_rules(rules, response)
+    return value
+
+
+def contact_rules(cust, rejected_contact_id=None):
     """
+    Returns (contact, created, tier) — tier names the match that hit (for /metrics).
+    A generator: each Xero call is yielded as (method, url, kwargs) and resumed with
+    its response, so the sync and asyncio pipelines run these same rules over their
+    own clients (run_contact_rules / async_sync._run_contact_rules_async).
+
     Match priority (no name matching):
       1) AccountNumber == <square_id>      # Zapier-style (no SQ- prefix)
       2) EmailAddress == email
     Also checks legacy 'SQ-<square_id>' on read for backward compat,
     but writes AccountNumber as <square_id> only.
+
+    The local contact index (services/contact_index.py) is consulted first, so
+    repeat customers resolve with no Xero reads. Index hits return a minimal
+    contact dict ({"ContactID", "AccountNumber"}). Once the contact mirror
+    (services/contact_mirror.py) is loaded, everything else is matched locally
+    too — including by phone — and live Xero queries are only the fallback.
     """
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        raise RuntimeError("Not connected to Xero. Run the Xero OAuth flow first.")
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Xero-tenant-id": tenant_id,
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
+    index = get_contact_index()
+    if rejected_contact_id:
+        forget_rejected_contact(rejected_contact_id)
 
     square_id = getattr(cust, "id", "") or ""
-    given     = getattr(cust, "given_name", "") or ""
-    family    = getattr(cust, "family_name", "") or ""
     email     = getattr(cust, "email_address", "") or ""
-    phone     = getattr(cust, "phone_number", "") or ""
 
     # Zapier-style account number (no prefix)
     account_number = square_id or None
     legacy_account_number = f"SQ-{square_id}" if square_id else None  # read-only check
+    email_key = normalize_email(email)
+
+    # 0) Local index — zero network calls for customers we've seen before
+    sq_known, sq_contact_id, _ = index.get("square", account_number)
+    if sq_contact_id:
+        return {"ContactID": sq_contact_id, "AccountNumber": account_number}, False, "index_square"
+
+    legacy_known, legacy_contact_id, _ = index.get("legacy", legacy_account_number)
+    if legacy_contact_id:
+        contact = {"ContactID": legacy_contact_id, "AccountNumber": legacy_account_number}
+        yield from _backfill_account_number(contact, account_number)
+        index.put_contact(contact, square_id=square_id, email=email)
+        return contact, False, "index_legacy"
+
+    email_known, email_contact_id, email_account_number = index.get("email", email_key)
+    if email_contact_id:
+        contact = {"ContactID": email_contact_id, "AccountNumber": email_account_number}
+        if needs_account_number_backfill(contact, account_number, legacy_account_number):
+            yield from _backfill_account_number(contact, account_number)
+        index.put_contact(contact, square_id=square_id if contact["AccountNumber"] == account_number else None, email=email)
+        return contact, False, "index_email"
+
+    # 0b) Local mirror of every Xero contact — no Xero reads once it's loaded
+    mirror = get_contact_mirror()
+    if mirror.ready():
+        resolved = yield from _resolve_from_mirror(index, mirror, cust, rejected_contact_id)
+        if resolved:
+            return resolved
+        # Another process's pull didn't land in time: ask Xero directly rather than risk a duplicate
 
     # 1) Match by AccountNumber (raw Square ID)
     if account_number:
-        r = requests.get(XERO_CONTACTS_URL, headers=headers, params=_where(f'AccountNumber=="{account_number}"'), timeout=30)
-        if r.status_code == 200 and r.json().get("Contacts"):
-            return r.json()["Contacts"][0], False
+        if not sq_known:
+            r = yield ("get", XERO_CONTACTS_URL, {"params": _where(f'AccountNumber=="{account_number}"')})
+            if r.status_code == 200 and r.json().get("Contacts"):
+                contact = r.json()["Contacts"][0]
+                index.put_contact(contact, square_id=square_id, email=email)
+                return contact, False, "account_number"
+            if r.status_code == 200:
+                index.put("square", account_number, None)
 
         # 1b) Backward-compat: match legacy 'SQ-<id>' if present
-        if legacy_account_number:
-            r2 = requests.get(XERO_CONTACTS_URL, headers=headers, params=_where(f'AccountNumber=="{legacy_account_number}"'), timeout=30)
+        if legacy_account_number and not legacy_known:
+            r2 = yield ("get", XERO_CONTACTS_URL, {"params": _where(f'AccountNumber=="{legacy_account_number}"')})
             if r2.status_code == 200 and r2.json().get("Contacts"):
                 contact = r2.json()["Contacts"][0]
                 # Optional: normalize to raw id going forward
-                patch_payload = {"Contacts": [{"ContactID": contact.get("ContactID"), "AccountNumber": account_number}]}
-                try:
-                    _ = requests.post(XERO_CONTACTS_URL, headers=headers, json=patch_payload, timeout=30)
-                except Exception:
-                    pass
-                return contact, False
+                yield from _backfill_account_number(contact, account_number)
+                index.put_contact(contact, square_id=square_id, email=email)
+                return contact, False, "legacy"
+            if r2.status_code == 200:
+                index.put("legacy", legacy_account_number, None)
 
     # 2) Fallback: match by EmailAddress
-    if email:
-        r = requests.get(XERO_CONTACTS_URL, headers=headers, params=_where(f'EmailAddress=="{email}"'), timeout=30)
+    if email and not email_known:
+        r = yield ("get", XERO_CONTACTS_URL, {"params": _where(f'EmailAddress=="{email}"')})
         if r.status_code == 200 and r.json().get("Contacts"):
             contact = r.json()["Contacts"][0]
             # Backfill AccountNumber (raw id) if missing or legacy
-            if account_number:
-                if not contact.get("AccountNumber") or contact.get("AccountNumber") == legacy_account_number:
-                    patch_payload = {"Contacts": [{"ContactID": contact.get("ContactID"), "AccountNumber": account_number}]}
-                    try:
-                        _ = requests.post(XERO_CONTACTS_URL, headers=headers, json=patch_payload, timeout=30)
-                    except Exception:
-                        pass
-            return contact, False
-
-    # --- Create new contact (Name is required by Xero; use email when available) ---
-    name_for_xero = email if email else f"Square [{square_id or 'no-id'}]"
-    payload = {
-        "Contacts": [
-            {
-                "Name": name_for_xero,                 # we do NOT use Name for matching
-                "FirstName": given or None,
-                "LastName": family or None,
-                "EmailAddress": email or None,
-                "AccountNumber": account_number or None,   # <-- raw Square ID (Zapier-style)
-                "Phones": (
-                    [{"PhoneType": "MOBILE", "PhoneNumber": _digits_only(phone)[:50]}]
-                    if phone else []
-                ),
-            }
-        ]
-    }
+            if needs_account_number_backfill(contact, account_number, legacy_account_number):
+                yield from _backfill_account_number(contact, account_number)
+            index.put_contact(
+                contact,
+                square_id=square_id if contact.get("AccountNumber") == account_number else None,
+                email=email,
+            )
+            return contact, False, "email"
+        if r.status_code == 200:
+            index.put("email", email_key, None)
+
+    return (yield from _create_contact(index, cust, rejected_contact_id)), True, "created"
+
 
-    create = requests.post(XERO_CONTACTS_URL, headers=headers, json=payload, timeout=30)
+def _resolve_from_mirror(index, mirror, cust, rejected_contact_id=None):
+    """
+    Same match priority against the local mirror (services/contact_mirror.py),
+    plus a unique digits-only phone match before giving up. On a miss, pulls
+    whatever changed in Xero since the last pull (one call) before creating —
+    or waits for the pull another process is running. Returns None when that
+    pull doesn't finish within CONTACT_MIRROR_MISS_WAIT (caller falls back to live queries).
+    """
+    square_id = getattr(cust, "id", "") or ""
+    email     = getattr(cust, "email_address", "") or ""
+    phone     = getattr(cust, "phone_number", "") or ""
+    account_number = square_id or None
+    legacy_account_number = f"SQ-{square_id}" if square_id else None
+
+    contact, kind = mirror.match(account_number, legacy_account_number, email, phone)
+    if contact is None:
+        try:
+            mirror.sync(max_age=CONTACT_MIRROR_MISS_MAX_AGE, wait=CONTACT_MIRROR_MISS_WAIT)
+        except MirrorBusy:
+            return None
+        contact, kind = mirror.match(account_number, legacy_account_number, email, phone)
+    if contact is None:
+        return (yield from _create_contact(index, cust, rejected_contact_id)), True, "created"
+
+    contact = dict(contact)
+    if kind != "account" and needs_account_number_backfill(contact, account_number, legacy_account_number):
+        yield from _backfill_account_number(contact, account_number)
+        mirror.put(contact)
+    index.put_contact(
+        contact,
+        square_id=square_id if contact.get("AccountNumber") == account_number else None,
+        email=email,
+    )
+    return contact, False, f"mirror_{kind}"
+
+
+def _create_contact(index, cust, rejected_contact_id=None):
+    """Create a Xero contact for a Square customer we couldn't match (Name is required; email when available)."""
+    payload = new_contact_payload(cust)
+    key = contact_idempotency_key(cust, rejected_contact_id)
+
+    create = yield ("post", XERO_CONTACTS_URL, {"json": payload, "headers": {"Idempotency-Key": key} if key else None})
     if create.status_code not in (200, 201):
         raise RuntimeError(f"Xero contact create failed: {create.status_code} {create.text}")
 
-    return create.json().get("Contacts", [None])[0], True
+    contact = create.json().get("Contacts", [None])[0]
+    # Index and mirror it, so the customer's next order resolves locally
+    index.put_contact(contact, square_id=getattr(cust, "id", "") or "", email=getattr(cust, "email_address", "") or "")
+    get_contact_mirror().put(contact)
+    return contact
 
-XERO_INVOICES_URL = "https://api.xero.com/api.xro/2.0/Invoices"
+XERO_INVOICES_URL = f"{BASE_URL}/Invoices"
 
-def create_xero_invoice(contact_id: str, items: list, square_order_id: str, reference: str | None = None):
+def build_xero_invoice(contact_id: str, items: list, square_order_id: str, reference: str | None = None, invoice_date: date | None = None):
     """
-    Create an invoice in Xero from Square order data.
-
-    Args:
-      contact_id: Xero ContactID to assign invoice to
-      items: list of dicts like:
-        {"description": str, "quantity": int, "unit_amount": float}
-      square_order_id: The Square order ID (used in invoice number)
-
-    Returns:
-      Xero API response JSON
+    The single-invoice dict create_xero_invoice sends (shared with the async pipeline).
+    invoice_date: issue / due date (the order's date); defaults to today.
     """
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        raise RuntimeError("Not connected to Xero. Run the OAuth connect flow first.")
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Xero-tenant-id": tenant_id,
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
-
     line_items = []
-    for it in items:
-        desc = it["description"].lower()
-        # Pick account code based on keywords
-        account_code = "200"
-        for keyword, code in XERO_ACCOUNT_CODES.items():
-            if keyword in desc:
-                account_code = code
-                break
+    # Catalog ID → category → keyword rules (services/account_rules.py)
+    account_codes = get_account_rules().map_many(items)
+    for it, account_code in zip(items, account_codes):
         li = {
             "Description": it["var_name"],
             "Quantity": int(it["quantity"]),
@@ -214,43 +361,98 @@ def create_xero_invoice(contact_id: str, items: list, square_order_id: str, refe
         }
         line_items.append(li)
 
-    today_str = date.today().isoformat()
-
-    payload = {
-        "Invoices": [{
-            "Type": "ACCREC",
-            "Contact": {"ContactID": contact_id},
-            "LineItems": line_items,
-            "InvoiceNumber": f"SQUARE - {square_order_id}",
-            "Date": today_str,      # Issue date
-            "DueDate": today_str,   # Same day due
-            "Status": "AUTHORISED", # currently SUBMITTED AUTHORISED
-            "LineAmountTypes": "Inclusive", # 👈 tax inclusive
-        }]
+    date_str = (invoice_date or date.today()).isoformat()
+
+    invoice = {
+        "Type": "ACCREC",
+        "Contact": {"ContactID": contact_id},
+        "LineItems": line_items,
+        "InvoiceNumber": f"SQUARE - {square_order_id}",
+        "Date": date_str,       # Issue date
+        "DueDate": date_str,    # Same day due
+        "Status": "AUTHORISED", # currently SUBMITTED AUTHORISED
+        "LineAmountTypes": "Inclusive", # 👈 tax inclusive
     }
     if reference:
-        payload["Invoices"][0]["Reference"] = reference
+        invoice["Reference"] = reference
+    return invoice
 
 
-    resp = requests.post(XERO_INVOICES_URL, headers=headers, json=payload, timeout=30)
-    if resp.status_code not in (200, 201):
-        raise RuntimeError(f"Xero invoice create failed: {resp.status_code} {resp.text}")
-    return resp.json()
+def create_xero_invoice(contact_id: str, items: list, square_order_id: str, reference: str | None = None, invoice_date: date | None = None):
+    """
+    Create an invoice in Xero from Square order data.
+
+    Args:
+      contact_id: Xero ContactID to assign invoice to
+      items: list of dicts like:
+        {"description": str, "quantity": int, "unit_amount": float}
+      square_order_id: The Square order ID (used in invoice number)
+      invoice_date: issue / due date (defaults to today)
+
+    Returns:
+      Xero API response JSON
+
+    Raises ContactRejected when Xero refuses the contact (archived / deleted).
+    """
+    invoice = build_xero_invoice(contact_id, items, square_order_id, reference, invoice_date)
+
+    with metrics.stage("invoice_create"):
+        if XERO_INVOICE_BATCH_WINDOW > 0:
+            # Shares one POST with whatever other orders are being invoiced right now
+            try:
+                created = get_invoice_batcher().submit(invoice).result()
+            except InvoiceValidationError as e:
+                raise_if_contact_rejected(e.messages, contact_id, e)
+                raise
+            data = {"Invoices": [created]}
+        else:
+            resp = get_xero_client().post(XERO_INVOICES_URL, json={"Invoices": [invoice]})
+            check_invoice_response(resp, contact_id)
+            data = resp.json()
+
+    for created in data.get("Invoices", [])[:1]:
+        sync_ledger.record_invoice(square_order_id, created)
+    return data
+
+
+def raise_if_contact_rejected(messages, contact_id, cause=None):
+    if rejects_contact(messages):
+        raise ContactRejected(f"Xero rejected contact {contact_id}: {messages}", contact_id) from cause
+
+
+def check_invoice_response(resp, contact_id):
+    """Raise for a failed single-invoice POST — ContactRejected when the contact was the problem."""
+    if resp.status_code in (200, 201):
+        return
+    if resp.status_code == 400:
+        raise_if_contact_rejected(_validation_messages(resp), contact_id)
+    raise RuntimeError(f"Xero invoice create failed: {resp.status_code} {resp.text}")
+
+
+_invoice_batchers = {}
+_invoice_batcher_lock = threading.Lock()
+
+
+def get_invoice_batcher(tenant_id=None):
+    """One batcher per tenant: a batch is a single POST, so it can only hold one tenant's invoices."""
+    tenant_id = tenant_id or tenants.current()
+    batcher = _invoice_batchers.get(tenant_id)
+    if batcher is None:
+        with _invoice_batcher_lock:
+            batcher = _invoice_batchers.get(tenant_id)
+            if batcher is None:
+                batcher = _invoice_batchers[tenant_id] = InvoiceBatcher(
+                    post=lambda payload, params: get_xero_client(tenant_id).post(XERO_INVOICES_URL, json=payload, params=params),
+                    window=XERO_INVOICE_BATCH_WINDOW,
+                    max_size=XERO_INVOICE_BATCH_MAX,
+                )
+    return batcher
 
 def update_xero_invoice_reference(invoice_id: str, reference: str):
     """
     Update an existing Xero invoice with a new reference string.
     """
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        raise RuntimeError("Not connected to Xero. Run the OAuth connect flow first.")
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Xero-tenant-id": tenant_id,
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-    }
+    xero = get_xero_client()
 
     payload = {
         "Invoices": [{
@@ -260,32 +462,35 @@ def update_xero_invoice_reference(invoice_id: str, reference: str):
     }
 
     # 👉 Use POST not PUT, and no /{invoice_id} in URL
-    resp = requests.post(XERO_INVOICES_URL, headers=headers, json=payload, timeout=30)
+    with metrics.stage("reference_update"):
+        resp = xero.post(XERO_INVOICES_URL, json=payload)
 
     if resp.status_code not in (200, 201):
         raise RuntimeError(f"Xero invoice update failed: {resp.status_code} {resp.text}")
 
+    sync_ledger.record_reference(invoice_id, reference)
     return resp.json()
 
 
 def get_xero_invoice_by_order_id(square_order_id: str):
-    access_token, tenant_id = get_valid_access_token()
-    if not access_token or not tenant_id:
-        raise RuntimeError("Not connected to Xero")
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Xero-tenant-id": tenant_id,
-        "Accept": "application/json",
-    }
+    """
+    Invoice for a Square order — from the local sync ledger when we created it,
+    otherwise looked up in Xero by InvoiceNumber (and then remembered).
+    """
+    entry = sync_ledger.get(square_order_id)
+    if entry and entry["invoice_id"]:
+        return sync_ledger.as_invoice(entry)
 
-    invoice_number = f"SQUARE - {square_order_id}"
-    url = f"{XERO_INVOICES_URL}?InvoiceNumbers={invoice_number}"
+    xero = get_xero_client()
 
-    resp = requests.get(url, headers=headers, timeout=30)
+    invoice_number = f"SQUARE - {square_order_id}"
+    resp = xero.get(XERO_INVOICES_URL, params={"InvoiceNumbers": invoice_number})
     if resp.status_code != 200:
         raise RuntimeError(f"Xero invoice lookup failed: {resp.status_code} {resp.text}")
 
     data = resp.json()
     invoices = data.get("Invoices", [])
-    return invoices[0] if invoices else None
+    if not invoices:
+        return None
+    sync_ledger.record_invoice(square_order_id, invoices[0])
+    return invoices[0]
@@ -0,0 +1,132 @@
+# utils/circuit_breaker.py
+import threading, time
+from utils.log import get_logger
+from config import BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT
+
+log = get_logger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker.
+
+    closed    – calls go through; BREAKER_FAILURE_THRESHOLD consecutive failures open it
+    open      – calls fail fast with CircuitOpenError for BREAKER_RESET_TIMEOUT seconds
+    half-open – one trial call is let through; success closes, failure re-opens
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def check(self):
+        """Raise CircuitOpenError if a call made now would be refused, without claiming the half-open trial."""
+        with self._lock:
+            state = self.state
+            if state == "closed" or (state == "half-open" and not self._trial_in_flight):
+                return
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def before_call(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial_in_flight:
+                    log.warning("circuit open", upstream=self.name, failures=self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The call ended without telling us anything about the upstream: let the next caller try."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _settle(self, verdict):
+        if verdict is None:
+            self.release_trial()
+        elif verdict:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def _settle_error(self, e, is_failure):
+        # Cancellation / interpreter exit aren't the upstream's doing
+        self._settle(is_failure(e) if isinstance(e, Exception) else None)
+
+    def call(self, fn, *args, is_failure=lambda e: True, bad_result=lambda r: False, **kwargs):
+        """
+        Run fn through the breaker. is_failure(e) decides whether an exception counts
+        against the upstream (True), for it (False, e.g. a 404 proves it's up) or
+        neither (None). bad_result(r) marks returned values that count as failures
+        (e.g. a 503 response). Every outcome settles the call, so a half-open trial
+        is never left in flight.
+        """
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self._settle_error(e, is_failure)
+            raise
+        self._settle(bad_result(result))
+        return result
+
+    async def call_async(self, fn, *args, is_failure=lambda e: True, bad_result=lambda r: False, **kwargs):
+        """call() for a coroutine function."""
+        self.before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self._settle_error(e, is_failure)
+            raise
+        self._settle(bad_result(result))
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """One shared breaker per upstream (host name)."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_states():
+    return {name: b.state for name, b in _breakers.items()}
@@ -1,24 +1,117 @@
 # utils/http.py
+import random, time
 import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from flask import jsonify
+from utils.circuit_breaker import get_breaker, CircuitOpenError
+from utils import metrics
+from config import HTTP_CONNECT_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_CAP
 
-def safe_get(url, headers=None, params=None, timeout=30):
-    """Wrapper for GET with basic error handling."""
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {500, 502, 503, 504}
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(HTTP_BACKOFF_CAP, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def upstream_error(e):
+    """Breaker verdict: transport failures count against the host; a bad URL or our own bug says nothing (None)."""
+    if isinstance(e, requests.RequestException) and not isinstance(e, ValueError):  # InvalidURL & co. are ValueErrors
+        return True
+    return None
+
+
+def retryable_response(response):
+    return response.status_code in RETRY_STATUSES
+
+
+class ResilientAdapter(HTTPAdapter):
+    """
+    Adds to every request:
+      - a per-host circuit breaker (fails fast with CircuitOpenError while the host is down)
+      - bounded retries with jittered backoff for idempotent methods on
+        connection errors, timeouts and 5xx — POSTs are never retried here
+      - a count of every attempt in outbound_calls_total (utils/metrics.py)
+    Subclasses hook in per-attempt behaviour by overriding _send_once().
+    Every attempt settles the breaker, whatever it raises.
+    """
+
+    def send(self, request, **kwargs):
+        breaker = get_breaker(urlparse(request.url).hostname)
+        retries = HTTP_MAX_RETRIES if request.method in IDEMPOTENT_METHODS else 0
+
+        for attempt in range(retries + 1):
+            try:
+                response = self._send_once(request, breaker, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+                response.close()
+            time.sleep(backoff_delay(attempt))
+
+    def _send_once(self, request, breaker, **kwargs):
+        """One attempt, through the host's breaker."""
+        return breaker.call(self._transmit, request, is_failure=upstream_error, bad_result=retryable_response, **kwargs)
+
+    def _transmit(self, request, **kwargs):
+        host = urlparse(request.url).hostname
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            metrics.record_call(host, "error")
+            raise
+        metrics.record_call(host, response.status_code)
+        return response
+
+
+def build_session(pool_connections=4, pool_maxsize=10, adapter_cls=ResilientAdapter):
+    """
+    Keep-alive Session with a sized connection pool.
+    pool_connections = hosts kept, pool_maxsize = sockets kept per host (≈ concurrent threads).
+    adapter_cls lets a caller add behaviour to every request (e.g. rate limiting).
+    """
+    session = requests.Session()
+    adapter = adapter_cls(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = build_session()
+
+
+def timeout_for(read_timeout):
+    """(connect, read) tuple so an unreachable host fails in seconds, not after the full read timeout."""
+    return (HTTP_CONNECT_TIMEOUT, read_timeout)
+
+
+def safe_get(url, headers=None, params=None, timeout=30, session=None):
+    """Wrapper for GET with basic error handling (retries + circuit breaker via the session's adapter)."""
     try:
-        resp = requests.get(url, headers=headers, params=params, timeout=timeout)
+        resp = (session or _session).get(url, headers=headers, params=params, timeout=timeout_for(timeout))
         if resp.status_code != 200:
             return None, jsonify({"error": resp.status_code, "body": resp.text}), 400
         return resp.json(), None, 200
+    except CircuitOpenError as e:
+        return None, jsonify({"error": "upstream_unavailable", "message": str(e)}), 503
     except requests.RequestException as e:
         return None, jsonify({"error": "request_failed", "message": str(e)}), 500
 
 
-def safe_post(url, headers=None, json=None, data=None, timeout=30):
-    """Wrapper for POST with basic error handling."""
+def safe_post(url, headers=None, json=None, data=None, timeout=30, session=None):
+    """Wrapper for POST with basic error handling (circuit breaker via the session's adapter)."""
     try:
-        resp = requests.post(url, headers=headers, json=json, data=data, timeout=timeout)
+        resp = (session or _session).post(url, headers=headers, json=json, data=data, timeout=timeout_for(timeout))
         if resp.status_code not in (200, 201):
             return None, jsonify({"error": resp.status_code, "body": resp.text}), 400
         return resp.json(), None, resp.status_code
+    except CircuitOpenError as e:
+        return None, jsonify({"error": "upstream_unavailable", "message": str(e)}), 503
     except requests.RequestException as e:
         return None, jsonify({"error": "request_failed", "message": str(e)}), 500
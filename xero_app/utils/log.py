@@ -0,0 +1,178 @@
+# utils/log.py
+"""
+Structured JSON logging for the webhook / sync path.
+
+    log = get_logger(__name__)
+    log.info("invoice created", invoice_id=inv_id, duration_ms=12.5)
+
+- Calls only put the record on a bounded in-memory queue; a background
+  listener thread formats it and writes one JSON line to stdout. If the queue
+  is full the record is dropped rather than blocking a request; drops are
+  counted in log_records_dropped_total (/metrics) and /square/queue-stats.
+- Log compact fields, never whole payloads. `with bind(event):` attaches
+  event_id / event_type / order_id to everything logged inside it.
+- Sampling: INFO and DEBUG records for an event type are kept at the rate in
+  LOG_SAMPLE_RATES (e.g. "payment.updated=0.1"). The decision is a hash of the
+  event_id, so an event is either logged on every stage and process or on none.
+  Warnings and errors are always kept.
+- PII (names, emails, phone numbers, addresses) is redacted in the listener.
+"""
+import contextvars, json, logging, logging.handlers, os, queue, re, sys, threading, time, zlib
+from contextlib import contextmanager
+from config import LOG_LEVEL, LOG_SAMPLE_RATES, LOG_QUEUE_SIZE
+
+PII_KEYS = {
+    "email_address", "phone_number", "given_name", "family_name", "company_name", "nickname",
+    "address", "birthday", "note", "buyer_email_address", "billing_address", "shipping_address",
+    "EmailAddress", "FirstName", "LastName", "Name", "Phones", "Addresses",
+}
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_PHONE = re.compile(r"(?<![\w-])\+?\d(?:[\s().-]?\d){8,14}(?![\w-])")  # 9–15 digits, not inside an ID
+# Our own identifiers / timestamps: never pattern-scrubbed
+_SAFE_KEYS = {"ts", "level", "logger", "event_id", "event_type", "order_id", "payment_id", "invoice_id", "contact_id", "stage"}
+_STD_KWARGS = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+_context = contextvars.ContextVar("log_context", default={})
+_lock = threading.Lock()
+_started_pid = None
+_queue = None
+dropped = 0  # records lost because the queue was full
+
+
+def _parse_rates(spec):
+    rates = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            event_type, rate = part.split("=", 1)
+            rates[event_type.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = _parse_rates(LOG_SAMPLE_RATES)
+
+
+def event_fields(event):
+    """The few fields worth logging for a Square webhook event."""
+    data = event.get("data") or {}
+    obj = data.get("object") or {}
+    order_id = (obj.get("order_created") or obj.get("order_updated") or {}).get("order_id")
+    payment = obj.get("payment") or {}
+    fields = {
+        "event_id": event.get("event_id"),
+        "event_type": event.get("type"),
+        "order_id": order_id or payment.get("order_id"),
+        "payment_id": payment.get("id"),
+    }
+    return {k: v for k, v in fields.items() if v}
+
+
+def sampled(event_type, event_id):
+    rate = SAMPLE_RATES.get(event_type, 1.0)
+    if rate >= 1.0:
+        return True
+    if not event_id:
+        return False
+    return zlib.crc32(event_id.encode()) % 10000 < rate * 10000
+
+
+@contextmanager
+def bind(event=None, **fields):
+    """Attach event fields (and any extras) to every record logged inside the block."""
+    ctx = {**_context.get(), **(event_fields(event) if event else {}), **fields}
+    token = _context.set(ctx)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            k: "[redacted]" if k in PII_KEYS else v if k in _SAFE_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        return _PHONE.sub("[phone]", _EMAIL.sub("[email]", value))
+    return value
+
+
+# --- handler plumbing ----------------------------------------------------------
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not on the request path
+        return record
+
+    def enqueue(self, record):
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+            from utils import metrics  # metrics logs through this module: import on first drop
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+class _ContextFilter(logging.Filter):
+    """Merges bound context into record.fields and applies per-event-type sampling."""
+
+    def filter(self, record):
+        fields = {**_context.get(), **getattr(record, "fields", {})}
+        if record.levelno < logging.WARNING and not sampled(fields.get("event_type"), fields.get("event_id")):
+            return False
+        record.fields = fields
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(redact(entry), default=str)
+
+
+def _start():
+    """One queue + listener thread per process (safe after fork)."""
+    global _started_pid, _queue
+    if _started_pid == os.getpid():
+        return
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _queue = queue.Queue(LOG_QUEUE_SIZE)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        logging.handlers.QueueListener(_queue, stream).start()  # daemon thread
+
+        handler = _DroppingQueueHandler(_queue)
+        handler.addFilter(_ContextFilter())
+        root = logging.getLogger("sync")
+        root.handlers[:] = [handler]
+        root.setLevel(LOG_LEVEL)
+        root.propagate = False
+        _started_pid = os.getpid()
+
+
+class StructLogger(logging.LoggerAdapter):
+    """logger.info("msg", key=value, ...) — keyword arguments become JSON fields."""
+
+    def process(self, msg, kwargs):
+        _start()
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _STD_KWARGS}
+        kwargs.setdefault("extra", {})["fields"] = fields
+        return msg, kwargs
+
+
+def get_logger(name):
+    _start()
+    return StructLogger(logging.getLogger(f"sync.{name}"), {})
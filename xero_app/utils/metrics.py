@@ -0,0 +1,121 @@
+# utils/metrics.py
+"""
+Prometheus metrics for the sync pipeline, served on /metrics.
+
+Under gunicorn every worker process writes its samples to
+PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and render() merges them,
+so the numbers cover the whole app, not just the worker that answered the scrape.
+
+  sync_stage_seconds{stage}               square_order_fetch, square_customer_fetch,
+                                          invoice_create, reference_update, token_refresh
+  sync_contact_resolution_seconds{tier}   which match tier resolved the contact
+  sync_event_seconds{type}                whole handler, per webhook event type
+  sync_event_outbound_calls{type}         outbound HTTP calls made while handling one event
+  outbound_calls_total{upstream,status}   every outbound attempt; status "error" = no response
+  webhook_requests_total{type,outcome}    POST /square-webhook results
+  xero_token_refresh_failures_total       background token refresher failures
+  sync_tender_reference_total{source}     "payment" = built from the webhook payload (a Square
+                                          order fetch saved), "order" = fell back to fetching the order
+  log_records_dropped_total               log records lost because the log queue was full (utils/log.py)
+"""
+import contextvars, os, time
+from contextlib import contextmanager
+import httpx
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+from utils.log import get_logger
+
+log = get_logger(__name__)
+
+_CALL_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
+
+STAGE_SECONDS = Histogram("sync_stage_seconds", "Time spent in one sync pipeline stage", ["stage"])
+CONTACT_SECONDS = Histogram(
+    "sync_contact_resolution_seconds", "Xero contact resolution time by the match tier that hit", ["tier"]
+)
+EVENT_SECONDS = Histogram("sync_event_seconds", "Time to handle one queued webhook event", ["type"])
+EVENT_CALLS = Histogram(
+    "sync_event_outbound_calls", "Outbound HTTP calls made while handling one event", ["type"], buckets=_CALL_BUCKETS,
+)
+OUTBOUND_CALLS = Counter("outbound_calls_total", "Outbound HTTP attempts by upstream and status", ["upstream", "status"])
+WEBHOOK_REQUESTS = Counter("webhook_requests_total", "Square webhook deliveries", ["type", "outcome"])
+TOKEN_REFRESH_FAILURES = Counter("xero_token_refresh_failures_total", "Failed background Xero token refreshes")
+TENDER_REFERENCES = Counter("sync_tender_reference_total", "Invoice tender references by where they were built from", ["source"])
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Calls made by the event currently being handled (None outside a handler)
+_event_calls = contextvars.ContextVar("event_calls", default=None)
+
+
+@contextmanager
+def stage(name):
+    """`with stage("invoice_create"):` — time one pipeline stage (histogram + a debug log line)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=name).observe(seconds)
+        log.debug("stage done", stage=name, duration_ms=round(seconds * 1000, 1))
+
+
+def observe_contact(tier, seconds):
+    CONTACT_SECONDS.labels(tier=tier).observe(seconds)
+
+
+def record_call(upstream, status):
+    """Count one outbound attempt (status code, or "error" when there was no response)."""
+    OUTBOUND_CALLS.labels(upstream=upstream or "unknown", status=str(status)).inc()
+    calls = _event_calls.get()
+    if calls is not None:
+        calls[0] += 1
+
+
+@contextmanager
+def track_event(event_type):
+    """Time an event's handler and attribute the outbound calls made inside it to that event."""
+    event_type = event_type or "unknown"
+    calls = [0]  # mutable, so calls made in to_thread / worker threads (copied contexts) still count
+    token = _event_calls.set(calls)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        EVENT_SECONDS.labels(type=event_type).observe(time.perf_counter() - started)
+        _event_calls.reset(token)
+        EVENT_CALLS.labels(type=event_type).observe(calls[0])
+
+
+def render():
+    """(body, content_type) for the /metrics endpoint, merged across processes when multiprocess."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# --- httpx transports for the Square SDK (it doesn't go through requests) ----
+
+class MeteredTransport(httpx.HTTPTransport):
+    def handle_request(self, request):
+        try:
+            response = super().handle_request(request)
+        except httpx.TransportError:
+            record_call(request.url.host, "error")
+            raise
+        record_call(request.url.host, response.status_code)
+        return response
+
+
+class AsyncMeteredTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request):
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.TransportError:
+            record_call(request.url.host, "error")
+            raise
+        record_call(request.url.host, response.status_code)
+        return response
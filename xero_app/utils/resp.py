@@ -0,0 +1,97 @@
+# utils/resp.py
+"""
+Minimal Redis-protocol (RESP2) client — just enough for the shared token
+store (GET / SET NX PX / DEL / WATCH / MULTI / EXEC).
+
+    r = RespClient("redis://:password@host:6379/0")
+    r.execute("SET", "key", "value", "NX", "PX", 5000)
+
+One socket per thread (WATCH/MULTI state is per connection), reconnected on
+the next call after a network error. Speaks to Redis, Valkey, KeyDB or any
+local stand-in (benchmarks/fakes.py FakeRedis, exercised by
+benchmarks/bench_token_store.py).
+"""
+import socket, threading
+from urllib.parse import urlparse
+
+
+class RespError(RuntimeError):
+    """Error reply from the server (-ERR ...)."""
+
+
+def encode(*args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+def read_reply(f):
+    line = f.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())  # returned, not raised: EXEC replies can contain errors
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        n = int(rest)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        return data[:-2]
+    if kind == b"*":
+        n = int(rest)
+        return None if n < 0 else [read_reply(f) for _ in range(n)]
+    raise ConnectionError(f"bad RESP reply: {line!r}")
+
+
+class RespClient:
+    def __init__(self, url, timeout=5.0):
+        u = urlparse(url)
+        self.host = u.hostname or "localhost"
+        self.port = u.port or 6379
+        self.password = u.password
+        self.db = int((u.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock, self._local.file = sock, sock.makefile("rb")
+        try:
+            if self.password:
+                self._call("AUTH", self.password)
+            if self.db:
+                self._call("SELECT", self.db)
+        except RespError:
+            self.close()
+            raise
+
+    def _call(self, *args):
+        self._local.sock.sendall(encode(*args))
+        reply = read_reply(self._local.file)
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            self._local.sock = self._local.file = None
+            sock.close()
+
+    def execute(self, *args):
+        try:
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            return self._call(*args)
+        except (OSError, ConnectionError):
+            self.close()  # next call reconnects
+            raise